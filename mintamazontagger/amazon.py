@@ -1,19 +1,26 @@
+import codecs
 from collections import defaultdict
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy, deepcopy
 import csv
-from datetime import datetime
+import functools
+import io
+import itertools
+import os
 from pprint import pformat
 import re
 import string
-import time
 
-from mintamazontagger.algorithm_u import algorithm_u
 from mintamazontagger import category
 from mintamazontagger.currency import micro_usd_nearly_equal
+from mintamazontagger.currency import micro_usd_to_cents
 from mintamazontagger.currency import micro_usd_to_usd_string
-from mintamazontagger.currency import parse_usd_as_micro_usd
+from mintamazontagger.currency import parse_usd_column
 from mintamazontagger.currency import CENT_MICRO_USD, MICRO_USD_EPS
+from mintamazontagger.dates import parse_date, parse_dates
 from mintamazontagger.mint import truncate_title
+from mintamazontagger.partition import SubsetPartitioner
+from mintamazontagger.partition import get_weighted_multiset
 
 PRINTABLE = set(string.printable)
 
@@ -61,61 +68,342 @@ RENAME_FIELD_NAMES = {
 }
 
 
-def is_empty_csv(csv_file_obj, key='Buyer Name'):
-    # Amazon likes to put "No data found for this time period" in the first
-    # row.
-    filename = csv_file_obj.name
-    return (sum([1 for r in csv.DictReader(
-        open(filename, encoding='utf-8'))]) <= 1 and
-            next(csv.DictReader(
-                open(filename, encoding='utf-8')))[key] is None)
+def open_csv_text(csv_file):
+    """Returns a text stream for csv_file, which may be any file-like object.
 
+    Binary streams (e.g. gzip.open(path) or sys.stdin.buffer) are decoded as
+    utf-8; text streams are returned as is.
+    """
+    if isinstance(csv_file, (io.RawIOBase, io.BufferedIOBase)):
+        return io.TextIOWrapper(csv_file, encoding='utf-8', newline='')
+    return csv_file
+
+
+def get_report_path(csv_file):
+    """Returns the on-disk path of csv_file, or None.
+
+    Only plain utf-8 text files on disk that have yet to be read (e.g.
+    open(path) or --items_csv) have a path, as the report is then re-read
+    from it in binary. Any other stream (e.g. stdin, a pipe, gzip.open(path,
+    'rt') or another encoding) is read as given.
+    """
+    if not isinstance(csv_file, io.TextIOWrapper):
+        return None
+    raw = getattr(csv_file.buffer, 'raw', None)
+    if not isinstance(raw, io.FileIO):
+        return None
+    path = raw.name
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return None
+    if codecs.lookup(csv_file.encoding).name != 'utf-8':
+        return None
+    try:
+        if csv_file.tell() != 0:
+            return None
+    except OSError:
+        return None
+    return os.path.abspath(path)
+
+
+def iter_csv_rows(binary_file, offset=0, end=None):
+    """Yields (byte offset, row) for the CSV rows of a binary stream.
+
+    The stream must be positioned at offset, the start of a row. Reading stops
+    at the first row starting at or past end (if given). Blank lines are
+    skipped.
+    """
+    line_end = offset
+
+    def iter_lines():
+        nonlocal line_end
+        for line in binary_file:
+            line_end += len(line)
+            yield line.decode('utf-8')
+
+    # The reader only pulls the lines of the row it returns, so line_end is
+    # where the next row starts.
+    row_start = offset
+    for row in csv.reader(iter_lines()):
+        if row:
+            yield row_start, row
+        row_start = line_end
+        if end is not None and row_start >= end:
+            return
 
-def parse_from_csv_common(cls, csv_file, progress):
-    if is_empty_csv(csv_file):
-        return []
 
-    reader = csv.DictReader(csv_file)
-    iter = progress.iter(reader) if progress else reader
-    result = [cls(raw_dict) for raw_dict in iter]
+def iter_report_file_rows(path):
+    with open(path, 'rb') as f:
+        yield from iter_csv_rows(f)
+
+
+class ReportSource:
+    """A report file, from which rows can be re-read by byte offset."""
+
+    def __init__(self, path, fieldnames):
+        self.path = path
+        self.fieldnames = fieldnames
+
+    def read_row(self, offset):
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for _, row in iter_csv_rows(f, offset):
+                return row
+        return None
+
+
+def read_csv_report(csv_file, key='Buyer Name'):
+    """Returns (fieldnames, rows, source) for an Amazon report, read once.
+
+    rows lazily yields (byte offset, row) pairs, each row as a list of strings
+    in fieldnames order. If csv_file is a file on disk, it is read by path and
+    source is its ReportSource; otherwise (e.g. stdin or an in-memory report)
+    source and all offsets are None.
+    Amazon likes to put "No data found for this time period" in the first row
+    of an empty report. That row only populates the first column, so it is
+    detected (by a missing `key`) and dropped while streaming, as are blank
+    lines.
+    """
+    path = get_report_path(csv_file)
+    if path:
+        offset_rows = iter_report_file_rows(path)
+    else:
+        offset_rows = (
+            (None, row) for row in csv.reader(open_csv_text(csv_file))
+            if row)
+    _, fieldnames = next(offset_rows, (None, []))
+    key_idx = fieldnames.index(key) if key in fieldnames else 0
+    source = ReportSource(path, tuple(fieldnames)) if path else None
+
+    def rows():
+        first_row = next(offset_rows, None)
+        if first_row is None:
+            return
+        if len(first_row[1]) > key_idx:
+            yield first_row
+        yield from offset_rows
+
+    return fieldnames, rows(), source
+
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# Rows converted at once (a column at a time) when parsing a report.
+CONVERSION_CHUNK_ROWS = 10000
+
+
+def iter_from_csv_common(cls, csv_file):
+    """Lazily yields a record per report row.
+
+    Rows are read and converted CONVERSION_CHUNK_ROWS at a time.
+    """
+    fieldnames, rows, source = read_csv_report(csv_file)
+    plan = get_row_conversion_plan(tuple(fieldnames), cls.FIELDS)
+    return itertools.chain.from_iterable(
+        cls.from_rows(plan, chunk, source)
+        for chunk in iter_chunks(rows, CONVERSION_CHUNK_ROWS))
+
+
+def parse_from_csv_common(cls, csv_file, progress):
+    records = iter_from_csv_common(cls, csv_file)
+    iter = progress.iter(records) if progress else records
+    result = list(iter)
     if progress:
         print()
     return result
 
 
-def pythonify_amazon_dict(raw_dict):
-    keys = set(raw_dict.keys())
+# Bytes of a report parsed per task when parsing in worker processes.
+PARSE_CHUNK_BYTES = 1 << 22
 
-    # Convert to microdollar ints
-    for ck in keys & CURRENCY_FIELD_NAMES:
-        raw_dict[ck] = parse_usd_as_micro_usd(raw_dict[ck])
 
-    # Convert to datetime.date
-    for dk in keys & DATE_FIELD_NAMES:
-        raw_dict[dk] = parse_amazon_date(raw_dict[dk])
+def get_row_ranges(path, start, chunk_bytes):
+    """Splits a report file, from start, into (start, end) byte ranges.
 
-    # Rename long or unpythonic names:
-    for old_key in keys & RENAME_FIELD_NAMES.keys():
-        new_key = RENAME_FIELD_NAMES[old_key]
-        raw_dict[new_key] = raw_dict[old_key]
-        del raw_dict[old_key]
+    Ranges are about chunk_bytes long and end at row boundaries: a newline
+    ends a row only outside of quotes, i.e. when it is preceded by an even
+    number of quotes (quotes within a quoted value are doubled). Only quotes
+    and newlines are scanned for; rows are not parsed.
+    """
+    ranges = []
+    with open(path, 'rb') as f:
+        f.seek(start)
+        num_quotes = 0
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            num_quotes += block.count(b'"')
+            if not block.endswith(b'\n'):
+                line = f.readline()
+                num_quotes += line.count(b'"')
+            while num_quotes % 2:
+                line = f.readline()
+                if not line:
+                    break
+                num_quotes += line.count(b'"')
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_report_range(cls, source, start, end):
+    """Parses the rows of a byte range of a report (in a worker)."""
+    plan = get_row_conversion_plan(source.fieldnames, cls.FIELDS)
+    with open(source.path, 'rb') as f:
+        f.seek(start)
+        return cls.from_rows(plan, list(iter_csv_rows(f, start, end)), source)
+
+
+def parse_from_csvs_concurrently(reports, max_workers=None, progress=None,
+                                 chunk_bytes=PARSE_CHUNK_BYTES):
+    """Parses several reports at once, using a pool of worker processes.
+
+    reports is a list of (cls, csv_file) pairs, e.g. (Item, items_csv). Every
+    report is split into byte ranges of rows (see get_row_ranges), so large
+    reports are spread across all workers too. Workers read their ranges from
+    the report files themselves; reports that are not files on disk (e.g.
+    stdin) are parsed in this process. Returns a list of records per report,
+    in order.
+
+    Only the split points are found here: parsing 100k items, this process
+    spends about 0.8s of CPU (mostly unpickling the records sent back by the
+    workers) where a plain parse takes about 2s.
+    """
+    results = [[] for _ in reports]
+    tasks = []
+    for report_idx, (cls, csv_file) in enumerate(reports):
+        fieldnames, rows, source = read_csv_report(csv_file)
+        if source is None:
+            plan = get_row_conversion_plan(tuple(fieldnames), cls.FIELDS)
+            results[report_idx] = cls.from_rows(plan, list(rows))
+            if progress:
+                progress.next(len(results[report_idx]))
+            continue
+        first_row = next(rows, None)
+        rows.close()
+        if first_row is None:
+            continue
+        tasks.extend(
+            (report_idx, cls, source, start, end)
+            for start, end in get_row_ranges(
+                source.path, first_row[0], chunk_bytes))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for (report_idx, _, _, _, _), records in zip(tasks, executor.map(
+                parse_report_range,
+                [cls for _, cls, _, _, _ in tasks],
+                [source for _, _, source, _, _ in tasks],
+                [start for _, _, _, start, _ in tasks],
+                [end for _, _, _, _, end in tasks])):
+            results[report_idx].extend(records)
+            if progress:
+                progress.next(len(records))
+    if progress:
+        print()
+    return results
+
+
+def to_attr_name(field_name):
+    """Converts a report column name into a pythonic attribute name."""
+    if field_name in RENAME_FIELD_NAMES:
+        return RENAME_FIELD_NAMES[field_name]
+    return field_name.lower().replace(' ', '_').replace('/', '_')
+
+
+def convert_each(convert):
+    """Returns a column converter that applies convert to each value."""
+    def convert_column(values):
+        return [convert(v) for v in values]
+    return convert_column
+
+
+def get_column_converter(field_name):
+    """Returns the converter for a whole report column, or None.
+
+    A column converter takes the list of a column's values (one per row) and
+    returns the list of converted values.
+    """
+    if field_name in CURRENCY_FIELD_NAMES:
+        # Convert to microdollar ints
+        return parse_usd_column
+    if field_name in DATE_FIELD_NAMES:
+        # Convert to datetime.date
+        return parse_amazon_dates
+    if field_name == 'Quantity':
+        return convert_each(int)
+    return None
+
+
+class RowConversionPlan:
+    """Per-column conversions for an Amazon report, compiled from its header.
+
+    Each column has a precomputed attribute name and an optional column
+    converter, so rows are converted a column at a time (one converter call
+    per column) without any per-row key munging. If `keep` is given, only
+    columns whose attribute name is in `keep` are converted; the rest are
+    skipped entirely.
+    """
+
+    def __init__(self, fieldnames, keep=None):
+        self.fieldnames = fieldnames
+        self.columns = []
+        for idx, field_name in enumerate(fieldnames):
+            attr = to_attr_name(field_name)
+            if keep is None or attr in keep:
+                self.columns.append(
+                    (idx, attr, get_column_converter(field_name)))
+
+    def pad(self, row):
+        """Pads a short row with None, just like csv.DictReader."""
+        missing = len(self.fieldnames) - len(row)
+        return list(row) + [None] * missing if missing > 0 else row
+
+    def convert_columns(self, rows):
+        """Converts rows (values in fieldnames order), a column at a time.
+
+        Returns a dict of attribute name -> list of converted values, in row
+        order.
+        """
+        rows = [self.pad(row) for row in rows]
+        columns = {}
+        for idx, attr, convert in self.columns:
+            values = [row[idx] for row in rows]
+            columns[attr] = convert(values) if convert else values
+        return columns
+
+    def convert_rows(self, rows):
+        """Converts rows into a list of fields dicts (see convert_columns)."""
+        columns = self.convert_columns(rows)
+        if not columns:
+            return [{} for _ in rows]
+        return [dict(zip(columns, values))
+                for values in zip(*columns.values())]
+
+    def convert(self, values):
+        """Converts a row (values in fieldnames order) into a fields dict."""
+        return self.convert_rows([values])[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_row_conversion_plan(fieldnames, keep=None):
+    """Returns the (shared) RowConversionPlan for a tuple of fieldnames."""
+    return RowConversionPlan(fieldnames, keep)
 
-    if 'Quantity' in keys:
-        raw_dict['Quantity'] = int(raw_dict['Quantity'])
 
-    return dict([
-        (k.lower().replace(' ', '_').replace('/', '_'), v)
-        for k, v in raw_dict.items()
-    ])
+def parse_amazon_date(date_str):
+    return parse_date(date_str)
 
 
-def parse_amazon_date(date_str):
-    if not date_str:
-        return None
-    try:
-        return datetime.strptime(date_str, '%m/%d/%Y').date()
-    except ValueError:
-        return datetime.strptime(date_str, '%m/%d/%y').date()
+def parse_amazon_dates(date_strs):
+    return parse_dates(date_strs)
 
 
 def get_invoice_url(order_id):
@@ -124,16 +412,105 @@ def get_invoice_url(order_id):
         'orderID={oid}'.format(oid=order_id))
 
 
-def associate_items_with_orders(all_orders, all_items, itemProgress=None):
-    items_by_oid = defaultdict(list)
-    for i in all_items:
-        items_by_oid[i.order_id].append(i)
-    orders_by_oid = defaultdict(list)
-    for o in all_orders:
-        orders_by_oid[o.order_id].append(o)
+def iter_associable_items(items):
+    """Yields the items that can be associated with orders, one at a time.
+
+    Items from cancelled orders, items that haven't shipped yet (which also
+    aren't charged) and items with zero quantity (it happens!) are dropped.
+
+    items can be any iterable, e.g. Item.iter_from_csv (as with
+    --streaming_association), in which case the dropped items are never
+    materialized.
+    """
+    for i in items:
+        if (i.is_cancelled() or i.order_status != 'Shipped' or
+                i.quantity <= 0):
+            continue
+        yield i
+
+
+def get_oldest_order_date(records):
+    """Returns the oldest order date of orders & refunds that can be matched.
+
+    Only records that can still be matched to Mint transactions count (see
+    is_matchable), unless there are none.
+    """
+    matchable = [r for r in records if r.is_matchable()]
+    return min([r.order_date for r in matchable or records])
+
+
+def group_by_order_id(amzn_objs):
+    """Returns a dict of order_id -> list of objects (orders, items, etc)."""
+    by_oid = defaultdict(list)
+    for o in amzn_objs:
+        by_oid[o.order_id].append(o)
+    return by_oid
+
+
+def item_quantity_subtotal(item, quantity):
+    """Returns the subtotal of `quantity` units of item."""
+    if quantity == item.quantity:
+        return item.item_subtotal
+    return item.purchase_price_per_unit * quantity
+
+
+def items_from_quantities(item_quantities):
+    """Materializes (item, quantity) pairs into a list of Items.
+
+    Pairs of the same item are combined. An item is used as is when all of
+    its units are included, otherwise a copy with the partial quantity is
+    made.
+    """
+    quantity_by_item = defaultdict(int)
+    for i, qty in item_quantities:
+        quantity_by_item[i] += qty
+    return [i if qty == i.quantity else i.with_quantity(qty)
+            for i, qty in quantity_by_item.items()]
+
+
+# Default upper bound on the number of search steps spent partitioning the
+# items of one order id amongst its shipments.
+DEFAULT_ASSOCIATION_BUDGET = 1000000
+
+# Number of order ids sent to a worker process at once.
+ASSOCIATION_CHUNK_SIZE = 64
+
+
+def associate_items_with_orders(all_orders, all_items, itemProgress=None,
+                                budget=DEFAULT_ASSOCIATION_BUDGET,
+                                max_workers=1, assignment_cache=None):
+    """Associates items with their orders (shipments).
+
+    Returns the order ids for which the search gave up, having used up its
+    (deterministic) budget of search steps.
+    """
+    return associate_items_with_orders_by_oid(
+        all_orders, group_by_order_id(all_items), itemProgress, budget,
+        max_workers, assignment_cache)
+
+
+def associate_items_with_orders_by_oid(all_orders, items_by_oid,
+                                       itemProgress=None,
+                                       budget=DEFAULT_ASSOCIATION_BUDGET,
+                                       max_workers=1, assignment_cache=None):
+    """Like associate_items_with_orders, with items already grouped by id.
+
+    itemProgress is advanced by the quantity of the associated items.
+
+    Order ids with a single shipment (or whose shipments are told apart by
+    tracking number) are associated inline. The remaining order ids need a
+    search to partition their items; with max_workers other than 1, these
+    are spread over a pool of worker processes (None for one per CPU).
+
+    If given, assignment_cache (an assignmentcache.AssignmentCache) replays
+    the searches of order ids whose items and shipments are unchanged.
+    """
+    gave_up = []
+    searches = []
+    orders_by_oid = group_by_order_id(all_orders)
 
     for oid, orders in orders_by_oid.items():
-        oid_items = items_by_oid[oid]
+        oid_items = items_by_oid.get(oid, [])
 
         if not micro_usd_nearly_equal(
                 Order.sum_subtotals(orders),
@@ -143,9 +520,9 @@ def associate_items_with_orders(all_orders, all_items, itemProgress=None):
             continue
 
         if len(orders) == 1:
-            orders[0].set_items(oid_items, assert_unmatched=True)
+            orders[0].set_items(oid_items)
             if itemProgress:
-                itemProgress.next(len(oid_items))
+                itemProgress.next(Item.sum_quantities(oid_items))
             continue
 
         # First try to divy up the items by tracking.
@@ -156,48 +533,162 @@ def associate_items_with_orders(all_orders, all_items, itemProgress=None):
         # It is never the case that multiple orders with the same order id will
         # have the same tracking number. Try using tracking number to split up
         # the items between the orders.
+        unfit_orders = []
         for order in orders:
             items = items_by_tracking[order.tracking]
-            if micro_usd_nearly_equal(
+            if items and micro_usd_nearly_equal(
                     Item.sum_subtotals(items),
                     order.subtotal):
                 # A perfect fit.
-                order.set_items(items, assert_unmatched=True)
+                order.set_items(items)
                 if itemProgress:
-                    itemProgress.next(len(items))
+                    itemProgress.next(Item.sum_quantities(items))
                 # Remove the selected items.
                 oid_items = [i for i in oid_items if i not in items]
-        # Remove orders that have items.
-        orders = [o for o in orders if not o.items]
+            else:
+                unfit_orders.append(order)
+        # Only the orders without a fit are left. (Orders may still have
+        # items from an earlier association; they are replaced.)
+        orders = unfit_orders
         if not orders and not oid_items:
             continue
-
-        orders = sorted(orders, key=lambda o: o.subtotal)
-
-        # Partition the remaining items into every possible arrangement and
-        # validate against the remaining orders.
-        # TODO: Make a custom algorithm with backtracking.
-
-        # The number of combinations are factorial, so limit the number of
-        # attempts (by a 1 sec timeout) before giving up.
-        start_time = time.time()
-        for item_groupings in algorithm_u(oid_items, len(orders)):
-            if time.time() - start_time > 1:
-                break
-            subtotals_with_groupings = sorted(
-                [(Item.sum_subtotals(itms), itms)
-                 for itms in item_groupings],
-                key=lambda g: g[0])
-            if all([micro_usd_nearly_equal(
-                    subtotals_with_groupings[i][0],
-                    orders[i].subtotal) for i in range(len(orders))]):
-                for idx, order in enumerate(orders):
-                    items = subtotals_with_groupings[idx][1]
-                    order.set_items(items,
-                                    assert_unmatched=True)
-                    if itemProgress:
-                        itemProgress.next(len(items))
-                break
+        searches.append((oid, oid_items, orders))
+
+    candidates = [get_partition_candidates(oid_items)
+                  for _, oid_items, _ in searches]
+    problems = [
+        (get_candidate_values(c), get_partition_targets(orders))
+        for c, (_, _, orders) in zip(candidates, searches)]
+    keys = [None] * len(searches)
+    solutions = [None] * len(searches)
+    if assignment_cache is not None:
+        for idx, ((oid, _, _), problem) in enumerate(zip(searches, problems)):
+            keys[idx] = assignment_cache.get_key(oid, *problem)
+            solutions[idx] = assignment_cache.get(keys[idx])
+    unsolved = [idx for idx, solution in enumerate(solutions)
+                if solution is None]
+    for idx, solution in zip(unsolved, solve_partitions(
+            [problems[idx] for idx in unsolved], budget, max_workers)):
+        solutions[idx] = solution
+        if assignment_cache is not None:
+            assignment_cache.put(keys[idx], solution)
+    results = [
+        get_groupings(c, orders, solution)
+        for c, (_, _, orders), solution in zip(
+            candidates, searches, solutions)]
+
+    for (oid, oid_items, orders), (groupings, exhausted) in zip(
+            searches, results):
+        if exhausted:
+            gave_up.append(oid)
+        if not groupings:
+            continue
+        for order, item_quantities in zip(orders, groupings):
+            items = items_from_quantities(item_quantities)
+            order.set_items(items)
+            if itemProgress:
+                itemProgress.next(Item.sum_quantities(items))
+        # Items split across several orders are associated via their
+        # partial-quantity copies.
+        for i in oid_items:
+            i.matched = True
+    return gave_up
+
+
+def solve_partitions(problems, budget, max_workers=1):
+    """Runs solve_partition for a list of (candidate values, targets).
+
+    With max_workers other than 1, the problems are spread over a pool of
+    worker processes (None for one per CPU). Only integer amounts are sent
+    to the workers. Returns the solutions, in order.
+    """
+    if max_workers == 1 or len(problems) < 2:
+        return [solve_partition(values, targets, budget)
+                for values, targets in problems]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(
+            solve_partition,
+            [values for values, _ in problems],
+            [targets for _, targets in problems],
+            itertools.repeat(budget),
+            chunksize=ASSOCIATION_CHUNK_SIZE))
+
+
+def get_partition_candidates(items):
+    """Returns the ways to divide items up to try, in order.
+
+    Each way is a list of ((item, quantity), count) lots: count
+    interchangeable lots of quantity units of item.
+    """
+    candidates = [[((i, i.quantity), 1) for i in items]]
+    if any(i.quantity > 1 for i in items):
+        candidates.append([((i, 1), i.quantity) for i in items])
+    return candidates
+
+
+def get_candidate_values(candidates):
+    """Returns, per candidate, (subtotal in cents, count) of every lot."""
+    return [[(micro_usd_to_cents(item_quantity_subtotal(i, qty)), count)
+             for (i, qty), count in lots]
+            for lots in candidates]
+
+
+def get_partition_targets(orders):
+    return [micro_usd_to_cents(o.subtotal) for o in orders]
+
+
+def solve_partition(candidate_values, targets, budget):
+    """Partitions the first possible candidate's lots into the targets.
+
+    The budget (of search steps) is shared by all candidates. Returns
+    (candidate index, per bin the count of each distinct value, exhausted);
+    the first two are None if no partition was found.
+    """
+    exhausted = False
+    for idx, value_counts in enumerate(candidate_values):
+        partitioner = SubsetPartitioner(targets, max_nodes=budget)
+        bin_counts = partitioner.solve_counts(
+            *get_weighted_multiset(value_counts))
+        budget -= partitioner.nodes
+        exhausted = exhausted or partitioner.exhausted
+        if bin_counts is not None:
+            return idx, bin_counts, False
+    return None, None, exhausted
+
+
+def get_groupings(candidates, orders, solution):
+    """Maps a solve_partition solution back to (groupings, exhausted).
+
+    The lots of each distinct subtotal are handed out to the orders in turn,
+    so the units of an item stay together as much as possible.
+    """
+    idx, bin_counts, exhausted = solution
+    if idx is None:
+        return None, exhausted
+    lots = candidates[idx]
+    value_counts = get_candidate_values([lots])[0]
+    distinct_values, _ = get_weighted_multiset(value_counts)
+    groupings = [[] for _ in orders]
+    lots_by_value = defaultdict(list)
+    for ((i, qty), count), (value, _) in zip(lots, value_counts):
+        if value == 0:
+            # Zero subtotal lots fit anywhere.
+            groupings[0].append((i, qty * count))
+        else:
+            lots_by_value[value].append([(i, qty), count])
+    for b, counts in enumerate(bin_counts):
+        for value, count in zip(distinct_values, counts):
+            value_lots = lots_by_value[value]
+            while count:
+                (i, qty), available = value_lots[0]
+                taken = min(count, available)
+                groupings[b].append((i, qty * taken))
+                count -= taken
+                if taken == available:
+                    value_lots.pop(0)
+                else:
+                    value_lots[0][1] -= taken
+    return groupings, exhausted
 
 
 ORDER_MERGE_FIELDS = {
@@ -210,20 +701,106 @@ ORDER_MERGE_FIELDS = {
 }
 
 
-class Order:
-    matched = False
-    items_matched = False
-    trans_id = None
-    items = []
-    is_debit = True
+class AmazonRecord:
+    """Base class for the compact records parsed from Amazon reports.
+
+    Only the columns named in FIELDS are converted and kept as (slotted)
+    attributes. The original row is not kept: records parsed from a report
+    file remember its source and byte offset instead, and raw_dict() re-reads
+    the row on demand.
+    """
+    __slots__ = ('raw_source', 'raw_offset')
+
+    FIELDS = ()
 
     def __init__(self, raw_dict):
-        self.__dict__.update(pythonify_amazon_dict(raw_dict))
+        plan = get_row_conversion_plan(tuple(raw_dict.keys()), self.FIELDS)
+        self.set_row(plan, list(raw_dict.values()))
+
+    @classmethod
+    def from_rows(cls, plan, offset_rows, source=None):
+        """Creates a record per (byte offset, row) pair, converted by plan.
+
+        source (a ReportSource) and the offsets locate the rows in their
+        report.
+        """
+        records = []
+        fields = plan.convert_rows([row for _, row in offset_rows])
+        for (offset, _), record_fields in zip(offset_rows, fields):
+            record = cls.__new__(cls)
+            record.raw_source = source
+            record.raw_offset = offset
+            record.set_fields(record_fields)
+            records.append(record)
+        return records
+
+    @classmethod
+    def from_fields(cls, fields):
+        """Creates a record from already pythonified report fields."""
+        record = cls.__new__(cls)
+        record.raw_source = None
+        record.raw_offset = None
+        record.set_fields(fields)
+        return record
+
+    def set_row(self, plan, row):
+        self.raw_source = None
+        self.raw_offset = None
+        self.set_fields(plan.convert(row))
+
+    def set_fields(self, fields):
+        for field in self.FIELDS:
+            setattr(self, field, fields.get(field))
+
+    def raw_dict(self):
+        """Returns the original report row (column name -> string), if any.
+
+        The row is re-read from the report file, which must be unchanged.
+        """
+        if self.raw_source is None:
+            return None
+        return dict(zip(
+            self.raw_source.fieldnames,
+            self.raw_source.read_row(self.raw_offset)))
+
+
+class Order(AmazonRecord):
+    FIELDS = (
+        'buyer_name',
+        'order_date',
+        'order_id',
+        'order_status',
+        'ordering_customer_email',
+        'payment_instrument_type',
+        'shipment_date',
+        'shipping_charge',
+        'subtotal',
+        'tax_before_promotions',
+        'tax_charged',
+        'total_charged',
+        'total_promotions',
+        'tracking',
+        'website',
+    )
+    __slots__ = FIELDS + ('matched', 'items_matched', 'trans_id', 'items')
+
+    is_debit = True
+
+    def set_fields(self, fields):
+        super().set_fields(fields)
+        self.matched = False
+        self.items_matched = False
+        self.trans_id = None
+        self.items = []
 
     @classmethod
     def parse_from_csv(cls, csv_file, progress=None):
         return parse_from_csv_common(cls, csv_file, progress)
 
+    @classmethod
+    def iter_from_csv(cls, csv_file):
+        return iter_from_csv_common(cls, csv_file)
+
     @staticmethod
     def sum_subtotals(orders):
         return sum([o.subtotal for o in orders])
@@ -244,16 +821,31 @@ class Order:
     def transact_amount(self):
         return self.total_charged
 
+    def is_paid_by_gift_card(self):
+        return 'Gift Certificate' in self.payment_instrument_type
+
+    def is_matchable(self):
+        """Whether this shipment can still be matched to a Mint charge.
+
+        It must have shipped (been charged), have its items associated and
+        not have been paid by gift card.
+        """
+        return bool(self.shipment_date and self.items and
+                    not self.is_paid_by_gift_card())
+
     def match(self, trans):
         self.matched = True
         self.trans_id = trans.id
 
-    def set_items(self, items, assert_unmatched=False):
+    def set_items(self, items):
+        """Associates items with this order (replacing any previous ones).
+
+        Items are not copied: associating the same items again (e.g. a retry)
+        simply re-associates them.
+        """
         self.items = items
         self.items_matched = True
         for i in items:
-            if assert_unmatched:
-                assert not i.matched
             i.matched = True
             i.order = self
 
@@ -291,6 +883,31 @@ class Order:
         self.items.append(adjustment)
         return True
 
+    def attribute_charge_diff_to_adjustment(self, amount):
+        """Adds an item for the difference between amount and the charge.
+
+        Transactions may match orders a few cents off (see
+        --match_amount_tolerance_cents), e.g. due to rounding. The order is
+        made to add up to the transaction amount.
+        """
+        diff = amount - self.total_charged
+        if abs(diff) < MICRO_USD_EPS:
+            return False
+
+        self.total_charged += diff
+        self.subtotal += diff
+
+        adjustment = deepcopy(self.items[0])
+        adjustment.title = 'Charge adjustment (rounding, etc)'
+        adjustment.category = 'Shopping'
+        adjustment.quantity = 1
+        adjustment.item_total = diff
+        adjustment.item_subtotal = diff
+        adjustment.item_subtotal_tax = 0
+
+        self.items.append(adjustment)
+        return True
+
     def attribute_itemized_diff_to_shipping_tax(self):
         # Shipping [sometimes] has tax. Include this in the shipping charge.
         # Unfortunately Amazon doesn't provide this anywhere; it must be
@@ -422,7 +1039,7 @@ class Order:
         result = deepcopy(orders[0])
         result.set_items(Item.merge([i for o in orders for i in o.items]))
         for key in ORDER_MERGE_FIELDS:
-            result.__dict__[key] = sum([o.__dict__[key] for o in orders])
+            setattr(result, key, sum([getattr(o, key) for o in orders]))
         return result
 
     def __repr__(self):
@@ -440,18 +1057,39 @@ class Order:
                 items=pformat(self.items)))
 
 
-class Item:
-    matched = False
-    order = None
-
-    def __init__(self, raw_dict):
-        self.__dict__.update(pythonify_amazon_dict(raw_dict))
-        self.__dict__['original_item_subtotal_tax'] = self.item_subtotal_tax
+class Item(AmazonRecord):
+    FIELDS = (
+        'asin_isbn',
+        'category',
+        'item_subtotal',
+        'item_subtotal_tax',
+        'item_total',
+        'order_date',
+        'order_id',
+        'order_status',
+        'purchase_price_per_unit',
+        'quantity',
+        'shipment_date',
+        'title',
+        'tracking',
+        'website',
+    )
+    __slots__ = FIELDS + ('original_item_subtotal_tax', 'matched', 'order')
+
+    def set_fields(self, fields):
+        super().set_fields(fields)
+        self.original_item_subtotal_tax = self.item_subtotal_tax
+        self.matched = False
+        self.order = None
 
     @classmethod
     def parse_from_csv(cls, csv_file, progress=None):
         return parse_from_csv_common(cls, csv_file, progress)
 
+    @classmethod
+    def iter_from_csv(cls, csv_file):
+        return iter_from_csv_common(cls, csv_file)
+
     @staticmethod
     def sum_subtotals(items):
         return sum([i.item_subtotal for i in items])
@@ -464,6 +1102,10 @@ class Item:
     def sum_subtotals_tax(items):
         return sum([i.item_subtotal_tax for i in items])
 
+    @staticmethod
+    def sum_quantities(items):
+        return sum([i.quantity for i in items])
+
     def get_title(self, target_length=100):
         return get_title(self, target_length)
 
@@ -486,13 +1128,11 @@ class Item:
         self.item_total = self.item_subtotal + self.item_subtotal_tax
         self.quantity = new_quantity
 
-    def split_by_quantity(self):
-        """Splits this item into 'quantity' items."""
-        if self.quantity == 1:
-            return [self]
-        orig_qty = self.quantity
-        self.set_quantity(1)
-        return [deepcopy(self) for i in range(orig_qty)]
+    def with_quantity(self, quantity):
+        """Returns a copy of this item with 'quantity' units (& prices)."""
+        item = copy(self)
+        item.set_quantity(quantity)
+        return item
 
     @classmethod
     def merge(cls, items):
@@ -529,17 +1169,32 @@ class Item:
                 desc=self.title))
 
 
-class Refund:
-    matched = False
-    trans_id = None
+class Refund(AmazonRecord):
+    FIELDS = (
+        'asin_isbn',
+        'buyer_name',
+        'category',
+        'order_date',
+        'order_id',
+        'quantity',
+        'refund_amount',
+        'refund_date',
+        'refund_reason',
+        'refund_tax_amount',
+        'title',
+        'website',
+    )
+    __slots__ = FIELDS + ('total_refund_amount', 'matched', 'trans_id')
+
     is_debit = False
 
-    def __init__(self, raw_dict):
+    def set_fields(self, fields):
+        super().set_fields(fields)
         # Refunds are rad: AMZN doesn't total the tax + sub-total for you.
-        fields = pythonify_amazon_dict(raw_dict)
-        fields['total_refund_amount'] = (
-            fields['refund_amount'] + fields['refund_tax_amount'])
-        self.__dict__.update(fields)
+        self.total_refund_amount = (
+            self.refund_amount + self.refund_tax_amount)
+        self.matched = False
+        self.trans_id = None
 
     @staticmethod
     def sum_total_refunds(refunds):
@@ -549,6 +1204,10 @@ class Refund:
     def parse_from_csv(cls, csv_file, progress=None):
         return parse_from_csv_common(cls, csv_file, progress)
 
+    @classmethod
+    def iter_from_csv(cls, csv_file):
+        return iter_from_csv_common(cls, csv_file)
+
     def match(self, trans):
         self.matched = True
         self.trans_id = trans.id
@@ -559,6 +1218,9 @@ class Refund:
     def transact_amount(self):
         return -self.total_refund_amount
 
+    def is_matchable(self):
+        return bool(self.refund_date)
+
     def get_title(self, target_length=100):
         return get_title(self, target_length)
 
@@ -588,6 +1250,21 @@ class Refund:
             is_debit=False)
         return result
 
+    @staticmethod
+    def attribute_refund_diff_to_tax(refunds, amount):
+        """Attributes the difference between amount and the refunds to tax.
+
+        Transactions may match refunds a few cents off (see
+        --match_amount_tolerance_cents), e.g. due to tax recomputation.
+        """
+        diff = -amount - Refund.sum_total_refunds(refunds)
+        if abs(diff) < MICRO_USD_EPS:
+            return False
+
+        refunds[0].refund_tax_amount += diff
+        refunds[0].total_refund_amount += diff
+        return True
+
     @staticmethod
     def merge(refunds):
         """Collapses identical items by using quantity."""
@@ -1,9 +1,16 @@
 from datetime import date
+import gzip
+import io
+import os
+import tempfile
 import unittest
 
 from mintamazontagger import amazon
 from mintamazontagger.amazon import Item, Order, Refund
 from mintamazontagger.mockdata import item, order, refund, transaction
+from mintamazontagger.mockdata import csv_file, csv_text
+from mintamazontagger.mockdata import item_dict, order_dict
+from mintamazontagger.mockdata import split_shipment
 
 
 class HelperMethods(unittest.TestCase):
@@ -25,6 +32,182 @@ class HelperMethods(unittest.TestCase):
             amazon.parse_amazon_date('1/23/1989'),
             date(1989, 1, 23))
 
+    def test_row_conversion_plan(self):
+        plan = amazon.get_row_conversion_plan((
+            'Order ID', 'Shipment Date', 'Item Total', 'Quantity',
+            'ASIN/ISBN', 'Carrier Name & Tracking Number'))
+
+        self.assertIs(plan, amazon.get_row_conversion_plan(plan.fieldnames))
+        self.assertEqual(
+            plan.convert(['1', '02/28/14', '$1.23', '3', 'B00', 'UPS(1Z)']),
+            {
+                'order_id': '1',
+                'shipment_date': date(2014, 2, 28),
+                'item_total': 1230000,
+                'quantity': 3,
+                'asin_isbn': 'B00',
+                'tracking': 'UPS(1Z)',
+            })
+
+    def test_parse_from_csv_in_memory(self):
+        orders = Order.parse_from_csv(csv_file([
+            order_dict(order_id='1'), order_dict(order_id='2')]))
+
+        self.assertEqual([o.order_id for o in orders], ['1', '2'])
+        self.assertEqual(orders[0].total_charged, 11950000)
+
+    def test_parse_from_csv_no_data_found(self):
+        header = ','.join(order_dict().keys())
+        no_data = header + '\nNo data found for this time period\n'
+
+        self.assertEqual(Order.parse_from_csv(io.StringIO(no_data)), [])
+        self.assertEqual(Order.parse_from_csv(io.StringIO(header)), [])
+
+    def test_parse_from_csv_blank_lines(self):
+        text = csv_text([item_dict(order_id='1'), item_dict(order_id='2')])
+        blank_lines = text.replace('\n', '\n\n', 1) + '\n'
+
+        items = Item.parse_from_csv(io.StringIO(blank_lines))
+
+        self.assertEqual([i.order_id for i in items], ['1', '2'])
+        self.assertEqual(items[1].quantity, 2)
+
+    def test_parse_from_csv_raw_dict(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'items.csv')
+            with open(report_path, 'w', newline='', encoding='utf-8') as f:
+                f.write(csv_text([
+                    item_dict(order_id='1', title='Two\nlines'),
+                    item_dict(order_id='2', title='Caf\u00e9')]))
+            with open(report_path, encoding='utf-8') as f:
+                items = Item.parse_from_csv(f)
+
+            self.assertEqual(
+                [i.title for i in items], ['Two\nlines', 'Caf\u00e9'])
+            self.assertEqual(items[0].raw_dict()['Title'], 'Two\nlines')
+            self.assertEqual(items[1].raw_dict()['Order ID'], '2')
+            self.assertEqual(items[1].raw_dict()['Title'], 'Caf\u00e9')
+            self.assertEqual(
+                items[1].raw_dict()['Shipping Address City'], 'SEATTLE')
+
+    def test_parse_from_csv_compressed_stream(self):
+        compressed = gzip.compress(csv_text([item_dict()]).encode('utf-8'))
+        with gzip.open(io.BytesIO(compressed)) as gzip_file:
+            items = Item.parse_from_csv(gzip_file)
+
+        self.assertEqual(len(items), 1)
+        self.assertEqual(items[0].title, 'Duracell AAs')
+
+    def test_parse_from_csv_compressed_file(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'items.csv.gz')
+            with gzip.open(report_path, 'wt', encoding='utf-8') as f:
+                f.write(csv_text([item_dict(title='Café')]))
+            with gzip.open(report_path, 'rt', encoding='utf-8') as f:
+                self.assertIsNone(amazon.get_report_path(f))
+                items = Item.parse_from_csv(f)
+
+        self.assertEqual([i.title for i in items], ['Café'])
+
+    def test_parse_from_csv_other_encoding(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'items.csv')
+            with open(report_path, 'w', newline='', encoding='latin-1') as f:
+                f.write(csv_text([item_dict(title='Café')]))
+            with open(report_path, encoding='latin-1') as f:
+                self.assertIsNone(amazon.get_report_path(f))
+                items = Item.parse_from_csv(f)
+
+        self.assertEqual([i.title for i in items], ['Café'])
+
+    def test_get_report_path(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'items.csv')
+            with open(report_path, 'w', encoding='utf-8') as f:
+                f.write(csv_text([item_dict()]))
+            with open(report_path, encoding='utf-8') as f:
+                self.assertEqual(amazon.get_report_path(f), report_path)
+                f.readline()
+                # Already partly read: the stream position is kept.
+                self.assertIsNone(amazon.get_report_path(f))
+            with open(report_path, 'rb') as f:
+                self.assertIsNone(amazon.get_report_path(f))
+        self.assertIsNone(amazon.get_report_path(io.StringIO('')))
+
+    def test_parse_from_csvs_concurrently(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            items_path = os.path.join(report_dir, 'items.csv')
+            with open(items_path, 'w', newline='', encoding='utf-8') as f:
+                f.write(csv_text([
+                    item_dict(order_id=str(i), title='Item\n"{}"'.format(i))
+                    for i in range(5)]))
+            with open(items_path, encoding='utf-8') as items_csv:
+                orders, items = amazon.parse_from_csvs_concurrently(
+                    [(Order, csv_file([order_dict(order_id='1')])),
+                     (Item, items_csv)],
+                    max_workers=2,
+                    chunk_bytes=10)
+
+            self.assertEqual([o.order_id for o in orders], ['1'])
+            self.assertEqual(
+                [i.order_id for i in items], ['0', '1', '2', '3', '4'])
+            self.assertEqual(items[4].title, 'Item\n"4"')
+            self.assertEqual(items[0].item_total, 11950000)
+            self.assertEqual(items[4].raw_dict()['Title'], 'Item\n"4"')
+
+    def test_get_row_ranges(self):
+        with tempfile.TemporaryDirectory() as report_dir:
+            report_path = os.path.join(report_dir, 'report.csv')
+            with open(report_path, 'wb') as f:
+                f.write(b'a,b\r\n1,"x\r\ny"\r\n2,""""\r\n3,z\r\n')
+
+            self.assertEqual(
+                amazon.get_row_ranges(report_path, 5, 4),
+                [(5, 15), (15, 23), (23, 28)])
+            self.assertEqual(
+                amazon.get_row_ranges(report_path, 5, 100), [(5, 28)])
+
+    def test_iter_associable_items(self):
+        i1 = item(order_id='1')
+        i2 = item(order_id='2', order_status='Cancelled')
+        i3 = item(order_id='3', order_status='Not yet shipped')
+        i4 = item(order_id='4', quantity=0)
+        i5 = item(order_id='5', quantity=1)
+
+        items = amazon.iter_associable_items(iter([i1, i2, i3, i4, i5]))
+
+        self.assertEqual([i.order_id for i in items], ['1', '5'])
+
+    def test_iter_from_csv(self):
+        items = Item.iter_from_csv(csv_file([
+            item_dict(order_id='1'), item_dict(order_id='2')]))
+
+        self.assertEqual(next(items).order_id, '1')
+        self.assertEqual(next(items).order_id, '2')
+        self.assertIsNone(next(items, None))
+
+    def test_get_oldest_order_date(self):
+        unshipped = order(
+            order_id='1', order_date='01/01/10', shipment_date='')
+        unshipped.set_items([item(order_id='1')])
+        without_items = order(order_id='2', order_date='01/01/11')
+        gift_card = order(order_id='3', order_date='01/01/12',
+                          payment_type='Gift Certificate/Card')
+        gift_card.set_items([item(order_id='3')])
+        o4 = order(order_id='4', order_date='01/01/13')
+        o4.set_items([item(order_id='4')])
+        r = refund(order_date='01/01/14')
+
+        # None of the older orders can ever be matched.
+        self.assertEqual(
+            amazon.get_oldest_order_date(
+                [unshipped, without_items, gift_card, o4, r]),
+            date(2013, 1, 1))
+        self.assertEqual(
+            amazon.get_oldest_order_date([unshipped, r]), date(2014, 1, 1))
+        self.assertEqual(
+            amazon.get_oldest_order_date([unshipped]), date(2010, 1, 1))
+
     def test_associate_items_with_orders_none_match(self):
         i1 = item(order_id='1', item_subtotal='$100.00')
         i2 = item(order_id='2')
@@ -127,6 +310,117 @@ class HelperMethods(unittest.TestCase):
         self.assertTrue(o3.items_matched)
         self.assertEqual(len(o3.items), 7)
 
+    def test_associate_items_with_orders_splits_quantities(self):
+        (o1, o2), (i1, i2) = split_shipment()
+
+        amazon.associate_items_with_orders([o1, o2], [i1, i2])
+
+        self.assertTrue(o1.items_matched)
+        self.assertEqual(
+            sorted([(i.quantity, i.item_subtotal) for i in o1.items]),
+            [(1, 1000000), (1, 5450000)])
+        self.assertTrue(o2.items_matched)
+        self.assertEqual(
+            [(i.quantity, i.item_subtotal) for i in o2.items],
+            [(2, 10900000)])
+        self.assertTrue(i1.matched)
+        self.assertEqual(i1.quantity, 3)
+
+    def test_associate_items_with_orders_negative_line_item(self):
+        # A promotion line (negative subtotal) shipped with the first item.
+        i1 = item(order_id='A', item_subtotal='$10.00', tracking='C')
+        i2 = item(order_id='A', item_subtotal='$5.00', tracking='C')
+        promo = item(order_id='A', item_subtotal='-$2.00', tracking='C')
+        o1 = order(order_id='A', subtotal='$8.00', tracking='A')
+        o2 = order(order_id='A', subtotal='$5.00', tracking='B')
+
+        amazon.associate_items_with_orders([o1, o2], [i1, i2, promo])
+
+        self.assertTrue(o1.items_matched)
+        self.assertEqual(
+            sorted([i.item_subtotal for i in o1.items]),
+            [-2000000, 10000000])
+        self.assertTrue(o2.items_matched)
+        self.assertEqual([i.item_subtotal for i in o2.items], [5000000])
+
+    def test_associate_items_with_orders_twice(self):
+        # E.g. a retry: the same records are associated again.
+        i1 = item(order_id='A', item_subtotal='$20.21', tracking='A')
+        i2 = item(order_id='A', item_subtotal='$0.41', tracking='B')
+        i3 = item(order_id='B', item_subtotal='$2.00', tracking='C')
+        i4 = item(order_id='B', item_subtotal='$2.00', tracking='C')
+        o1 = order(order_id='A', subtotal='$20.21', tracking='A')
+        o2 = order(order_id='A', subtotal='$0.41', tracking='B')
+        o3 = order(order_id='B', subtotal='$2.00', tracking='D')
+        o4 = order(order_id='B', subtotal='$2.00', tracking='E')
+        orders = [o1, o2, o3, o4]
+        items = [i1, i2, i3, i4]
+
+        amazon.associate_items_with_orders(orders, items)
+        amazon.associate_items_with_orders(orders, items)
+
+        self.assertEqual(o1.items, [i1])
+        self.assertEqual(o2.items, [i2])
+        self.assertEqual(len(o3.items), 1)
+        self.assertEqual(len(o4.items), 1)
+        self.assertTrue(all(i.matched for i in items))
+
+    def test_associate_items_with_orders_concurrently(self):
+        def make_orders_and_items():
+            orders = []
+            items = []
+            for oid in ['A', 'B', 'C']:
+                oid_orders, oid_items = split_shipment(oid)
+                orders.extend(oid_orders)
+                items.extend(oid_items)
+            # A single shipment order, which is associated inline.
+            items.append(item(order_id='D'))
+            orders.append(order(order_id='D'))
+            return orders, items
+
+        orders, items = make_orders_and_items()
+        amazon.associate_items_with_orders(orders, items)
+        expected = [sorted([(i.quantity, i.item_subtotal) for i in o.items])
+                    for o in orders]
+
+        orders, items = make_orders_and_items()
+        self.assertEqual(
+            amazon.associate_items_with_orders(orders, items, max_workers=2),
+            [])
+        self.assertEqual(
+            [sorted([(i.quantity, i.item_subtotal) for i in o.items])
+             for o in orders],
+            expected)
+        self.assertTrue(all(o.items_matched for o in orders))
+        self.assertTrue(all(i.matched for i in items))
+        for o in orders:
+            for i in o.items:
+                self.assertEqual(i.order, o)
+
+    def test_associate_items_with_orders_gives_up_deterministically(self):
+        # Two packages of 12 distinct items: partitioning them takes more
+        # than a handful of search steps.
+        def make_orders_and_items():
+            items = [
+                item(order_id='A', quantity=1, tracking='C',
+                     item_subtotal='${}.00'.format(2 * (n + 1)))
+                for n in range(12)]
+            orders = [order(order_id='A', subtotal='$78.00', tracking='A'),
+                      order(order_id='A', subtotal='$78.00', tracking='B')]
+            return orders, items
+
+        orders, items = make_orders_and_items()
+        self.assertEqual(
+            amazon.associate_items_with_orders(orders, items, budget=3),
+            ['A'])
+        self.assertFalse(orders[0].items_matched)
+
+        orders, items = make_orders_and_items()
+        self.assertEqual(
+            amazon.associate_items_with_orders(orders, items), [])
+        self.assertTrue(orders[0].items_matched)
+        self.assertTrue(orders[1].items_matched)
+
 
 class OrderClass(unittest.TestCase):
     def test_constructor(self):
@@ -150,6 +444,13 @@ class OrderClass(unittest.TestCase):
         # Tracking is renamed:
         self.assertEqual(o.tracking, 'AMZN(ABC123)')
 
+        # Unused columns are not kept (nor is the row, without a report).
+        self.assertFalse(hasattr(o, '__dict__'))
+        self.assertFalse(hasattr(o, 'shipping_address_city'))
+        self.assertIsNone(o.raw_dict())
+        self.assertEqual(o.items, [])
+        self.assertIsNot(o.items, order().items)
+
     def test_sum_subtotals(self):
         self.assertEqual(Order.sum_subtotals([]), 0)
 
@@ -353,6 +654,17 @@ class OrderClass(unittest.TestCase):
         self.assertEqual(i.item_subtotal, 9000000)
         self.assertEqual(i.item_subtotal_tax, 1000000)
 
+    def test_attribute_charge_diff_to_adjustment(self):
+        o = order()
+        o.set_items([item()])
+        self.assertFalse(o.attribute_charge_diff_to_adjustment(11950000))
+
+        self.assertTrue(o.attribute_charge_diff_to_adjustment(11960000))
+        self.assertEqual(o.total_charged, 11960000)
+        self.assertEqual(o.total_by_subtotals(), 11960000)
+        self.assertEqual(o.total_by_items(), 11960000)
+        self.assertEqual(o.items[-1].item_total, 10000)
+
     def test_to_mint_transactions_free_shipping(self):
         orig_trans = transaction(amount='$20.00')
 
@@ -539,16 +851,16 @@ class ItemClass(unittest.TestCase):
         self.assertEqual(i.item_subtotal_tax, 525000)
         self.assertEqual(i.item_total, 5975000)
 
-    def test_split_by_quantity(self):
+    def test_with_quantity(self):
         i = item()
-        items = i.split_by_quantity()
+        i1 = i.with_quantity(1)
 
-        self.assertEqual(len(items), 2)
-        for it in items:
-            self.assertEqual(it.quantity, 1)
-            self.assertEqual(it.item_subtotal, 5450000)
-            self.assertEqual(it.item_subtotal_tax, 525000)
-            self.assertEqual(it.item_total, 5975000)
+        self.assertIsNot(i1, i)
+        self.assertEqual(i1.quantity, 1)
+        self.assertEqual(i1.item_subtotal, 5450000)
+        self.assertEqual(i1.item_total, 5975000)
+        self.assertEqual(i.quantity, 2)
+        self.assertEqual(i.item_total, 11950000)
 
     def test_merge(self):
         i1 = item()
@@ -629,6 +941,16 @@ class RefundClass(unittest.TestCase):
         self.assertTrue('Refund date: 2014-03-16' in r.get_note())
         self.assertTrue('Refund reason: Customer Return' in r.get_note())
 
+    def test_attribute_refund_diff_to_tax(self):
+        r = refund()
+        self.assertFalse(
+            amazon.Refund.attribute_refund_diff_to_tax([r], -11950000))
+
+        self.assertTrue(
+            amazon.Refund.attribute_refund_diff_to_tax([r], -11940000))
+        self.assertEqual(r.total_refund_amount, 11940000)
+        self.assertEqual(r.refund_tax_amount, 1040000)
+
     def test_to_mint_transaction(self):
         r = refund(title='Duracell Procell AA 24 Pack')
         t = transaction(amount='$11.95', is_debit=False)
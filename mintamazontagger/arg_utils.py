@@ -48,6 +48,45 @@ def define_args(parser):
         help='The "Refunds" Order History Report from Amazon. '
              'This is optional.')
 
+    parser.add_argument(
+        '--report_cache_location', type=str,
+        default='AMZN Reports Cache',
+        help=('Where to cache the parsed Amazon reports. A report is only '
+              're-parsed when its file changes (size or modification time). '
+              'The items found in each shipment of orders that shipped in '
+              'several packages are cached here too.'))
+    parser.add_argument(
+        '--no_report_cache', action='store_true',
+        help=('Always re-parse the Amazon reports and re-associate their '
+              'items; do not use the cache.'))
+    parser.add_argument(
+        '--match_ledger_location', type=str,
+        default=None,
+        help=('If present, record the Mint transactions tagged (and the '
+              'Amazon orders and refunds they were tagged with) in this JSON '
+              'file. These are skipped by later runs given the same file, so '
+              'only new activity is matched; untagged orders and refunds '
+              'older than the newest tagged one do not widen the Mint '
+              'transactions fetched. The ledger is not used with '
+              '--retag_changed or --prompt_retag. Default: off (match all '
+              'transactions, orders and refunds every run).'))
+    parser.add_argument(
+        '--parse_workers', type=int,
+        default=1,
+        help=('Number of worker processes used to parse the Amazon reports. '
+              'The reports are parsed concurrently and large reports are '
+              'split into byte ranges of rows, each read by a worker. Only '
+              'helps with several CPUs. Use 0 for one worker per CPU. '
+              'Default: 1 (parse in this process).'))
+    parser.add_argument(
+        '--columnar_reports', action='store_true',
+        help=('Parse the Amazon reports column-wise and only create orders '
+              'and items for order ids whose item subtotals add up. Much '
+              'lighter on memory for very large order histories, but the '
+              'Amazon stats only reflect those orders/items. The reports are '
+              'parsed in this process (this conflicts with --parse_workers) '
+              'and are never read from or saved to the report cache.'))
+
     # Mint creds:
     parser.add_argument(
         '--mint_email', default=None,
@@ -178,6 +217,78 @@ def define_args(parser):
         help=('The max number of days after Amazon ship date that the Mint '
               'transaction can be dated. Default to "3" days, but "7" could be '
               'used if match rate is low.'))
+    parser.add_argument(
+        '--match_strategy', choices=['optimal', 'closest', 'sort_merge'],
+        default='optimal',
+        help=('How to match transactions to orders (and refunds) of the same '
+              'amount. "optimal" finds, per amount, the most matches with the '
+              'least total number of days between transactions and orders. '
+              '"closest" has each transaction (in turn) take the closest '
+              'unmatched order. "sort_merge" finds as many matches as '
+              '"optimal" in a single pass over transactions and orders '
+              'sorted by amount and date, though not necessarily the closest '
+              'ones; use it for very large histories. Default: optimal.'))
+    parser.add_argument(
+        '--match_amount_tolerance_cents', type=int,
+        default=0,
+        help=('Also match transactions whose amount is up to this many cents '
+              'off from the Amazon charge (or refund), e.g. due to rounding '
+              'or tax recomputation. Exact amounts are always preferred. The '
+              'difference is itemized as an adjustment. Default: 0.'))
+    parser.add_argument(
+        '--match_across_orders', action='store_true',
+        help=('Also match transactions to combinations of orders with '
+              'different order ids, shipped within --max_days_after_shipping '
+              'of the transaction (Amazon sometimes charges them together).'))
+    parser.add_argument(
+        '--cross_order_match_budget', type=int,
+        default=10000,
+        help=('The max number of search steps spent per transaction by '
+              '--match_across_orders. Default: 10000.'))
+    parser.add_argument(
+        '--match_workers', type=int,
+        default=1,
+        help=('Number of worker processes used to match transactions. '
+              'Debits are matched to orders and credits to refunds '
+              'concurrently, and transactions of different amounts in '
+              'parallel. Use 0 for one worker per CPU. Default: 1 (match '
+              'orders, then refunds, in this process).'))
+    parser.add_argument(
+        '--match_trace_file',
+        help=('If present, trace where matching spends its time: write, per '
+              'transaction, the candidate orders (and refunds) examined and '
+              'rejected (dated out of the window or already matched), per '
+              'order id, the combinations of shipments generated, and the '
+              'time spent per matching pass, to this CSV file. A summary is '
+              'logged with the processing stats.'))
+    parser.add_argument(
+        '--item_association_budget', type=int,
+        default=1000000,
+        help=('The max number of search steps spent associating the items of '
+              'one order with its shipments (when there are several). Order '
+              'ids that exceed this are reported as having given up. The '
+              'budget is deterministic: the same reports always give the same '
+              'result. Default: 1000000.'))
+    parser.add_argument(
+        '--association_workers', type=int,
+        default=1,
+        help=('Number of worker processes used to associate items with the '
+              'shipments of orders that shipped in several packages. Orders '
+              'with a single shipment are always handled in this process. Use '
+              '0 for one worker per CPU. Default: 1 (associate in this '
+              'process).'))
+    parser.add_argument(
+        '--streaming_association', action='store_true',
+        help=('Associate items with orders one order id at a time, after '
+              'sorting both reports by order id (spilling to temporary files '
+              'for very large reports), instead of grouping the whole '
+              'history in memory. The Orders and Items reports are streamed '
+              'straight from their files (without --parse_workers or the '
+              'report cache) and only the associated items are kept, so the '
+              'Amazon stats only reflect those. Memory is only bounded while '
+              'associating: all orders (and their items) are then kept for '
+              'matching. Ignores --association_workers; cannot be used with '
+              '--columnar_reports.'))
     parser.add_argument(
         '--do_not_predict_categories', action='store_true',
         help=('Do not attempt to predict custom category tagging based on any '
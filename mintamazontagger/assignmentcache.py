@@ -0,0 +1,87 @@
+"""On-disk memo of item-to-shipment assignments.
+
+Order ids that shipped in several packages need a search to tell which items
+went in which shipment. Historical orders never change, yet used to be
+searched again on every run. The solution of each search is memoized under a
+hash of the order id and the item and shipment amounts that went into it;
+an order id is only searched again if any of these change.
+"""
+
+import hashlib
+import logging
+import os
+
+from mintamazontagger.reportcache import dump_cached_report
+from mintamazontagger.reportcache import load_cached_report
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+# Bump whenever the memoized solution format changes.
+ASSIGNMENT_CACHE_VERSION = 1
+
+ASSIGNMENT_CACHE_NAME = 'Item assignments.pickle'
+
+
+class AssignmentCache:
+    """Memoized partition solutions (see amazon.solve_partition) by key.
+
+    Only the entries that are used (looked up or added) during a run are
+    saved, so orders that have aged out of the reports are dropped.
+    """
+
+    def __init__(self, solutions=None):
+        self.solutions = solutions or {}
+        self.used = {}
+        self.hits = 0
+
+    @staticmethod
+    def get_key(order_id, candidate_values, targets):
+        content = repr((order_id, candidate_values, targets))
+        return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Returns the memoized solution for key, or None."""
+        solution = self.solutions.get(key)
+        if solution is not None:
+            self.used[key] = solution
+            self.hits += 1
+        return solution
+
+    def put(self, key, solution):
+        _, _, exhausted = solution
+        # A search that ran out of budget may succeed with a larger one.
+        if exhausted:
+            return
+        self.solutions[key] = solution
+        self.used[key] = solution
+
+    def __len__(self):
+        return len(self.solutions)
+
+
+def get_assignment_cache_path(cache_base_path):
+    return os.path.join(cache_base_path, ASSIGNMENT_CACHE_NAME)
+
+
+def load_assignment_cache(cache_base_path):
+    """Returns the AssignmentCache saved in cache_base_path (or a new one)."""
+    if not cache_base_path:
+        return AssignmentCache()
+    solutions = load_cached_report(
+        get_assignment_cache_path(cache_base_path),
+        ASSIGNMENT_CACHE_VERSION)
+    if solutions:
+        logger.info('Loaded {} item assignments from the cache'.format(
+            len(solutions)))
+    return AssignmentCache(solutions)
+
+
+def save_assignment_cache(cache, cache_base_path):
+    if not cache_base_path:
+        return
+    dump_cached_report(
+        get_assignment_cache_path(cache_base_path),
+        ASSIGNMENT_CACHE_VERSION,
+        cache.used)
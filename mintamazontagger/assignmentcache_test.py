@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+from mintamazontagger import amazon
+from mintamazontagger import assignmentcache
+from mintamazontagger.mockdata import split_shipment
+
+
+def item_subtotals(orders):
+    return [sorted([(i.quantity, i.item_subtotal) for i in o.items])
+            for o in orders]
+
+
+class AssignmentCacheMethods(unittest.TestCase):
+    def test_replays_assignments(self):
+        cache = assignmentcache.AssignmentCache()
+        orders, items = split_shipment()
+        amazon.associate_items_with_orders(
+            orders, items, assignment_cache=cache)
+        expected = item_subtotals(orders)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.hits, 0)
+
+        orders, items = split_shipment()
+        # With no budget, the search itself would give up right away.
+        self.assertEqual(
+            amazon.associate_items_with_orders(
+                orders, items, budget=0, assignment_cache=cache),
+            [])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(item_subtotals(orders), expected)
+        self.assertTrue(all(o.items_matched for o in orders))
+
+    def test_changed_orders_are_searched_again(self):
+        cache = assignmentcache.AssignmentCache()
+        orders, items = split_shipment()
+        amazon.associate_items_with_orders(
+            orders, items, assignment_cache=cache)
+
+        orders, items = split_shipment()
+        items[1].item_subtotal = 2000000
+        orders[1].subtotal = 11900000
+        amazon.associate_items_with_orders(
+            orders, items, assignment_cache=cache)
+        self.assertEqual(cache.hits, 0)
+        self.assertEqual(len(cache), 2)
+
+    def test_does_not_memoize_exhausted_searches(self):
+        cache = assignmentcache.AssignmentCache()
+        orders, items = split_shipment()
+        self.assertEqual(
+            amazon.associate_items_with_orders(
+                orders, items, budget=0, assignment_cache=cache),
+            ['A'])
+        self.assertEqual(len(cache), 0)
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = assignmentcache.load_assignment_cache(cache_dir)
+            self.assertEqual(len(cache), 0)
+            orders, items = split_shipment()
+            amazon.associate_items_with_orders(
+                orders, items, assignment_cache=cache)
+            assignmentcache.save_assignment_cache(cache, cache_dir)
+            self.assertTrue(os.path.exists(
+                assignmentcache.get_assignment_cache_path(cache_dir)))
+
+            cache = assignmentcache.load_assignment_cache(cache_dir)
+            self.assertEqual(len(cache), 1)
+            # Unused entries are not saved again.
+            assignmentcache.save_assignment_cache(cache, cache_dir)
+            cache = assignmentcache.load_assignment_cache(cache_dir)
+            self.assertEqual(len(cache), 0)
+
+    def test_no_cache_location(self):
+        cache = assignmentcache.load_assignment_cache(None)
+        self.assertEqual(len(cache), 0)
+        assignmentcache.save_assignment_cache(cache, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+"""Files that are replaced whole, e.g. the report cache and match ledger."""
+
+from contextlib import contextmanager
+import os
+
+
+@contextmanager
+def open_atomic(path, mode='w'):
+    """Opens a file for (over)writing path, creating its directory if needed.
+
+    Writes go to a temporary file that is only renamed over path once fully
+    written, so an interrupted run never leaves a torn file behind.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, mode) as f:
+        yield f
+    os.replace(tmp_path, path)
@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+from mintamazontagger.atomicfile import open_atomic
+
+
+class AtomicFileMethods(unittest.TestCase):
+    def test_open_atomic(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'sub', 'file.txt')
+            with open_atomic(path) as f:
+                f.write('first')
+            with open_atomic(path) as f:
+                f.write('second')
+
+            with open(path) as f:
+                self.assertEqual(f.read(), 'second')
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['file.txt'])
+
+    def test_open_atomic_interrupted(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'file.txt')
+            with open_atomic(path) as f:
+                f.write('kept')
+
+            with self.assertRaises(KeyboardInterrupt):
+                with open_atomic(path) as f:
+                    f.write('torn')
+                    raise KeyboardInterrupt()
+
+            with open(path) as f:
+                self.assertEqual(f.read(), 'kept')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""Column-oriented (array backed) storage of Amazon reports.
+
+Instead of one object per row, each report column is held as a single array:
+amounts as int64 micro-USD, dates as ordinal days and strings (e.g. order ids)
+dictionary-encoded. Rows are converted in chunks, a column at a time, by the
+report's RowConversionPlan (just as when parsing records) and appended to the
+columns.
+
+This is only a storage format: association and matching still run over
+Order, Item and Refund objects. Those are created (as views) only for the
+order ids that materialize_for_association finds can be associated.
+"""
+
+from array import array
+from collections import defaultdict
+from datetime import date
+
+from mintamazontagger import amazon
+from mintamazontagger.currency import micro_usd_nearly_equal
+
+# Ordinal used for missing dates (e.g. orders that have not shipped yet).
+NO_DATE = 0
+
+
+class DateColumn:
+    """A date column, stored as ordinal days (NO_DATE if missing)."""
+
+    def __init__(self, ordinals=None):
+        self.ordinals = ordinals if ordinals is not None else array('l')
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def __getitem__(self, idx):
+        ordinal = self.ordinals[idx]
+        return date.fromordinal(ordinal) if ordinal != NO_DATE else None
+
+    def extend(self, dates):
+        self.ordinals.extend(d.toordinal() if d else NO_DATE for d in dates)
+
+
+class DictionaryColumn:
+    """A dictionary-encoded string column: distinct values + per-row codes."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = array('l')
+        self.codes_by_value = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, idx):
+        return self.values[self.codes[idx]]
+
+    def get_code(self, value):
+        """Returns the code of value, adding it if it is new."""
+        code = self.codes_by_value.get(value)
+        if code is None:
+            code = self.codes_by_value[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def extend(self, values):
+        self.codes.extend(self.get_code(v) for v in values)
+
+
+def new_column(field_name):
+    """Returns an empty column for a report column, based on its name."""
+    if (field_name in amazon.CURRENCY_FIELD_NAMES or
+            field_name == 'Quantity'):
+        # int64 (micro-USD for amounts).
+        return array('q')
+    if field_name in amazon.DATE_FIELD_NAMES:
+        return DateColumn()
+    return DictionaryColumn()
+
+
+class ColumnarReport:
+    """An Amazon report (Orders, Items or Refunds) stored column-wise.
+
+    record_cls is the amazon record type (Order, Item or Refund) whose FIELDS
+    determine which columns are kept and which type view() returns.
+    """
+
+    def __init__(self, record_cls, columns, num_rows):
+        self.record_cls = record_cls
+        self.columns = columns
+        self.num_rows = num_rows
+
+    @classmethod
+    def parse_from_csv(cls, record_cls, csv_file, progress=None):
+        """Parses a report, appending a chunk of rows at a time."""
+        fieldnames, rows, _ = amazon.read_csv_report(csv_file)
+        plan = amazon.get_row_conversion_plan(
+            tuple(fieldnames), record_cls.FIELDS)
+        columns = dict(
+            (attr, new_column(fieldnames[idx]))
+            for idx, attr, _ in plan.columns)
+        num_rows = 0
+        iter = progress.iter(rows) if progress else rows
+        for chunk in amazon.iter_chunks(iter, amazon.CONVERSION_CHUNK_ROWS):
+            converted = plan.convert_columns([row for _, row in chunk])
+            for attr, values in converted.items():
+                columns[attr].extend(values)
+            num_rows += len(chunk)
+        if progress:
+            print()
+        return cls(record_cls, columns, num_rows)
+
+    def __len__(self):
+        return self.num_rows
+
+    def column(self, attr):
+        return self.columns[attr]
+
+    def view(self, idx):
+        """Returns a record (e.g. an Order) for row idx."""
+        return self.record_cls.from_fields({
+            attr: column[idx]
+            for attr, column in self.columns.items()})
+
+    def views(self, idxs=None):
+        """Returns records for the given rows (all rows if idxs is None)."""
+        if idxs is None:
+            idxs = range(self.num_rows)
+        return [self.view(idx) for idx in idxs]
+
+    def rows_by_order_id(self, row_filter=None):
+        """Returns a dict of order_id -> list of row indexes."""
+        order_ids = self.columns['order_id']
+        rows_by_code = defaultdict(list)
+        for idx, code in enumerate(order_ids.codes):
+            if row_filter is None or row_filter(idx):
+                rows_by_code[code].append(idx)
+        return dict(
+            (order_ids.values[code], idxs)
+            for code, idxs in rows_by_code.items())
+
+    def sum_by_order_id(self, attr, rows_by_oid):
+        amounts = self.columns[attr]
+        return dict(
+            (oid, sum([amounts[idx] for idx in idxs]))
+            for oid, idxs in rows_by_oid.items())
+
+
+def is_chargeable_item_row(items_report):
+    """Returns a row filter for items that are shipped (and thus charged)."""
+    statuses = items_report.column('order_status')
+    quantities = items_report.column('quantity')
+    shipped_codes = set(
+        code for code, status in enumerate(statuses.values)
+        if status == 'Shipped')
+
+    def row_filter(idx):
+        return statuses.codes[idx] in shipped_codes and quantities[idx] > 0
+    return row_filter
+
+
+def materialize_for_association(orders_report, items_report):
+    """Returns (orders, items) records for order ids that can be associated.
+
+    associate_items_with_orders skips any order id whose shipped item
+    subtotals do not add up to its order subtotals. That check is done here
+    over the columns, so records are only created for the rows that can
+    actually be associated (and later matched to transactions).
+    """
+    order_rows = orders_report.rows_by_order_id()
+    item_rows = items_report.rows_by_order_id(
+        is_chargeable_item_row(items_report))
+    order_subtotals = orders_report.sum_by_order_id('subtotal', order_rows)
+    item_subtotals = items_report.sum_by_order_id('item_subtotal', item_rows)
+
+    balanced_oids = [
+        oid for oid, subtotal in order_subtotals.items()
+        if oid in item_subtotals and micro_usd_nearly_equal(
+            subtotal, item_subtotals[oid])]
+    orders = orders_report.views(
+        idx for oid in balanced_oids for idx in order_rows[oid])
+    items = items_report.views(
+        idx for oid in balanced_oids for idx in item_rows[oid])
+    return orders, items
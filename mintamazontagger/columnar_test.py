@@ -0,0 +1,60 @@
+from datetime import date
+import unittest
+
+from mintamazontagger.amazon import Item, Order
+from mintamazontagger.columnar import ColumnarReport
+from mintamazontagger.columnar import materialize_for_association
+from mintamazontagger.mockdata import csv_file, item_dict, order_dict
+
+
+class ColumnarReportClass(unittest.TestCase):
+    def test_parse_from_csv(self):
+        report = ColumnarReport.parse_from_csv(Order, csv_file([
+            order_dict(order_id='1', subtotal='$1.23'),
+            order_dict(order_id='2', shipment_date=''),
+            order_dict(order_id='1', subtotal='$4.56'),
+        ]))
+
+        self.assertEqual(len(report), 3)
+        self.assertEqual(
+            list(report.column('subtotal')), [1230000, 10900000, 4560000])
+        self.assertEqual(report.column('order_id').values, ['1', '2'])
+        self.assertEqual(list(report.column('order_id').codes), [0, 1, 0])
+        self.assertEqual(report.column('shipment_date')[0], date(2014, 2, 28))
+        self.assertIsNone(report.column('shipment_date')[1])
+        self.assertEqual(report.rows_by_order_id(), {'1': [0, 2], '2': [1]})
+
+    def test_view(self):
+        report = ColumnarReport.parse_from_csv(
+            Item, csv_file([item_dict()]))
+
+        i = report.view(0)
+
+        self.assertIsInstance(i, Item)
+        self.assertEqual(i.title, 'Duracell AAs')
+        self.assertEqual(i.quantity, 2)
+        self.assertEqual(i.item_total, 11950000)
+        self.assertEqual(i.shipment_date, date(2014, 2, 28))
+        self.assertFalse(i.matched)
+
+    def test_materialize_for_association(self):
+        orders_report = ColumnarReport.parse_from_csv(Order, csv_file([
+            order_dict(order_id='1'),
+            order_dict(order_id='2'),
+            order_dict(order_id='3', subtotal='$5.00'),
+        ]))
+        items_report = ColumnarReport.parse_from_csv(Item, csv_file([
+            item_dict(order_id='1'),
+            item_dict(order_id='2', order_status='Cancelled'),
+            item_dict(order_id='3'),
+        ]))
+
+        orders, items = materialize_for_association(
+            orders_report, items_report)
+
+        self.assertEqual([o.order_id for o in orders], ['1'])
+        self.assertEqual([i.order_id for i in items], ['1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
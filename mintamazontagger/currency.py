@@ -1,3 +1,5 @@
+import re
+
 # 50 Micro dollars we'll consider equal (this allows for some
 # division/multiplication rounding wiggle room).
 MICRO_USD_EPS = 50
@@ -18,6 +20,11 @@ def round_micro_usd_to_cent(micro_usd):
     return int(round_usd(micro_usd_to_usd_float(micro_usd)) * 1000000)
 
 
+def micro_usd_to_cents(micro_usd):
+    """Returns micro_usd as a whole number of cents (rounded)."""
+    return int(round(micro_usd / CENT_MICRO_USD))
+
+
 def micro_usd_to_usd_float(micro_usd):
     return round_usd(micro_usd / 1000000.0)
 
@@ -28,8 +35,43 @@ def micro_usd_to_usd_string(micro_usd):
         micro_usd_to_usd_float(abs(micro_usd)))
 
 
+# Optional sign, optional '$', dollars and (optional) fractional digits.
+USD_RE = re.compile(r'^\s*(-?)\s*\$?\s*(\d*)(?:\.(\d*))?\s*$')
+
+
 def parse_usd_as_micro_usd(amount):
-    return int(round_usd(parse_usd_as_float(amount)) * 1000000)
+    """Parses a USD amount string into micro-USD, rounded to the cent.
+
+    Plain decimal text (e.g. '-$1,234.56') is parsed exactly with integer
+    math. It is rounded the way parsing via a float always has been (see
+    round_usd): half a cent rounds up, towards positive infinity, so '$1.005'
+    is $1.01 but '-$1.005' is -$1.00. Anything else falls back to parsing via
+    a float.
+    """
+    if not amount:
+        return 0
+    # Remove any formatting/grouping commas.
+    match = USD_RE.match(amount.replace(',', ''))
+    if not match or not (match.group(2) or match.group(3)):
+        return int(round_usd(parse_usd_as_float(amount)) * 1000000)
+    negate, dollars, fraction = match.groups()
+    fraction = fraction or ''
+    scale = 10 ** len(fraction)
+    units = int(dollars or '0') * scale + int(fraction or '0')
+    if negate:
+        units = -units
+    # floor(dollars * 100 + 0.51): DOLLAR_EPS, then rounding half up.
+    cents = (units * 10000 + 51 * scale) // (100 * scale)
+    return cents * CENT_MICRO_USD
+
+
+def parse_usd_column(amounts):
+    """Parses a whole column of USD amount strings into micro-USD, in order.
+
+    Each distinct string is only parsed once.
+    """
+    parsed = dict((a, parse_usd_as_micro_usd(a)) for a in set(amounts))
+    return [parsed[a] for a in amounts]
 
 
 def parse_usd_as_float(amount):
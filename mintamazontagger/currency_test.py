@@ -30,6 +30,12 @@ class CurrencyMethods(unittest.TestCase):
         self.assertEqual(currency.round_micro_usd_to_cent(-550), 0)
         self.assertEqual(currency.round_micro_usd_to_cent(550), 0)
 
+    def test_micro_usd_to_cents(self):
+        self.assertEqual(currency.micro_usd_to_cents(50510000), 5051)
+        self.assertEqual(currency.micro_usd_to_cents(50509990), 5051)
+        self.assertEqual(currency.micro_usd_to_cents(-10000), -1)
+        self.assertEqual(currency.micro_usd_to_cents(40), 0)
+
     def test_micro_usd_to_usd_float(self):
         self.assertEqual(currency.micro_usd_to_usd_float(5050500), 5.05)
         self.assertEqual(currency.micro_usd_to_usd_float(150500), 0.15)
@@ -49,6 +55,28 @@ class CurrencyMethods(unittest.TestCase):
         self.assertEqual(currency.parse_usd_as_micro_usd('$55'), 55000000)
         self.assertEqual(currency.parse_usd_as_micro_usd('$12.23'), 12230000)
         self.assertEqual(currency.parse_usd_as_micro_usd('-$12.23'), -12230000)
+        self.assertEqual(currency.parse_usd_as_micro_usd(''), 0)
+        self.assertEqual(currency.parse_usd_as_micro_usd('.5'), 500000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('$0.07'), 70000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('$1.005'), 1010000)
+        # Half cents round up, as when parsing via a float.
+        self.assertEqual(currency.parse_usd_as_micro_usd('-$1.005'), -1000000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('-$1.006'), -1010000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('-$1.015'), -1010000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('-$0.004'), 0)
+        self.assertEqual(
+            currency.parse_usd_as_micro_usd('$1,234,567.89'),
+            1234567890000)
+        self.assertEqual(
+            currency.parse_usd_as_micro_usd('$92233720368.54'),
+            92233720368540000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('1e2'), 100000000)
+        self.assertEqual(currency.parse_usd_as_micro_usd('N/A'), 0)
+
+    def test_parse_usd_column(self):
+        self.assertEqual(
+            currency.parse_usd_column(['$1.23', '', '$1.23', '-$0.50']),
+            [1230000, 0, 1230000, -500000])
 
     def test_parse_usd_as_float(self):
         self.assertEqual(currency.parse_usd_as_float('$1.23'), 1.23)
@@ -0,0 +1,62 @@
+"""Shared, memoized date parsing for Amazon reports and Mint transactions.
+
+Date strings repeat heavily across rows, so each distinct string is only ever
+parsed once. The format is detected up front (no strptime attempts that fail
+by raising), and the "current year" used for Mint's short dates is computed
+once per run.
+"""
+
+from datetime import date
+import functools
+import re
+
+# 10/8/10 or 07/21/2010
+SLASH_DATE_RE = re.compile(r'^(\d{1,2})/(\d{1,2})/(\d{4}|\d{2})$')
+# Jan 10 (Mint omits the year for dates in the current year)
+MONTH_DAY_RE = re.compile(r'^([A-Za-z]{3}) (\d{1,2})$')
+
+MONTH_ABBREVIATIONS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12,
+}
+
+
+@functools.lru_cache(maxsize=None)
+def current_year():
+    """Returns the (ISO) year of today, computed once per run."""
+    return date.today().isocalendar()[0]
+
+
+def expand_two_digit_year(year):
+    # Same pivot as strptime's %y: 69-99 -> 1900s, 00-68 -> 2000s.
+    return year + (1900 if year >= 69 else 2000)
+
+
+@functools.lru_cache(maxsize=None)
+def parse_date(date_str):
+    """Parses 'M/D/YY', 'M/D/YYYY' or 'Mon D' into a datetime.date.
+
+    Returns None for an empty string. Raises ValueError if the format is not
+    recognized or the date is invalid.
+    """
+    if not date_str:
+        return None
+    match = SLASH_DATE_RE.match(date_str)
+    if match:
+        month, day, year = match.groups()
+        year = (int(year) if len(year) == 4
+                else expand_two_digit_year(int(year)))
+        return date(year, int(month), int(day))
+    match = MONTH_DAY_RE.match(date_str)
+    if match and match.group(1).lower() in MONTH_ABBREVIATIONS:
+        return date(
+            current_year(),
+            MONTH_ABBREVIATIONS[match.group(1).lower()],
+            int(match.group(2)))
+    raise ValueError('Unrecognized date: {}'.format(date_str))
+
+
+def parse_dates(date_strs):
+    """Parses a whole column of date strings, in order."""
+    parsed = dict((d, parse_date(d)) for d in set(date_strs))
+    return [parsed[d] for d in date_strs]
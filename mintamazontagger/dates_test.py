@@ -0,0 +1,40 @@
+from datetime import date
+import unittest
+
+from mintamazontagger import dates
+
+
+class DatesMethods(unittest.TestCase):
+    def test_parse_date_slashes(self):
+        self.assertEqual(dates.parse_date('10/8/10'), date(2010, 10, 8))
+        self.assertEqual(dates.parse_date('6/1/01'), date(2001, 6, 1))
+        self.assertEqual(dates.parse_date('6/1/99'), date(1999, 6, 1))
+        self.assertEqual(dates.parse_date('07/21/2010'), date(2010, 7, 21))
+        self.assertEqual(dates.parse_date('1/23/1989'), date(1989, 1, 23))
+
+    def test_parse_date_month_day(self):
+        self.assertEqual(
+            dates.parse_date('Oct 08'), date(dates.current_year(), 10, 8))
+        self.assertEqual(
+            dates.parse_date('jan 1'), date(dates.current_year(), 1, 1))
+
+    def test_parse_date_empty(self):
+        self.assertIsNone(dates.parse_date(''))
+        self.assertIsNone(dates.parse_date(None))
+
+    def test_parse_date_invalid(self):
+        with self.assertRaises(ValueError):
+            dates.parse_date('2010-10-08')
+        with self.assertRaises(ValueError):
+            dates.parse_date('Foo 08')
+        with self.assertRaises(ValueError):
+            dates.parse_date('2/30/20')
+
+    def test_parse_dates(self):
+        self.assertEqual(
+            dates.parse_dates(['1/2/20', '', '1/2/20', '3/4/2021']),
+            [date(2020, 1, 2), None, date(2020, 1, 2), date(2021, 3, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
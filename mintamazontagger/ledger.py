@@ -0,0 +1,126 @@
+"""Ledger of the Mint transactions tagged with Amazon orders and refunds.
+
+Once updates are sent to Mint, each tagged transaction's id is recorded
+along with the orders (shipments) or refunds it was matched to. Later runs
+skip these transactions, orders and refunds before matching, so only new
+activity is matched.
+"""
+
+from collections import Counter
+import hashlib
+import json
+import logging
+import os
+
+from mintamazontagger.atomicfile import open_atomic
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+# Bump whenever the record keys change.
+LEDGER_VERSION = 2
+
+# The report columns identifying orders (shipments) and refunds.
+ORDER_KEY_FIELDS = ('order_id', 'order_date', 'shipment_date', 'tracking')
+REFUND_KEY_FIELDS = (
+    'order_id', 'order_date', 'refund_date', 'asin_isbn', 'refund_reason')
+
+
+def get_record_key(record, occurrence=0):
+    """Identifies an order (shipment) or refund across runs.
+
+    Amounts are adjusted during tagging (e.g. misc charges), so the key is
+    based on the identifying columns only. Records alike in all of these
+    (e.g. two returns of the same item on the same day) are told apart by
+    occurrence, their position amongst each other in the report.
+    """
+    key_fields = ORDER_KEY_FIELDS if record.is_debit else REFUND_KEY_FIELDS
+    values = [getattr(record, f) for f in key_fields]
+    if occurrence:
+        values.append(occurrence)
+    content = repr(values)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+class MatchLedger:
+    """Mint transaction ids -> keys of the orders (or refunds) tagged."""
+
+    def __init__(self, transactions=None):
+        self.transactions = transactions or {}
+        self.record_keys = set(
+            key for keys in self.transactions.values() for key in keys)
+        # id(record) -> (record, key), for the records of index_records.
+        self.indexed_keys = {}
+
+    def __len__(self):
+        return len(self.transactions)
+
+    def index_records(self, records):
+        """Keys every record by its position amongst identical records.
+
+        records must be whole reports, in report order. Records already
+        indexed keep their key.
+        """
+        occurrences = Counter()
+        for r in records:
+            key = get_record_key(r)
+            occurrence = occurrences[key]
+            occurrences[key] += 1
+            if id(r) not in self.indexed_keys:
+                self.indexed_keys[id(r)] = (
+                    r, get_record_key(r, occurrence) if occurrence else key)
+
+    def get_key(self, record):
+        indexed = self.indexed_keys.get(id(record))
+        return indexed[1] if indexed else get_record_key(record)
+
+    def has_transaction(self, t):
+        return str(t.id) in self.transactions
+
+    def has_record(self, record):
+        return self.get_key(record) in self.record_keys
+
+    def get_newest_tagged_date(self, records):
+        """Returns the newest order date of the tagged records, or None."""
+        dates = [r.order_date for r in records if self.has_record(r)]
+        return max(dates) if dates else None
+
+    def add(self, t):
+        """Records that t was tagged with the orders/refunds it matched."""
+        keys = [self.get_key(o) for o in t.orders]
+        self.transactions[str(t.id)] = keys
+        self.record_keys.update(keys)
+
+    def add_updates(self, updates):
+        for orig_trans, _ in updates:
+            self.add(orig_trans)
+
+
+def load_match_ledger(ledger_path):
+    """Returns the MatchLedger saved at ledger_path (or an empty one)."""
+    if not ledger_path or not os.path.exists(ledger_path):
+        return MatchLedger()
+    try:
+        with open(ledger_path, 'r') as f:
+            ledger_json = json.load(f)
+    except ValueError:
+        logger.warning('Ignoring unreadable match ledger: {}'.format(
+            ledger_path))
+        return MatchLedger()
+    if ledger_json.get('version') != LEDGER_VERSION:
+        return MatchLedger()
+    ledger = MatchLedger(ledger_json['transactions'])
+    logger.info('Loaded {} previously tagged transactions from the match '
+                'ledger'.format(len(ledger)))
+    return ledger
+
+
+def save_match_ledger(ledger, ledger_path):
+    if not ledger_path:
+        return
+    with open_atomic(ledger_path) as f:
+        json.dump({
+            'version': LEDGER_VERSION,
+            'transactions': ledger.transactions,
+        }, f)
@@ -0,0 +1,106 @@
+from datetime import date
+import os
+import tempfile
+import unittest
+
+from mintamazontagger import ledger
+from mintamazontagger.mockdata import order, refund, transaction
+
+
+class LedgerMethods(unittest.TestCase):
+    def test_get_record_key(self):
+        o1 = order()
+        o2 = order(order_id='2')
+        self.assertEqual(
+            ledger.get_record_key(o1), ledger.get_record_key(order()))
+        self.assertNotEqual(
+            ledger.get_record_key(o1), ledger.get_record_key(o2))
+
+        # Adjustments made while tagging do not change the key.
+        key = ledger.get_record_key(o1)
+        o1.total_charged += 10000
+        self.assertEqual(ledger.get_record_key(o1), key)
+
+    def test_get_record_key_refund(self):
+        r = refund()
+        key = ledger.get_record_key(r)
+        r.total_refund_amount += 10000
+        self.assertEqual(ledger.get_record_key(r), key)
+
+    def test_index_records_identical_refunds(self):
+        r1 = refund()
+        r2 = refund()
+        t = transaction(id=1, amount='$11.95', is_debit=False)
+        t.match([r1])
+        match_ledger = ledger.MatchLedger()
+        match_ledger.index_records([r1, r2])
+
+        match_ledger.add(t)
+
+        self.assertTrue(match_ledger.has_record(r1))
+        self.assertFalse(match_ledger.has_record(r2))
+
+        # The next run tells them apart the same way.
+        match_ledger = ledger.MatchLedger(match_ledger.transactions)
+        r1 = refund()
+        r2 = refund()
+        match_ledger.index_records([r1, r2])
+        self.assertTrue(match_ledger.has_record(r1))
+        self.assertFalse(match_ledger.has_record(r2))
+
+    def test_add(self):
+        o = order()
+        r = refund()
+        t = transaction(id=1)
+        t.match([o])
+        match_ledger = ledger.MatchLedger()
+
+        match_ledger.add(t)
+
+        self.assertTrue(match_ledger.has_transaction(t))
+        self.assertFalse(match_ledger.has_transaction(transaction(id=2)))
+        self.assertTrue(match_ledger.has_record(o))
+        self.assertTrue(match_ledger.has_record(order()))
+        self.assertFalse(match_ledger.has_record(r))
+
+    def test_get_newest_tagged_date(self):
+        o1 = order(order_id='1', order_date='01/02/14')
+        o2 = order(order_id='2', order_date='03/04/14')
+        o3 = order(order_id='3', order_date='05/06/14')
+        t = transaction(id=1)
+        t.match([o1, o2])
+        match_ledger = ledger.MatchLedger()
+        self.assertIsNone(match_ledger.get_newest_tagged_date([o1, o2, o3]))
+
+        match_ledger.add(t)
+
+        self.assertEqual(
+            match_ledger.get_newest_tagged_date([o1, o2, o3]),
+            date(2014, 3, 4))
+
+    def test_save_and_load(self):
+        t = transaction(id=1)
+        t.match([order()])
+        with tempfile.TemporaryDirectory() as ledger_dir:
+            ledger_path = os.path.join(ledger_dir, 'ledger.json')
+            self.assertEqual(len(ledger.load_match_ledger(ledger_path)), 0)
+
+            match_ledger = ledger.MatchLedger()
+            match_ledger.add_updates([(t, [])])
+            ledger.save_match_ledger(match_ledger, ledger_path)
+
+            match_ledger = ledger.load_match_ledger(ledger_path)
+            self.assertEqual(len(match_ledger), 1)
+            self.assertTrue(match_ledger.has_transaction(t))
+            self.assertTrue(match_ledger.has_record(order()))
+
+    def test_load_unreadable(self):
+        with tempfile.TemporaryDirectory() as ledger_dir:
+            ledger_path = os.path.join(ledger_dir, 'ledger.json')
+            with open(ledger_path, 'w') as f:
+                f.write('{not json')
+            self.assertEqual(len(ledger.load_match_ledger(ledger_path)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
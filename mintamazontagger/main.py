@@ -7,6 +7,7 @@
 
 from collections import defaultdict, Counter
 import datetime
+import functools
 import logging
 import pickle
 import os
@@ -17,12 +18,23 @@ from progress.spinner import Spinner
 from outdated import check_outdated, warn_if_outdated
 
 from mintamazontagger import amazon
+from mintamazontagger import category
 from mintamazontagger import mint
 from mintamazontagger import tagger
 from mintamazontagger import VERSION
+from mintamazontagger.assignmentcache import load_assignment_cache
+from mintamazontagger.assignmentcache import save_assignment_cache
 from mintamazontagger.asyncprogress import AsyncProgress
+from mintamazontagger.columnar import ColumnarReport
+from mintamazontagger.columnar import materialize_for_association
 from mintamazontagger.currency import micro_usd_to_usd_string
+from mintamazontagger.ledger import load_match_ledger
+from mintamazontagger.ledger import save_match_ledger
+from mintamazontagger.matchtrace import MatchTrace
 from mintamazontagger.orderhistory import fetch_order_history
+from mintamazontagger.reportcache import load_from_cache
+from mintamazontagger.reportcache import parse_from_csv_cached
+from mintamazontagger.reportcache import save_to_cache
 from mintamazontagger.mintclient import MintClient
 from mintamazontagger import arg_utils
 
@@ -76,13 +88,29 @@ def main():
                         'unable to fetch. Exiting.')
         exit(1)
 
-    orders = amazon.Order.parse_from_csv(
-        orders_csv, ProgressCounter('Parsing Orders - '))
-    items = amazon.Item.parse_from_csv(
-        items_csv, ProgressCounter('Parsing Items - '))
-    refunds = ([] if not refunds_csv
-               else amazon.Refund.parse_from_csv(
-                   refunds_csv, ProgressCounter('Parsing Refunds - ')))
+    if args.columnar_reports and args.parse_workers != 1:
+        logger.critical('--columnar_reports parses the reports in this '
+                        'process; it cannot be used with --parse_workers.')
+        exit(1)
+
+    if args.columnar_reports and args.streaming_association:
+        logger.critical('--columnar_reports cannot be used with '
+                        '--streaming_association.')
+        exit(1)
+
+    if args.columnar_reports:
+        orders, items, refunds = parse_columnar_reports(
+            orders_csv, items_csv, refunds_csv)
+    elif args.streaming_association:
+        # Orders and items are streamed from the reports straight into
+        # association; only the records it yields are kept (all orders, but
+        # only the associated items).
+        _, _, refunds = parse_reports(None, None, refunds_csv, args)
+        orders = amazon.Order.iter_from_csv(orders_csv)
+        items = amazon.Item.iter_from_csv(items_csv)
+    else:
+        orders, items, refunds = parse_reports(
+            orders_csv, items_csv, refunds_csv, args)
 
     if args.dry_run:
         logger.info('\nDry Run; no modifications being sent to Mint.\n')
@@ -92,6 +120,9 @@ def main():
     stats = Counter(
         adjust_itemized_tax=0,
         already_up_to_date=0,
+        amount_adjustment=0,
+        association_gave_up=0,
+        ledgered=0,
         misc_charge=0,
         new_tag=0,
         no_retag=0,
@@ -100,22 +131,55 @@ def main():
         personal_cat=0,
     )
 
+    cache_location = (
+        None if args.no_report_cache else args.report_cache_location)
+    assignment_cache = load_assignment_cache(cache_location)
+    orders, association_gave_up = tagger.associate_items(
+        orders, items, stats, assignment_cache)
+    save_assignment_cache(assignment_cache, cache_location)
+    if args.streaming_association:
+        # Only the associated items were kept.
+        items = [i for o in orders for i in o.items]
+
+    # With a match ledger, previously tagged transactions (and their orders)
+    # are skipped, unless asked to retag.
+    ledger = None
+    new_activity = orders + refunds
+    if (args.match_ledger_location and
+            not (args.retag_changed or args.prompt_retag)):
+        ledger = load_match_ledger(args.match_ledger_location)
+        ledger.index_records(new_activity)
+        new_activity = [
+            r for r in new_activity if not ledger.has_record(r)]
+
     mint_client = MintClient(args.mint_email, args.mint_password,
                              session_path, args.headless,
                              args.mint_mfa_method, args.wait_for_sync)
 
-    if args.pickled_epoch:
+    if ledger is not None and not new_activity:
+        logger.info('Every Amazon order and refund was tagged by a previous '
+                    'run (see --match_ledger_location); not fetching Mint '
+                    'transactions.')
+        mint_trans = []
+        mint_category_name_to_id = category.DEFAULT_MINT_CATEGORIES_TO_IDS
+    elif args.pickled_epoch:
         mint_trans, mint_category_name_to_id = (
             get_trans_and_categories_from_pickle(
                 args.pickled_epoch, args.mint_pickle_location))
     else:
-        # Get the date of the oldest Amazon order.
+        # Get the date of the oldest Amazon order (that can still be matched
+        # and has yet to be tagged).
         if not start_date:
-            start_date = min([o.order_date for o in orders])
-            if refunds:
-                start_date = min(
-                    start_date,
-                    min([o.order_date for o in refunds]))
+            start_date = amazon.get_oldest_order_date(new_activity)
+            newest_tagged_date = (
+                ledger.get_newest_tagged_date(orders + refunds)
+                if ledger is not None else None)
+            if newest_tagged_date:
+                # Previous runs already looked for the transactions of
+                # untagged orders/refunds older than the newest tagged one;
+                # ones that never match must not keep the window open.
+                start_date = max(start_date, newest_tagged_date - (
+                    datetime.timedelta(days=args.max_days_after_shipping)))
 
         # Double the length of transaction history to help aid in
         # personalized category tagging overrides.
@@ -130,14 +194,19 @@ def main():
             mint_trans, mint_category_name_to_id, epoch,
             args.mint_pickle_location)
 
-    updates, unmatched_orders = tagger.get_mint_updates(
-        orders, items, refunds,
+    match_trace = MatchTrace() if args.match_trace_file else None
+    updates, unmatched_orders = tagger.get_mint_updates_for_orders(
+        orders, refunds,
         mint_trans,
         stats,
-        mint_category_name_to_id)
+        mint_category_name_to_id,
+        ledger,
+        match_trace)
+    if match_trace is not None:
+        match_trace.write_csv(args.match_trace_file)
 
     log_amazon_stats(items, orders, refunds)
-    log_processing_stats(stats)
+    log_processing_stats(stats, match_trace)
 
     if args.print_unmatched and unmatched_orders:
         logger.warning(
@@ -153,7 +222,18 @@ def main():
             for r in amazon.Refund.merge(refunds):
                 print_unmatched(r)
 
+    if args.print_unmatched and association_gave_up:
+        logger.warning(
+            'Gave up associating items with the shipments of the following '
+            'orders (see --item_association_budget):\n')
+        for oid in association_gave_up:
+            logger.warning('\t{}\t{}'.format(
+                oid, amazon.get_invoice_url(oid)))
+        logger.warning('')
+
     if not updates:
+        if ledger is not None and not args.dry_run:
+            save_match_ledger(ledger, args.match_ledger_location)
         logger.info(
             'All done; no new tags to be updated at this point in time!')
         exit(0)
@@ -169,6 +249,67 @@ def main():
     else:
         mint_client.send_updates(
             updates, ignore_category=args.no_tag_categories)
+        if ledger is not None:
+            ledger.add_updates(updates)
+            save_match_ledger(ledger, args.match_ledger_location)
+
+
+def parse_reports(orders_csv, items_csv, refunds_csv, args):
+    """Parses (or loads from the cache) the Orders, Items & Refunds reports.
+
+    Reports that are not given (None) are empty.
+    """
+    report_cache_location = (
+        None if args.no_report_cache else args.report_cache_location)
+    reports = [
+        (cls, csv_file) for cls, csv_file in (
+            (amazon.Order, orders_csv),
+            (amazon.Item, items_csv),
+            (amazon.Refund, refunds_csv))
+        if csv_file]
+
+    if args.parse_workers == 1:
+        results = [
+            parse_from_csv_cached(
+                cls, csv_file, report_cache_location,
+                functools.partial(
+                    ProgressCounter,
+                    'Parsing {}s - '.format(cls.__name__)))
+            for cls, csv_file in reports]
+    else:
+        results = [
+            load_from_cache(cls, csv_file, report_cache_location)
+            for cls, csv_file in reports]
+        uncached = [r for r, records in zip(reports, results)
+                    if records is None]
+        parsed = iter(amazon.parse_from_csvs_concurrently(
+            uncached,
+            max_workers=args.parse_workers or None,
+            progress=ProgressCounter('Parsing Amazon reports - '))
+            if uncached else [])
+        for idx, (cls, csv_file) in enumerate(reports):
+            if results[idx] is None:
+                results[idx] = next(parsed)
+                save_to_cache(
+                    cls, csv_file, report_cache_location, results[idx])
+
+    records = dict((cls, r) for (cls, _), r in zip(reports, results))
+    return (records.get(amazon.Order, []), records.get(amazon.Item, []),
+            records.get(amazon.Refund, []))
+
+
+def parse_columnar_reports(orders_csv, items_csv, refunds_csv):
+    """Parses the reports column-wise, only creating the needed records."""
+    orders_report = ColumnarReport.parse_from_csv(
+        amazon.Order, orders_csv, ProgressCounter('Parsing Orders - '))
+    items_report = ColumnarReport.parse_from_csv(
+        amazon.Item, items_csv, ProgressCounter('Parsing Items - '))
+    orders, items = materialize_for_association(orders_report, items_report)
+    refunds = ([] if not refunds_csv
+               else ColumnarReport.parse_from_csv(
+                   amazon.Refund, refunds_csv,
+                   ProgressCounter('Parsing Refunds - ')).views())
+    return orders, items, refunds
 
 
 def log_amazon_stats(items, orders, refunds):
@@ -217,11 +358,12 @@ def log_amazon_stats(items, orders, refunds):
             micro_usd_to_usd_string(sum(per_refund_totals))))
 
 
-def log_processing_stats(stats):
+def log_processing_stats(stats, match_trace=None):
     logger.info(
         '\nTransactions: {trans}\n'
         'Transactions w/ "Amazon" in description: {amazon_in_desc}\n'
         'Transactions ignored: is pending: {pending}\n'
+        'Transactions ignored: tagged by a previous run: {ledgered}\n'
         '\n'
         'Orders matched w/ transactions: {order_match} (unmatched orders: '
         '{order_unmatch})\n'
@@ -232,9 +374,11 @@ def log_processing_stats(stats):
         '\n'
         'Orders skipped: not shipped: {skipped_orders_unshipped}\n'
         'Orders skipped: gift card used: {skipped_orders_gift_card}\n'
+        'Orders without items: association gave up: {association_gave_up}\n'
         '\n'
         'Order fix-up: incorrect tax itemization: {adjust_itemized_tax}\n'
         'Order fix-up: has a misc charges (e.g. gift wrap): {misc_charge}\n'
+        'Order/refund fix-up: amount a few cents off: {amount_adjustment}\n'
         '\n'
         'Transactions ignored; already tagged & up to date: '
         '{already_up_to_date}\n'
@@ -245,6 +389,8 @@ def log_processing_stats(stats):
         '\n'
         'Transactions to be retagged: {retag}\n'
         'Transactions to be newly tagged: {new_tag}\n'.format(**stats))
+    if match_trace is not None:
+        logger.info('{}\n'.format(match_trace.get_summary()))
 
 
 def print_unmatched(amzn_obj):
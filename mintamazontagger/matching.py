@@ -0,0 +1,733 @@
+"""Matching of Mint transactions to Amazon orders (or refunds).
+
+A transaction matches an order (or a combination of orders with the same
+order id, when charged together) of the exact same amount, shipped (or
+refunded) within max_days_after_shipping days of the transaction date.
+Optionally, amounts can be a few cents off (amount_tolerance_cents); exact
+amounts are always preferred.
+
+Three strategies are available:
+- CLOSEST: each transaction in turn takes the closest unmatched candidate.
+- OPTIMAL: per amount, the matching with the most matches and then the
+  least total distance (in days) between transactions and candidates.
+- SORT_MERGE: a merge join of transactions and candidates sorted by amount
+  and date. As many matches as OPTIMAL, in a single linear pass, though not
+  necessarily the closest ones.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+import contextlib
+import itertools
+import logging
+
+from mintamazontagger.currency import micro_usd_to_cents
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+CLOSEST = 'closest'
+OPTIMAL = 'optimal'
+SORT_MERGE = 'sort_merge'
+MATCH_STRATEGIES = (OPTIMAL, CLOSEST, SORT_MERGE)
+
+# Candidates more than this many days away are never considered a match.
+MAX_DAYS_APART = 364
+
+# Max unmatched orders of one order id to search combinations of; the search
+# takes about 2 ** (n / 2) steps (and memory), i.e. about 8k at most.
+MAX_COMBINATION_ORDERS = 24
+
+# Default max search steps per transaction when combining orders across
+# order ids.
+DEFAULT_CROSS_ORDER_BUDGET = 10000
+
+# Max orders (the closest by date) considered per transaction when combining
+# orders across order ids.
+MAX_CROSS_ORDER_CANDIDATES = 100
+
+# Largest (transactions x candidates) cluster that is matched optimally;
+# larger ones are matched by CLOSEST instead (to bound memory).
+MAX_OPTIMAL_CELLS = 1000000
+
+
+def get_amount_bucket(amount):
+    """Candidates and transactions are bucketed by amount in cents."""
+    return micro_usd_to_cents(amount)
+
+
+def iter_bucket_offsets(tolerance_cents):
+    """Yields the bucket offsets to look at, exact amounts first."""
+    yield 0
+    for cents in range(1, tolerance_cents + 1):
+        yield -cents
+        yield cents
+
+
+def get_candidate_date(orders):
+    """Returns the transaction date of a candidate (a list of orders)."""
+    an_order = next((o for o in orders if o.transact_date()), None)
+    return an_order.transact_date() if an_order else None
+
+
+def is_candidate_matched(orders):
+    return any([o.matched for o in orders])
+
+
+def get_trans_counters(trace, t):
+    """Returns the trace counters of t, or None when not tracing."""
+    return trace.get_counters(t) if trace is not None else None
+
+
+def timed_pass(trace, pass_name):
+    if trace is None:
+        return contextlib.nullcontext()
+    return trace.timed(pass_name)
+
+
+def count_date_rejections(counters, days, day, max_days):
+    """Counts the candidates examined and those dated out of the window.
+
+    days are the (sorted) days of the candidates of a transaction's amount.
+    """
+    in_window = (bisect_left(days, day + max_days + 1) -
+                 bisect_left(days, day - max_days))
+    counters['candidates'] += len(days)
+    counters['date_rejections'] += len(days) - in_window
+
+
+class CandidateIndex:
+    """Unmatched candidates (lists of orders or refunds) by amount.
+
+    Candidates are bucketed by amount in cents, so neighbouring amounts (a
+    cent or two off) are a dict lookup away. The candidates of each bucket
+    are kept sorted by date (ties in the order they were added), so the
+    closest candidate to a transaction date is found by bisection.
+    Candidates are removed once matched; candidates that are found to share
+    an order with a matched candidate are dropped on the fly.
+    """
+
+    def __init__(self, amount_candidates=()):
+        entries_by_amount = defaultdict(list)
+        for seq, (amount, orders) in enumerate(amount_candidates):
+            when = get_candidate_date(orders)
+            if not when:
+                continue
+            entries_by_amount[get_amount_bucket(amount)].append(
+                ((when.toordinal(), seq), orders))
+        self.keys = {}
+        self.candidates = {}
+        for amount, entries in entries_by_amount.items():
+            entries.sort(key=lambda e: e[0])
+            self.keys[amount] = [key for key, _ in entries]
+            self.candidates[amount] = [orders for _, orders in entries]
+
+    def __len__(self):
+        return sum([len(keys) for keys in self.keys.values()])
+
+    def pop_closest(self, amount, when, max_days, tolerance_cents=0,
+                    counters=None):
+        """Removes and returns the closest unmatched candidate, or None.
+
+        Only candidates at most max_days away from `when` are considered. Of
+        equally close candidates, the one added first wins. Candidates of
+        amounts up to tolerance_cents off are only considered if there are
+        none of the exact amount (then of 1 cent off, etc). If given, the
+        candidates examined and rejected are counted in counters (see
+        matchtrace).
+        """
+        bucket = get_amount_bucket(amount)
+        max_days = min(max_days, MAX_DAYS_APART)
+        for offset in iter_bucket_offsets(tolerance_cents):
+            orders = self.pop_closest_in_bucket(
+                bucket + offset, when.toordinal(), max_days, counters)
+            if orders:
+                return orders
+        return None
+
+    def pop_closest_in_bucket(self, bucket, day, max_days, counters=None):
+        keys = self.keys.get(bucket)
+        if not keys:
+            return None
+        candidates = self.candidates[bucket]
+        stale = set()
+        if counters is not None:
+            counters['date_rejections'] += len(keys) - (
+                bisect_left(keys, (day + max_days + 1,)) -
+                bisect_left(keys, (day - max_days,)))
+
+        def first_unmatched(start, stop, step=1):
+            for idx in range(start, stop, step):
+                if counters is not None:
+                    counters['candidates'] += 1
+                if not is_candidate_matched(candidates[idx]):
+                    return idx
+                stale.add(idx)
+            return None
+
+        pivot = bisect_left(keys, (day,))
+        before = first_unmatched(
+            pivot - 1, bisect_left(keys, (day - max_days,)) - 1, -1)
+        after = first_unmatched(
+            pivot, bisect_left(keys, (day + max_days + 1,)))
+        distances = [abs(keys[idx][0] - day)
+                     for idx in (before, after) if idx is not None]
+
+        best = None
+        if distances:
+            best_days = min(distances)
+            for ordinal in set([day - best_days, day + best_days]):
+                idx = first_unmatched(
+                    bisect_left(keys, (ordinal,)),
+                    bisect_left(keys, (ordinal + 1,)))
+                if idx is not None and (
+                        best is None or keys[idx][1] < keys[best][1]):
+                    best = idx
+        if counters is not None:
+            counters['matched_rejections'] += len(stale)
+        if best is not None:
+            stale.add(best)
+        orders = candidates[best] if best is not None else None
+
+        for idx in sorted(stale, reverse=True):
+            del keys[idx]
+            del candidates[idx]
+        return orders
+
+
+def match(t, orders, progress=None):
+    for o in orders:
+        o.match(t)
+    t.match(orders)
+    if progress:
+        progress.next(len(orders))
+
+
+def match_closest(t, index, max_days_after_shipping, progress=None,
+                  tolerance_cents=0, trace=None):
+    """Matches t to its closest candidate in index (if any)."""
+    orders = index.pop_closest(
+        t.amount, t.odate, max_days_after_shipping, tolerance_cents,
+        get_trans_counters(trace, t))
+    if orders:
+        match(t, orders, progress)
+
+
+def get_clusters(trans_days, candidate_days, max_days):
+    """Splits sorted days into clusters that cannot match across.
+
+    Yields (trans range, candidate range) pairs; any two events in different
+    clusters are more than max_days apart.
+    """
+    events = sorted(itertools.chain(
+        ((day, 0) for day in trans_days),
+        ((day, 1) for day in candidate_days)))
+    i = j = 0
+    start_i = start_j = 0
+    last_day = None
+    for day, kind in events:
+        if last_day is not None and day - last_day > max_days:
+            yield range(start_i, i), range(start_j, j)
+            start_i, start_j = i, j
+        if kind == 0:
+            i += 1
+        else:
+            j += 1
+        last_day = day
+    if events:
+        yield range(start_i, i), range(start_j, j)
+
+
+def get_optimal_pairs(trans_days, candidate_days, max_days):
+    """Returns the (trans idx, candidate idx) pairs of an optimal matching.
+
+    Both lists of days must be sorted. The matching has as many pairs as
+    possible, each at most max_days apart, and of those the least total
+    distance. On a line, some optimal matching never crosses (if a < b and
+    c < d, pairing a-c and b-d is no worse than a-d and b-c), so a dynamic
+    program over the two sorted lists finds it.
+    """
+    pairs = []
+    for trans_range, candidate_range in get_clusters(
+            trans_days, candidate_days, max_days):
+        if not trans_range or not candidate_range:
+            continue
+        ts = [trans_days[i] for i in trans_range]
+        cs = [candidate_days[j] for j in candidate_range]
+        if len(ts) * len(cs) > MAX_OPTIMAL_CELLS:
+            cluster_pairs = get_closest_pairs(ts, cs, max_days)
+        else:
+            cluster_pairs = get_cluster_optimal_pairs(ts, cs, max_days)
+        pairs.extend(
+            (trans_range[i], candidate_range[j]) for i, j in cluster_pairs)
+    return pairs
+
+
+def get_cluster_optimal_pairs(ts, cs, max_days):
+    # A score encodes (number of pairs, -total distance) as a single int.
+    pair_score = (max_days + 1) * (min(len(ts), len(cs)) + 1)
+    n, m = len(ts), len(cs)
+    score = [[0] * (m + 1) for _ in range(n + 1)]
+    for i in range(1, n + 1):
+        row, prev_row = score[i], score[i - 1]
+        t_day = ts[i - 1]
+        for j in range(1, m + 1):
+            best = max(prev_row[j], row[j - 1])
+            days = abs(t_day - cs[j - 1])
+            if days <= max_days:
+                best = max(best, prev_row[j - 1] + pair_score - days)
+            row[j] = best
+
+    pairs = []
+    i, j = n, m
+    while i and j:
+        days = abs(ts[i - 1] - cs[j - 1])
+        if (days <= max_days and
+                score[i][j] == score[i - 1][j - 1] + pair_score - days):
+            pairs.append((i - 1, j - 1))
+            i -= 1
+            j -= 1
+        elif score[i][j] == score[i - 1][j]:
+            i -= 1
+        else:
+            j -= 1
+    pairs.reverse()
+    return pairs
+
+
+def get_closest_pairs(ts, cs, max_days):
+    """Like get_cluster_optimal_pairs, each transaction taking the closest."""
+    taken = [False] * len(cs)
+    pairs = []
+    for i, day in enumerate(ts):
+        best = None
+        for j in range(bisect_left(cs, day - max_days),
+                       bisect_left(cs, day + max_days + 1)):
+            if not taken[j] and (
+                    best is None or abs(cs[j] - day) < abs(cs[best] - day)):
+                best = j
+        if best is not None:
+            taken[best] = True
+            pairs.append((i, best))
+    return pairs
+
+
+def match_optimally(unmatched_trans, amount_candidates,
+                    max_days_after_shipping, progress=None,
+                    tolerance_cents=0, trace=None):
+    """Matches transactions to candidates using the OPTIMAL strategy.
+
+    amount_candidates are (amount, candidate) pairs. Candidates can be
+    combinations that share orders: the optimal pairs of all amounts are
+    then matched closest first, skipping any conflicting ones. Transactions
+    left over (due to such conflicts, or only matching amounts within
+    tolerance_cents) are matched by CLOSEST.
+    """
+    max_days = min(max_days_after_shipping, MAX_DAYS_APART)
+    amount_candidates = list(amount_candidates)
+    candidates_by_amount = defaultdict(list)
+    for seq, (amount, orders) in enumerate(amount_candidates):
+        when = get_candidate_date(orders)
+        if when:
+            candidates_by_amount[get_amount_bucket(amount)].append(
+                ((when.toordinal(), seq), orders))
+    trans_by_amount = defaultdict(list)
+    for seq, t in enumerate(unmatched_trans):
+        trans_by_amount[get_amount_bucket(t.amount)].append(
+            ((t.odate.toordinal(), seq), t))
+
+    pairs = []
+    for amount, trans_entries in trans_by_amount.items():
+        candidate_entries = candidates_by_amount.get(amount)
+        if not candidate_entries:
+            continue
+        trans_entries.sort(key=lambda e: e[0])
+        candidate_entries.sort(key=lambda e: e[0])
+        candidate_days = [key[0] for key, _ in candidate_entries]
+        if trace is not None:
+            for (t_day, _), t in trans_entries:
+                count_date_rejections(
+                    trace.get_counters(t), candidate_days, t_day, max_days)
+        for i, j in get_optimal_pairs(
+                [key[0] for key, _ in trans_entries], candidate_days,
+                max_days):
+            (t_day, t_seq), t = trans_entries[i]
+            (c_day, _), orders = candidate_entries[j]
+            pairs.append((abs(t_day - c_day), t_seq, t, orders))
+
+    pairs.sort(key=lambda p: p[:2])
+    for _, _, t, orders in pairs:
+        if not is_candidate_matched(orders):
+            match(t, orders, progress)
+        elif trace is not None:
+            trace.get_counters(t)['matched_rejections'] += 1
+
+    unmatched_trans = [t for t in unmatched_trans if not t.orders]
+    if len(unmatched_trans):
+        index = CandidateIndex(amount_candidates)
+        for t in unmatched_trans:
+            match_closest(
+                t, index, max_days, progress, tolerance_cents, trace)
+
+
+def match_sort_merge(unmatched_trans, amount_candidates,
+                     max_days_after_shipping, progress=None,
+                     tolerance_cents=0, trace=None):
+    """Matches transactions to candidates using the SORT_MERGE strategy.
+
+    Both sides are sorted once by (amount, date) and walked together: each
+    transaction in turn takes the earliest unmatched candidate of its amount
+    dated at most max_days_after_shipping before it, if that candidate is
+    not dated more than max_days_after_shipping after it. Candidates too
+    early for a transaction are too early for all the transactions after
+    it. This matches as many transactions per amount as OPTIMAL. Transactions
+    left over are matched by CLOSEST to amounts within tolerance_cents.
+    """
+    max_days = min(max_days_after_shipping, MAX_DAYS_APART)
+    amount_candidates = list(amount_candidates)
+    candidates = []
+    for seq, (amount, orders) in enumerate(amount_candidates):
+        when = get_candidate_date(orders)
+        if when:
+            candidates.append(
+                ((get_amount_bucket(amount), when.toordinal(), seq), orders))
+    candidates.sort(key=lambda c: c[0])
+    trans_entries = sorted(
+        ((get_amount_bucket(t.amount), t.odate.toordinal(), seq), t)
+        for seq, t in enumerate(unmatched_trans))
+
+    j = 0
+    for (amount, day, _), t in trans_entries:
+        counters = get_trans_counters(trace, t)
+        while j < len(candidates) and (
+                candidates[j][0] < (amount, day - max_days) or
+                is_candidate_matched(candidates[j][1])):
+            if counters is not None:
+                count_sort_merge_skip(counters, candidates[j], amount, day,
+                                      max_days)
+            j += 1
+        if j == len(candidates):
+            continue
+        if counters is not None:
+            counters['candidates'] += 1
+        if candidates[j][0][:2] <= (amount, day + max_days):
+            match(t, candidates[j][1], progress)
+            j += 1
+        elif counters is not None and candidates[j][0][0] == amount:
+            counters['date_rejections'] += 1
+
+    if tolerance_cents:
+        index = CandidateIndex(amount_candidates)
+        for t in unmatched_trans:
+            if not t.orders:
+                match_closest(
+                    t, index, max_days, progress, tolerance_cents, trace)
+
+
+def count_sort_merge_skip(counters, candidate, amount, day, max_days):
+    (candidate_amount, candidate_day, _), orders = candidate
+    counters['candidates'] += 1
+    if candidate_amount == amount and candidate_day < day - max_days:
+        counters['date_rejections'] += 1
+    elif is_candidate_matched(orders):
+        counters['matched_rejections'] += 1
+
+
+def match_by_strategy(unmatched_trans, amount_candidates,
+                      max_days_after_shipping, strategy, progress=None,
+                      tolerance_cents=0, trace=None):
+    if strategy == OPTIMAL:
+        match_optimally(
+            unmatched_trans, amount_candidates, max_days_after_shipping,
+            progress, tolerance_cents, trace)
+        return
+    if strategy == SORT_MERGE:
+        match_sort_merge(
+            unmatched_trans, amount_candidates, max_days_after_shipping,
+            progress, tolerance_cents, trace)
+        return
+    index = CandidateIndex(amount_candidates)
+    for t in unmatched_trans:
+        match_closest(
+            t, index, max_days_after_shipping, progress, tolerance_cents,
+            trace)
+
+
+def match_transactions(unmatched_trans, unmatched_orders,
+                       max_days_after_shipping, progress=None,
+                       strategy=OPTIMAL, cross_order_budget=None,
+                       amount_tolerance_cents=0, trace=None):
+    """Matches transactions to orders (or combinations of orders).
+
+    Transactions match amounts up to amount_tolerance_cents off, though
+    exact amounts are preferred.
+
+    If cross_order_budget is given, a third pass matches the transactions
+    left to combinations of orders with different order ids (see
+    match_across_orders).
+
+    If a matchtrace.MatchTrace is given as trace, the work done per
+    transaction (and order id) and the time spent per pass are added to it.
+    """
+    # Also works with Refund objects.
+    match_singles(
+        unmatched_trans, unmatched_orders, max_days_after_shipping, progress,
+        strategy, amount_tolerance_cents, trace)
+    match_combinations(
+        [t for t in unmatched_trans if not t.orders],
+        [o for o in unmatched_orders if not o.matched],
+        max_days_after_shipping, progress, strategy, cross_order_budget,
+        amount_tolerance_cents, trace)
+
+
+def match_singles(unmatched_trans, unmatched_orders, max_days_after_shipping,
+                  progress=None, strategy=OPTIMAL, tolerance_cents=0,
+                  trace=None):
+    """First pass of match_transactions: one order per transaction.
+
+    A transaction only ever competes with transactions of (about) the same
+    amount here.
+    """
+    # Match up transactions that exactly equal an order's charged amount.
+    with timed_pass(trace, 'singles'):
+        match_by_strategy(
+            unmatched_trans,
+            ((o.transact_amount(), [o]) for o in unmatched_orders),
+            max_days_after_shipping, strategy, progress, tolerance_cents,
+            trace)
+
+
+def match_combinations(unmatched_trans, unmatched_orders,
+                       max_days_after_shipping, progress=None,
+                       strategy=OPTIMAL, cross_order_budget=None,
+                       tolerance_cents=0, trace=None):
+    """Second (and third) pass of match_transactions: several orders each.
+
+    unmatched_trans and unmatched_orders are what match_singles left.
+    """
+    # Second pass: Match up transactions to a combination of orders (sometimes
+    # they are charged together).
+    with timed_pass(trace, 'combinations'):
+        match_by_strategy(
+            unmatched_trans,
+            get_combination_candidates(
+                unmatched_trans, unmatched_orders, max_days_after_shipping,
+                tolerance_cents, trace),
+            max_days_after_shipping, strategy, progress, tolerance_cents,
+            trace)
+
+    if cross_order_budget:
+        # Third pass: Amazon sometimes charges shipments of different orders
+        # together.
+        with timed_pass(trace, 'across_orders'):
+            match_across_orders(
+                [t for t in unmatched_trans if not t.orders],
+                [o for o in unmatched_orders if not o.matched],
+                max_days_after_shipping, cross_order_budget, progress,
+                tolerance_cents, trace)
+
+
+def match_across_orders(unmatched_trans, unmatched_orders,
+                        max_days_after_shipping,
+                        budget=DEFAULT_CROSS_ORDER_BUDGET, progress=None,
+                        tolerance_cents=0, trace=None):
+    """Matches transactions to combinations of orders of any order ids.
+
+    Only orders dated within max_days_after_shipping of a transaction (at
+    most MAX_CROSS_ORDER_CANDIDATES, the closest first) are combined, and the
+    search for each transaction gives up after budget steps (split evenly
+    between the exact amount and the amounts within tolerance_cents).
+    """
+    offsets = list(iter_bucket_offsets(tolerance_cents))
+    budget_per_offset = max(1, budget // len(offsets))
+    max_days = min(max_days_after_shipping, MAX_DAYS_APART)
+    entries = sorted(
+        ((o.transact_date().toordinal(), seq), o)
+        for seq, o in enumerate(unmatched_orders) if o.transact_date())
+    keys = [key for key, _ in entries]
+    orders = [o for _, o in entries]
+
+    for t in unmatched_trans:
+        if not t.amount:
+            continue
+        # Works the same for refunds (negative amounts).
+        sign = 1 if t.amount > 0 else -1
+        day = t.odate.toordinal()
+        counters = get_trans_counters(trace, t)
+        window_idxs = range(
+            bisect_left(keys, (day - max_days,)),
+            bisect_left(keys, (day + max_days + 1,)))
+        window = [
+            (abs(keys[idx][0] - day), idx) for idx in window_idxs
+            if not orders[idx].matched and
+            orders[idx].transact_amount() * sign > 0]
+        if counters is not None:
+            counters['candidates'] += len(window_idxs)
+            counters['matched_rejections'] += len(
+                [idx for idx in window_idxs if orders[idx].matched])
+        window = [orders[idx] for _, idx in
+                  sorted(window)[:MAX_CROSS_ORDER_CANDIDATES]]
+        if len(set([o.order_id for o in window])) < 2:
+            continue
+        window.sort(key=lambda o: -o.transact_amount() * sign)
+        amounts = [get_amount_bucket(o.transact_amount()) * sign
+                   for o in window]
+        for offset in offsets:
+            idxs = find_combination(
+                amounts, get_amount_bucket(t.amount) * sign + offset,
+                budget_per_offset, counters,
+                keys=[o.order_id for o in window])
+            if idxs:
+                match(t, tuple(window[idx] for idx in idxs), progress)
+                break
+
+
+def find_combination(amounts, target, budget, counters=None, keys=None):
+    """Returns the indexes of 2 or more amounts that sum to target, or None.
+
+    amounts must be positive and sorted in decreasing order. Amounts larger
+    than what remains are skipped by bisection, and branches whose remaining
+    amounts cannot add up to the target are pruned. Gives up (returning
+    None) after budget steps. If given, the steps are counted as
+    combinations in counters. If keys (e.g. the order id of each amount) are
+    given, the combination must span at least 2 distinct keys.
+    """
+    negated = [-amount for amount in amounts]
+    suffix_sums = list(itertools.accumulate(reversed(amounts)))[::-1] + [0]
+    chosen = []
+    steps = [0]
+
+    def search(start, remaining):
+        if remaining == 0:
+            if keys is not None:
+                return len(set([keys[idx] for idx in chosen])) >= 2
+            return len(chosen) >= 2
+        first = bisect_left(negated, -remaining, lo=start)
+        for idx in range(first, len(amounts)):
+            if suffix_sums[idx] < remaining:
+                return False
+            if (idx > first and amounts[idx] == amounts[idx - 1] and
+                    (keys is None or keys[idx] == keys[idx - 1])):
+                # Same as the previous branch.
+                continue
+            steps[0] += 1
+            if steps[0] > budget:
+                return False
+            chosen.append(idx)
+            if search(idx + 1, remaining - amounts[idx]):
+                return True
+            chosen.pop()
+        return False
+
+    found = search(0, target)
+    if counters is not None:
+        counters['combinations'] += min(steps[0], budget)
+    return list(chosen) if found else None
+
+
+def get_subset_sums(amounts, offset=0):
+    """Returns (sum, bitmask) for every subset of amounts.
+
+    Bit (idx + offset) of a bitmask is set if amounts[idx] is in the subset.
+    """
+    sums = [(0, 0)]
+    for idx, amount in enumerate(amounts):
+        bit = 1 << (idx + offset)
+        sums += [(total + amount, mask | bit) for total, mask in sums]
+    return sums
+
+
+def iter_combinations_summing_to(amounts, targets):
+    """Yields bitmasks of the combinations of amounts that sum to a target.
+
+    Only combinations of at least 2 amounts are yielded. Rather than trying
+    all 2 ** n combinations, the subset sums of each half of the amounts are
+    enumerated (meet in the middle): a combination is a subset of the first
+    half whose sum, with a target, determines the sum of the second half.
+    """
+    half = len(amounts) // 2
+    masks_by_sum = defaultdict(list)
+    for total, mask in get_subset_sums(amounts[half:], half):
+        masks_by_sum[total].append(mask)
+    for total, mask in get_subset_sums(amounts[:half]):
+        for target in targets:
+            for other_mask in masks_by_sum.get(target - total, ()):
+                combined = mask | other_mask
+                if bin(combined).count('1') >= 2:
+                    yield combined
+
+
+def get_combination_candidates(unmatched_trans, unmatched_orders,
+                               max_days_after_shipping, tolerance_cents=0,
+                               trace=None):
+    """Returns (amount, combination) for combinations of orders to match.
+
+    A combination has 2 or more orders with the same order id. Only the
+    combinations whose total is (within tolerance_cents of) the amount of an
+    unmatched transaction dated within max_days_after_shipping are returned,
+    in the order of itertools.combinations (per order id, by size).
+    """
+    max_days = min(max_days_after_shipping, MAX_DAYS_APART)
+    offsets = list(iter_bucket_offsets(tolerance_cents))
+    trans_days = sorted(
+        (t.odate.toordinal(), get_amount_bucket(t.amount))
+        for t in unmatched_trans)
+    trans_days_by_bucket = defaultdict(list)
+    for day, bucket in trans_days:
+        trans_days_by_bucket[bucket].append(day)
+
+    def has_trans_near(bucket, day):
+        for offset in offsets:
+            days = trans_days_by_bucket.get(bucket + offset, [])
+            idx = bisect_left(days, day - max_days)
+            if idx < len(days) and days[idx] <= day + max_days:
+                return True
+        return False
+
+    oid_to_orders = defaultdict(list)
+    for o in unmatched_orders:
+        oid_to_orders[o.order_id].append(o)
+
+    candidates = []
+    for oid, orders_same_id in oid_to_orders.items():
+        if len(orders_same_id) < 2:
+            continue
+        if len(orders_same_id) > MAX_COMBINATION_ORDERS:
+            logger.warning(
+                'Not matching combinations of the {} shipments of order {}'
+                .format(len(orders_same_id), oid))
+            continue
+        order_days = [o.transact_date().toordinal()
+                      for o in orders_same_id if o.transact_date()]
+        if not order_days:
+            continue
+        # Only transactions near these orders' dates can match.
+        targets = set([
+            bucket + offset for _, bucket in trans_days[
+                bisect_left(trans_days, (min(order_days) - max_days,)):
+                bisect_left(
+                    trans_days, (max(order_days) + max_days + 1,))]
+            for offset in offsets])
+        if trace is not None:
+            # The subset sums of both halves (see
+            # iter_combinations_summing_to).
+            half = len(orders_same_id) // 2
+            trace.get_order_id_counters(oid)['combinations'] += (
+                2 ** half + 2 ** (len(orders_same_id) - half))
+        combos = []
+        for mask in iter_combinations_summing_to(
+                [get_amount_bucket(o.transact_amount())
+                 for o in orders_same_id],
+                targets):
+            idxs = tuple(idx for idx in range(len(orders_same_id))
+                         if mask >> idx & 1)
+            combo = tuple(orders_same_id[idx] for idx in idxs)
+            when = get_candidate_date(combo)
+            amount = sum([o.transact_amount() for o in combo])
+            if when and has_trans_near(
+                    get_amount_bucket(amount), when.toordinal()):
+                combos.append(((len(idxs), idxs), amount, combo))
+        combos.sort(key=lambda c: c[0])
+        candidates.extend((amount, combo) for _, amount, combo in combos)
+    return candidates
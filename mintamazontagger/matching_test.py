@@ -0,0 +1,332 @@
+from datetime import date
+import unittest
+
+from mintamazontagger import matching
+from mintamazontagger.mockdata import order, refund, transaction
+
+
+class CandidateIndexClass(unittest.TestCase):
+    def test_pop_closest(self):
+        o1 = order(order_id='1', shipment_date='02/20/14')
+        o2 = order(order_id='2', shipment_date='02/25/14')
+        o3 = order(order_id='3', shipment_date='02/26/14')
+        index = matching.CandidateIndex(
+            (o.transact_amount(), [o]) for o in [o1, o2, o3])
+        amount = o1.transact_amount()
+
+        self.assertIsNone(
+            index.pop_closest(amount + 10000, date(2014, 2, 25), 3))
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 24), 3), [o2])
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 24), 3), [o3])
+        # o1 is too far away.
+        self.assertIsNone(index.pop_closest(amount, date(2014, 2, 24), 3))
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 17), 3), [o1])
+        self.assertEqual(len(index), 0)
+
+    def test_pop_closest_ties_go_to_the_first_added(self):
+        o1 = order(order_id='1', shipment_date='02/26/14')
+        o2 = order(order_id='2', shipment_date='02/22/14')
+        o3 = order(order_id='3', shipment_date='02/22/14')
+        index = matching.CandidateIndex(
+            (o.transact_amount(), [o]) for o in [o1, o2, o3])
+        amount = o1.transact_amount()
+
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 24), 3), [o1])
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 24), 3), [o2])
+        self.assertEqual(index.pop_closest(amount, date(2014, 2, 24), 3), [o3])
+
+    def test_pop_closest_drops_matched_candidates(self):
+        o1 = order(order_id='1', shipment_date='02/24/14')
+        o2 = order(order_id='1', shipment_date='02/25/14')
+        index = matching.CandidateIndex([(10, [o1, o2]), (10, [o2])])
+        o1.matched = True
+
+        self.assertEqual(index.pop_closest(10, date(2014, 2, 24), 3), [o2])
+        self.assertEqual(len(index), 0)
+
+    def test_skips_candidates_without_date(self):
+        r = refund(refund_date=None)
+        index = matching.CandidateIndex([(r.transact_amount(), [r])])
+        self.assertEqual(len(index), 0)
+
+
+class MatchingMethods(unittest.TestCase):
+    def test_match_transactions(self):
+        o1 = order(order_id='1', shipment_date='02/26/14')
+        o2 = order(order_id='2', shipment_date='02/20/14')
+        t1 = transaction(amount='$11.95', date='2/20/14', id=1)
+        t2 = transaction(amount='$11.95', date='2/27/14', id=2)
+
+        matching.match_transactions([t1, t2], [o1, o2], 3)
+
+        self.assertEqual(t1.orders, [o2])
+        self.assertEqual(t2.orders, [o1])
+        self.assertEqual(o1.trans_id, 2)
+        self.assertEqual(o2.trans_id, 1)
+
+    def test_match_transactions_combination(self):
+        o1 = order(order_id='3', subtotal='$5.45', tax_charged='$0.55',
+                   total_charged='$6.00', tracking='A')
+        o2 = order(order_id='3', subtotal='$5.45', tax_charged='$0.50',
+                   total_charged='$5.95', tracking='B')
+        t = transaction(amount='$11.95', date='2/28/14', id=3)
+
+        matching.match_transactions([t], [o1, o2], 3)
+
+        self.assertEqual(list(t.orders), [o1, o2])
+        self.assertTrue(o1.matched)
+        self.assertTrue(o2.matched)
+
+    def test_match_transactions_too_far_apart(self):
+        o = order(shipment_date='02/20/14')
+        t = transaction(amount='$11.95', date='2/28/14')
+
+        matching.match_transactions([t], [o], 3)
+
+        self.assertFalse(o.matched)
+        self.assertFalse(t.orders)
+
+    def test_match_transactions_optimal(self):
+        # Taking the closest order for t1 would leave t2 without a match.
+        o1 = order(order_id='1', shipment_date='02/22/14')
+        o2 = order(order_id='2', shipment_date='02/19/14')
+        t1 = transaction(amount='$11.95', date='2/21/14', id=1)
+        t2 = transaction(amount='$11.95', date='2/25/14', id=2)
+
+        matching.match_transactions([t1, t2], [o1, o2], 3)
+
+        self.assertEqual(t1.orders, [o2])
+        self.assertEqual(t2.orders, [o1])
+
+    def test_match_transactions_closest(self):
+        o1 = order(order_id='1', shipment_date='02/22/14')
+        o2 = order(order_id='2', shipment_date='02/19/14')
+        t1 = transaction(amount='$11.95', date='2/21/14', id=1)
+        t2 = transaction(amount='$11.95', date='2/25/14', id=2)
+
+        matching.match_transactions(
+            [t1, t2], [o1, o2], 3, strategy=matching.CLOSEST)
+
+        self.assertEqual(t1.orders, [o1])
+        self.assertFalse(t2.orders)
+        self.assertFalse(o2.matched)
+
+    def test_match_transactions_sort_merge(self):
+        o1 = order(order_id='1', shipment_date='02/22/14')
+        o2 = order(order_id='2', shipment_date='02/19/14')
+        o3 = order(order_id='3', total_charged='$5.00',
+                   shipment_date='02/21/14')
+        t1 = transaction(amount='$11.95', date='2/21/14', id=1)
+        t2 = transaction(amount='$11.95', date='2/25/14', id=2)
+        t3 = transaction(amount='$5.00', date='2/28/14', id=3)
+
+        matching.match_transactions(
+            [t3, t2, t1], [o1, o2, o3], 3, strategy=matching.SORT_MERGE)
+
+        self.assertEqual(t1.orders, [o2])
+        self.assertEqual(t2.orders, [o1])
+        # o3 is too far away.
+        self.assertFalse(t3.orders)
+        self.assertFalse(o3.matched)
+
+    def test_match_sort_merge_skips_matched_candidates(self):
+        o1 = order(order_id='3', total_charged='$6.00', tracking='A')
+        o2 = order(order_id='3', total_charged='$5.95', tracking='B')
+        t1 = transaction(amount='$11.95', date='2/28/14', id=1)
+        t2 = transaction(amount='$5.95', date='2/28/14', id=2)
+
+        matching.match_sort_merge(
+            [t1, t2], [(o1.transact_amount() + o2.transact_amount(), [o1, o2]),
+                       (o2.transact_amount(), [o2])], 3)
+
+        self.assertEqual(t2.orders, [o2])
+        self.assertFalse(t1.orders)
+
+    def test_match_sort_merge_within_tolerance(self):
+        o = order(total_charged='$11.96')
+        t = transaction(amount='$11.95')
+
+        matching.match_sort_merge([t], [(o.transact_amount(), [o])], 3)
+        self.assertFalse(t.orders)
+
+        matching.match_sort_merge(
+            [t], [(o.transact_amount(), [o])], 3, tolerance_cents=1)
+        self.assertEqual(t.orders, [o])
+
+    def test_get_optimal_pairs(self):
+        self.assertEqual(
+            matching.get_optimal_pairs([1, 5, 20], [2, 3, 21, 40], 3),
+            [(0, 0), (1, 1), (2, 2)])
+        self.assertEqual(matching.get_optimal_pairs([], [1], 3), [])
+        self.assertEqual(matching.get_optimal_pairs([1], [10], 3), [])
+
+    def test_get_optimal_pairs_falls_back_to_closest(self):
+        max_cells = matching.MAX_OPTIMAL_CELLS
+        matching.MAX_OPTIMAL_CELLS = 1
+        try:
+            self.assertEqual(
+                matching.get_optimal_pairs([2, 4], [1, 3], 3),
+                [(0, 0), (1, 1)])
+        finally:
+            matching.MAX_OPTIMAL_CELLS = max_cells
+
+    def test_match_optimally_combination_conflicts(self):
+        # Both combinations share o2; only one can be matched.
+        o1 = order(order_id='3', total_charged='$6.00', tracking='A')
+        o2 = order(order_id='3', total_charged='$5.95', tracking='B')
+        o3 = order(order_id='3', total_charged='$1.00', tracking='C')
+        t1 = transaction(amount='$11.95', date='2/28/14', id=1)
+        t2 = transaction(amount='$6.95', date='2/28/14', id=2)
+
+        matching.match_transactions([t1, t2], [o1, o2, o3], 3)
+
+        # Equally close: the first transaction wins.
+        self.assertEqual(t1.orders, (o1, o2))
+        self.assertFalse(t2.orders)
+        self.assertFalse(o3.matched)
+
+    def test_iter_combinations_summing_to(self):
+        amounts = [1, 2, 4, 8, 3]
+        self.assertEqual(
+            sorted(matching.iter_combinations_summing_to(amounts, [7, 100])),
+            # 1 + 2 + 4, 4 + 3
+            sorted([0b00111, 0b10100]))
+        # A single amount is not a combination.
+        self.assertEqual(
+            list(matching.iter_combinations_summing_to(amounts, [2])), [])
+
+    def test_get_combination_candidates(self):
+        orders = [order(order_id='3', total_charged='$1.00', tracking=str(n))
+                  for n in range(3)]
+        orders.append(order(order_id='4', total_charged='$1.00'))
+        near = transaction(amount='$2.00', date='2/28/14')
+        far = transaction(amount='$3.00', date='2/28/15')
+
+        candidates = matching.get_combination_candidates(
+            [near, far], orders, 3)
+
+        self.assertEqual(
+            [(amount, [o.tracking for o in combo])
+             for amount, combo in candidates],
+            [(2000000, ['0', '1']),
+             (2000000, ['0', '2']),
+             (2000000, ['1', '2'])])
+
+    def test_match_transactions_many_shipments(self):
+        orders = [order(order_id='3', total_charged='${}.00'.format(n + 1),
+                        tracking=str(n))
+                  for n in range(24)]
+        t = transaction(amount='$300.00', date='2/28/14', id=3)
+
+        matching.match_transactions([t], orders, 3)
+
+        self.assertEqual(len(t.orders), 24)
+
+    def test_match_transactions_too_many_shipments(self):
+        orders = [order(order_id='3', total_charged='${}.00'.format(n + 1),
+                        tracking=str(n))
+                  for n in range(matching.MAX_COMBINATION_ORDERS + 1)]
+        t = transaction(amount='$325.00', date='2/28/14', id=3)
+
+        matching.match_transactions([t], orders, 3)
+
+        self.assertFalse(t.orders)
+
+    def test_find_combination(self):
+        self.assertEqual(matching.find_combination([8, 4, 3, 2, 1], 7, 100),
+                         [1, 2])
+        self.assertEqual(
+            matching.find_combination([5, 5, 5], 10, 100), [0, 1])
+        self.assertIsNone(matching.find_combination([8, 4], 8, 100))
+        self.assertIsNone(matching.find_combination([8, 4, 3], 16, 100))
+
+    def test_find_combination_distinct_keys(self):
+        self.assertEqual(
+            matching.find_combination(
+                [5, 5, 5], 10, 100, keys=['A', 'A', 'B']), [0, 2])
+        self.assertIsNone(
+            matching.find_combination(
+                [5, 5, 3], 10, 100, keys=['A', 'A', 'B']))
+
+    def test_find_combination_budget(self):
+        amounts = list(range(60, 0, -2))
+        self.assertIsNotNone(matching.find_combination(amounts, 42, 1000))
+        self.assertIsNone(matching.find_combination(amounts, 1, 1000))
+        self.assertIsNone(matching.find_combination(amounts, 2 * 299, 5))
+
+    def test_match_transactions_across_orders(self):
+        o1 = order(order_id='1', total_charged='$6.00',
+                   shipment_date='02/28/14')
+        o2 = order(order_id='2', total_charged='$5.95',
+                   shipment_date='02/27/14')
+        o3 = order(order_id='3', total_charged='$5.95',
+                   shipment_date='02/01/14')
+        t = transaction(amount='$11.95', date='2/28/14', id=3)
+
+        matching.match_transactions([t], [o1, o2, o3], 3)
+        self.assertFalse(t.orders)
+
+        matching.match_transactions(
+            [t], [o1, o2, o3], 3, cross_order_budget=100)
+        self.assertEqual(t.orders, (o1, o2))
+        self.assertFalse(o3.matched)
+
+    def test_match_across_orders_needs_several_order_ids(self):
+        # Shipments of the same order only add up to t.
+        o1a = order(order_id='1', total_charged='$6.00', tracking='A')
+        o1b = order(order_id='1', total_charged='$5.95', tracking='B')
+        o2 = order(order_id='2', total_charged='$3.00')
+        t = transaction(amount='$11.95', date='2/28/14', id=3)
+
+        matching.match_across_orders([t], [o1a, o1b, o2], 3)
+
+        self.assertFalse(t.orders)
+        self.assertFalse(o1a.matched)
+
+    def test_match_across_orders_refunds(self):
+        r1 = refund(order_id='1', refund_amount='$6.00',
+                    refund_date='03/16/14')
+        r2 = refund(order_id='2', refund_amount='$5.95',
+                    refund_date='03/16/14')
+        # Refunds of $7.05 and $7.00 (incl. tax).
+        t = transaction(amount='$14.05', is_debit=False, date='3/16/14', id=4)
+
+        matching.match_across_orders([t], [r1, r2], 3)
+
+        self.assertEqual(set(t.orders), set([r1, r2]))
+
+    def test_match_transactions_amount_tolerance(self):
+        o1 = order(order_id='1', total_charged='$11.96',
+                   shipment_date='02/28/14')
+        o2 = order(order_id='2', total_charged='$11.95',
+                   shipment_date='02/25/14')
+        t1 = transaction(amount='$11.95', date='2/28/14', id=1)
+        t2 = transaction(amount='$11.95', date='3/1/14', id=2)
+
+        matching.match_transactions([t1, t2], [o1, o2], 3)
+        # Exact amounts only by default.
+        self.assertEqual(t1.orders, [o2])
+        self.assertFalse(t2.orders)
+
+        matching.match_transactions(
+            [t2], [o1], 3, amount_tolerance_cents=1)
+        self.assertEqual(t2.orders, [o1])
+
+    def test_pop_closest_prefers_exact_amounts(self):
+        o1 = order(order_id='1', total_charged='$11.96',
+                   shipment_date='02/28/14')
+        o2 = order(order_id='2', total_charged='$11.95',
+                   shipment_date='02/25/14')
+        o3 = order(order_id='3', total_charged='$11.93',
+                   shipment_date='02/28/14')
+        index = matching.CandidateIndex(
+            (o.transact_amount(), [o]) for o in [o1, o2, o3])
+
+        when = date(2014, 2, 28)
+        self.assertEqual(index.pop_closest(11950000, when, 3, 2), [o2])
+        self.assertEqual(index.pop_closest(11950000, when, 3, 2), [o1])
+        self.assertEqual(index.pop_closest(11950000, when, 3, 2), [o3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Counters and timings of where matching spends its time.
+
+Per transaction, matching counts the candidates (orders, refunds or
+combinations of them) it examined, and those rejected for being dated out
+of the window or already matched. Per order id, it counts the combinations
+of shipments generated. Each pass of matching is timed.
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import csv
+import time
+
+from mintamazontagger.currency import micro_usd_to_cents
+from mintamazontagger.currency import micro_usd_to_usd_string
+
+CANDIDATES = 'candidates'
+COMBINATIONS = 'combinations'
+DATE_REJECTIONS = 'date_rejections'
+MATCHED_REJECTIONS = 'matched_rejections'
+COUNTERS = (CANDIDATES, COMBINATIONS, DATE_REJECTIONS, MATCHED_REJECTIONS)
+
+TRACE_FIELDS = ('kind', 'key', 'amount_cents', 'seconds') + COUNTERS
+
+# The number of amounts and order ids listed by get_summary.
+SUMMARY_TOP_N = 5
+
+
+class MatchTrace:
+    """Counters per transaction and per order id, and seconds per pass."""
+
+    def __init__(self):
+        self.trans_counters = defaultdict(Counter)
+        self.order_id_counters = defaultdict(Counter)
+        self.pass_seconds = defaultdict(float)
+
+    def get_counters(self, t):
+        return self.trans_counters[t]
+
+    def get_order_id_counters(self, order_id):
+        return self.order_id_counters[order_id]
+
+    @contextmanager
+    def timed(self, pass_name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.pass_seconds[pass_name] += time.perf_counter() - start
+
+    def merge(self, other, trans):
+        """Adds the counts of other, whose transactions are indexes in trans.
+
+        See shardedmatching: pass seconds add up the time of all workers.
+        """
+        for shard_t, counters in other.trans_counters.items():
+            self.trans_counters[trans[shard_t.idx]].update(counters)
+        for order_id, counters in other.order_id_counters.items():
+            self.order_id_counters[order_id].update(counters)
+        for pass_name, seconds in other.pass_seconds.items():
+            self.pass_seconds[pass_name] += seconds
+
+    def get_totals(self):
+        totals = Counter({name: 0 for name in COUNTERS})
+        for counters in self.trans_counters.values():
+            totals.update(counters)
+        for counters in self.order_id_counters.values():
+            totals.update(counters)
+        return totals
+
+    def get_top_amounts(self, n=SUMMARY_TOP_N):
+        """Returns the (amount in cents, work) of the costliest amounts."""
+        work_by_amount = Counter()
+        for t, counters in self.trans_counters.items():
+            work_by_amount[micro_usd_to_cents(t.amount)] += sum(
+                counters.values())
+        return work_by_amount.most_common(n)
+
+    def get_top_order_ids(self, n=SUMMARY_TOP_N):
+        """Returns the (order id, combinations) of the costliest order ids."""
+        return Counter({
+            order_id: counters[COMBINATIONS]
+            for order_id, counters in self.order_id_counters.items()
+        }).most_common(n)
+
+    def get_summary(self):
+        totals = self.get_totals()
+        lines = ['Matching trace:']
+        lines.extend(
+            '  {}: {}'.format(name.replace('_', ' ').capitalize(),
+                              totals[name])
+            for name in COUNTERS)
+        lines.extend(
+            '  Pass "{}": {:.3f}s'.format(pass_name, seconds)
+            for pass_name, seconds in self.pass_seconds.items())
+        lines.extend(
+            '  Amount {}: {} candidates/rejections'.format(
+                micro_usd_to_usd_string(cents * 10000), work)
+            for cents, work in self.get_top_amounts())
+        lines.extend(
+            '  Order {}: {} combinations'.format(order_id, combinations)
+            for order_id, combinations in self.get_top_order_ids()
+            if combinations)
+        return '\n'.join(lines)
+
+    def write_csv(self, trace_path):
+        with open(trace_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(TRACE_FIELDS)
+            for pass_name, seconds in self.pass_seconds.items():
+                writer.writerow(
+                    ['pass', pass_name, '', '{:.6f}'.format(seconds)] +
+                    [''] * len(COUNTERS))
+            for t, counters in self.trans_counters.items():
+                writer.writerow(
+                    ['transaction', t.id, micro_usd_to_cents(t.amount), ''] +
+                    [counters[name] for name in COUNTERS])
+            for order_id, counters in self.order_id_counters.items():
+                writer.writerow(
+                    ['order_id', order_id, '', ''] +
+                    [counters[name] for name in COUNTERS])
@@ -0,0 +1,92 @@
+from collections import Counter
+import csv
+from datetime import date
+import os
+import tempfile
+import unittest
+
+from mintamazontagger import matching
+from mintamazontagger import shardedmatching
+from mintamazontagger.matchtrace import MatchTrace
+from mintamazontagger.mockdata import order, split_shipment, transaction
+
+
+def get_orders_and_trans():
+    o1 = order(order_id='1', shipment_date='02/26/14')
+    o2 = order(order_id='2', shipment_date='02/10/14')
+    # Order 3's two shipments ($6.45 + $10.90) are charged together.
+    o3s, _ = split_shipment('3')
+    t1 = transaction(amount='$11.95', date='2/27/14', id=1)
+    t2 = transaction(amount='$17.35', date='2/28/14', id=2)
+    return [o1, o2] + o3s, [t1, t2]
+
+
+class MatchTraceClass(unittest.TestCase):
+    def test_match_transactions(self):
+        orders, trans = get_orders_and_trans()
+        trace = MatchTrace()
+
+        matching.match_transactions(trans, orders, 3, trace=trace)
+
+        # o2 is too far away.
+        self.assertEqual(
+            trace.get_counters(trans[0]),
+            Counter(candidates=2, date_rejections=1))
+        self.assertEqual(trace.get_counters(trans[1]), Counter(candidates=1))
+        self.assertEqual(
+            trace.get_order_id_counters('3'), Counter(combinations=4))
+        self.assertEqual(
+            set(trace.pass_seconds), set(['singles', 'combinations']))
+        self.assertEqual(
+            trace.get_totals(),
+            Counter(candidates=3, combinations=4, date_rejections=1,
+                    matched_rejections=0))
+        self.assertEqual(trace.get_top_order_ids(), [('3', 4)])
+
+    def test_match_orders_and_refunds(self):
+        orders, trans = get_orders_and_trans()
+        trace = MatchTrace()
+
+        shardedmatching.match_orders_and_refunds(
+            trans, orders, [], 3, max_workers=2, trace=trace)
+
+        self.assertEqual(trans[1].orders, orders[2:])
+        self.assertEqual(
+            trace.get_counters(trans[0]),
+            Counter(candidates=2, date_rejections=1))
+        self.assertEqual(
+            trace.get_order_id_counters('3'), Counter(combinations=4))
+
+    def test_pop_closest_counts_matched_rejections(self):
+        o1 = order(order_id='1', shipment_date='02/24/14')
+        o2 = order(order_id='1', shipment_date='02/25/14')
+        index = matching.CandidateIndex([(10, [o1, o2]), (10, [o2])])
+        o1.matched = True
+        counters = Counter()
+
+        index.pop_closest(10, date(2014, 2, 24), 3, counters=counters)
+        self.assertEqual(
+            counters, Counter(candidates=3, matched_rejections=1))
+
+    def test_write_csv(self):
+        orders, trans = get_orders_and_trans()
+        trace = MatchTrace()
+        matching.match_transactions(trans, orders, 3, trace=trace)
+
+        with tempfile.TemporaryDirectory() as trace_dir:
+            trace_path = os.path.join(trace_dir, 'trace.csv')
+            trace.write_csv(trace_path)
+            with open(trace_path, newline='') as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(
+            [(r['kind'], r['key']) for r in rows],
+            [('pass', 'singles'), ('pass', 'combinations'),
+             ('transaction', '1'), ('transaction', '2'), ('order_id', '3')])
+        self.assertEqual(rows[2]['amount_cents'], '1195')
+        self.assertEqual(rows[2]['date_rejections'], '1')
+        self.assertIn('Order 3: 4 combinations', trace.get_summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
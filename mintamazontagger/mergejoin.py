@@ -0,0 +1,107 @@
+"""Out-of-core association of Amazon Items with their Orders.
+
+associate_items_with_orders groups the entire history by order id in memory.
+Here, both reports are instead sorted by order id externally: sorted runs of
+at most chunk_size records are spilled to temporary files and then merged
+back (heapq.merge) one record at a time. The two sorted streams are then
+merge-joined, so only one order id's orders and items are held at a time.
+"""
+
+import heapq
+import itertools
+import operator
+import pickle
+import tempfile
+
+from mintamazontagger.amazon import DEFAULT_ASSOCIATION_BUDGET
+from mintamazontagger.amazon import associate_items_with_orders_by_oid
+from mintamazontagger.amazon import iter_chunks
+
+# Max number of records sorted in memory at once, before spilling to disk.
+EXTERNAL_SORT_CHUNK_SIZE = 100000
+
+get_order_id = operator.attrgetter('order_id')
+
+
+def spill_run(records, tmp_dir=None):
+    """Writes records to an (anonymous) temp file; returns the file."""
+    run = tempfile.TemporaryFile(dir=tmp_dir)
+    pickler = pickle.Pickler(run, pickle.HIGHEST_PROTOCOL)
+    for r in records:
+        pickler.dump(r)
+        # Records are not shared across a run: don't keep them all memoized.
+        pickler.clear_memo()
+    run.seek(0)
+    return run
+
+
+def iter_run(run):
+    """Yields the records in a spilled run, closing it when done."""
+    with run:
+        unpickler = pickle.Unpickler(run)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def external_sort(records, key=get_order_id,
+                  chunk_size=EXTERNAL_SORT_CHUNK_SIZE, tmp_dir=None):
+    """Yields records (any iterable) sorted by key, in bounded memory.
+
+    The sort is stable. If all records fit in a single chunk, nothing is
+    spilled to disk.
+    """
+    runs = []
+    for chunk in iter_chunks(records, chunk_size):
+        chunk.sort(key=key)
+        if len(chunk) < chunk_size and not runs:
+            # The only chunk: sort in memory.
+            yield from chunk
+            return
+        runs.append(spill_run(chunk, tmp_dir))
+        del chunk
+    yield from heapq.merge(*[iter_run(run) for run in runs], key=key)
+
+
+def merge_join_by_order_id(sorted_orders, sorted_items):
+    """Yields (order_id, orders, items) from streams sorted by order id.
+
+    Only order ids with orders are yielded; items without an order (e.g. from
+    orders that have not shipped yet) are skipped.
+    """
+    item_groups = itertools.groupby(sorted_items, key=get_order_id)
+    item_oid, items = next(item_groups, (None, None))
+    for oid, orders in itertools.groupby(sorted_orders, key=get_order_id):
+        while item_oid is not None and item_oid < oid:
+            item_oid, items = next(item_groups, (None, None))
+        if item_oid == oid:
+            yield oid, list(orders), list(items)
+            item_oid, items = next(item_groups, (None, None))
+        else:
+            yield oid, list(orders), []
+
+
+def iter_associated_orders(orders, items, itemProgress=None,
+                           budget=DEFAULT_ASSOCIATION_BUDGET,
+                           assignment_cache=None,
+                           chunk_size=EXTERNAL_SORT_CHUNK_SIZE, tmp_dir=None):
+    """Like associate_items_with_orders, one order id at a time.
+
+    orders and items can be any iterables (e.g. Order.iter_from_csv and
+    iter_associable_items). Yields (order id, orders, whether the search gave
+    up), in order id order, whether or not items were associated with the
+    orders.
+
+    Once a report spills to disk, the records yielded are copies read back,
+    not the ones given: stream the records in (e.g. straight from the
+    reports) and keep the ones yielded.
+    """
+    for oid, oid_orders, oid_items in merge_join_by_order_id(
+            external_sort(orders, chunk_size=chunk_size, tmp_dir=tmp_dir),
+            external_sort(items, chunk_size=chunk_size, tmp_dir=tmp_dir)):
+        gave_up = associate_items_with_orders_by_oid(
+            oid_orders, {oid: oid_items}, itemProgress, budget,
+            assignment_cache=assignment_cache)
+        yield oid, oid_orders, bool(gave_up)
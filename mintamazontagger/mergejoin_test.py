@@ -0,0 +1,120 @@
+import unittest
+
+from mintamazontagger import amazon
+from mintamazontagger import mergejoin
+from mintamazontagger.mockdata import csv_file, item_dict, order_dict
+from mintamazontagger.mockdata import item, order, split_shipment
+
+
+def make_orders_and_items():
+    # Order C is shipped in two packages; its records are interleaved with
+    # those of other orders.
+    c_orders, c_items = split_shipment('C')
+    orders = [
+        c_orders[0],
+        order(order_id='A'),
+        c_orders[1],
+        order(order_id='B'),
+        order(order_id='E'),
+    ]
+    items = [
+        item(order_id='B'),
+        c_items[0],
+        item(order_id='D'),
+        item(order_id='A'),
+        c_items[1],
+    ]
+    return orders, items
+
+
+class MergeJoinMethods(unittest.TestCase):
+    def test_external_sort_in_memory(self):
+        orders, _ = make_orders_and_items()
+        self.assertEqual(
+            [o.order_id for o in mergejoin.external_sort(orders)],
+            ['A', 'B', 'C', 'C', 'E'])
+
+    def test_external_sort_spills(self):
+        orders, _ = make_orders_and_items()
+        sorted_orders = list(mergejoin.external_sort(orders, chunk_size=2))
+
+        self.assertEqual(
+            [o.order_id for o in sorted_orders], ['A', 'B', 'C', 'C', 'E'])
+        # Stable: the shipments of order C keep their report order.
+        self.assertEqual(
+            [o.tracking for o in sorted_orders if o.order_id == 'C'],
+            ['A', 'B'])
+
+    def test_external_sort_empty(self):
+        self.assertEqual(list(mergejoin.external_sort([])), [])
+
+    def test_merge_join_by_order_id(self):
+        orders, items = make_orders_and_items()
+        joined = mergejoin.merge_join_by_order_id(
+            mergejoin.external_sort(orders, chunk_size=2),
+            mergejoin.external_sort(items, chunk_size=2))
+
+        self.assertEqual(
+            [(oid, len(oid_orders), len(oid_items))
+             for oid, oid_orders, oid_items in joined],
+            [('A', 1, 1), ('B', 1, 1), ('C', 2, 2), ('E', 1, 0)])
+
+    def test_iter_associated_orders(self):
+        orders, items = make_orders_and_items()
+        amazon.associate_items_with_orders(orders, items)
+        expected = sorted(
+            (o.order_id, o.tracking,
+             sorted([(i.quantity, i.item_subtotal) for i in o.items]))
+            for o in orders)
+
+        for chunk_size in [2, mergejoin.EXTERNAL_SORT_CHUNK_SIZE]:
+            orders, items = make_orders_and_items()
+            results = list(mergejoin.iter_associated_orders(
+                orders, items, chunk_size=chunk_size))
+            associated = [o for _, oid_orders, _ in results
+                          for o in oid_orders]
+
+            self.assertEqual(
+                sorted((o.order_id, o.tracking,
+                        sorted([(i.quantity, i.item_subtotal)
+                                for i in o.items]))
+                       for o in associated),
+                expected)
+            self.assertEqual(
+                [o.items_matched for o in associated],
+                [True, True, True, True, False])
+            self.assertEqual(
+                [(oid, gave_up) for oid, _, gave_up in results],
+                [('A', False), ('B', False), ('C', False), ('E', False)])
+
+    def test_iter_associated_orders_from_reports_spilled(self):
+        orders = amazon.Order.iter_from_csv(csv_file([
+            order_dict(order_id='3'),
+            order_dict(order_id='1'),
+            order_dict(order_id='2', subtotal='$5.00'),
+        ]))
+        items = amazon.iter_associable_items(amazon.Item.iter_from_csv(
+            csv_file([
+                item_dict(order_id='2'),
+                item_dict(order_id='1'),
+                item_dict(order_id='3'),
+            ])))
+
+        # The orders and items read back from disk are what the caller sees.
+        associated = [
+            o for _, oid_orders, _ in mergejoin.iter_associated_orders(
+                orders, items, chunk_size=2)
+            for o in oid_orders]
+
+        self.assertEqual([o.order_id for o in associated], ['1', '2', '3'])
+        self.assertEqual(
+            [o.items_matched for o in associated], [True, False, True])
+        self.assertEqual(
+            [[i.order_id for i in o.items] for o in associated],
+            [['1'], [], ['3']])
+        self.assertTrue(all(i.matched for o in associated for i in o.items))
+        self.assertIs(associated[0].items[0].order, associated[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
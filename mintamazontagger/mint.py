@@ -1,12 +1,12 @@
 from collections import defaultdict
 from copy import deepcopy
-from datetime import date, datetime
 import re
 
 from mintamazontagger import category
 from mintamazontagger.currency import micro_usd_to_usd_string
-from mintamazontagger.currency import parse_usd_as_micro_usd
+from mintamazontagger.currency import parse_usd_column
 from mintamazontagger.currency import round_micro_usd_to_cent
+from mintamazontagger.dates import parse_date, parse_dates
 
 
 def truncate_title(title, target_length, base_str=None):
@@ -38,32 +38,43 @@ def convertCamel_to_underscores(name):
 
 
 def pythonify_mint_dict(raw_dict):
-    # Parse out the date fields into datetime.date objects.
-    raw_dict['date'] = parse_mint_date(raw_dict['date'])
-    raw_dict['odate'] = parse_mint_date(raw_dict['odate'])
+    return pythonify_mint_dicts([raw_dict])[0]
 
-    # Parse the amount into micro usd.
-    amount = parse_usd_as_micro_usd(raw_dict['amount'])
-    # Adjust credit transactions such that:
-    # - debits are positive
-    # - credits are negative
-    if not raw_dict['isDebit']:
-        amount *= -1
-    raw_dict['amount'] = amount
 
-    return dict([
-        (convertCamel_to_underscores(k.replace(' ', '_')), v)
-        for k, v in raw_dict.items()
-    ])
+def pythonify_mint_dicts(raw_dicts):
+    """Pythonifies a list of Mint transaction dicts, in order."""
+    # Parse out the date fields into datetime.date objects and the amount
+    # into micro usd, a whole column at a time.
+    dates = parse_mint_dates([raw_dict['date'] for raw_dict in raw_dicts])
+    odates = parse_mint_dates([raw_dict['odate'] for raw_dict in raw_dicts])
+    amounts = parse_usd_column([raw_dict['amount'] for raw_dict in raw_dicts])
+
+    results = []
+    for raw_dict, date, odate, amount in zip(
+            raw_dicts, dates, odates, amounts):
+        raw_dict['date'] = date
+        raw_dict['odate'] = odate
+
+        # Adjust credit transactions such that:
+        # - debits are positive
+        # - credits are negative
+        if not raw_dict['isDebit']:
+            amount *= -1
+        raw_dict['amount'] = amount
+
+        results.append(dict([
+            (convertCamel_to_underscores(k.replace(' ', '_')), v)
+            for k, v in raw_dict.items()
+        ]))
+    return results
 
 
 def parse_mint_date(date_str):
-    current_year = datetime.isocalendar(date.today())[0]
-    try:
-        new_date = datetime.strptime(date_str + str(current_year), '%b %d%Y')
-    except ValueError:
-        new_date = datetime.strptime(date_str, '%m/%d/%y')
-    return new_date.date()
+    return parse_date(date_str)
+
+
+def parse_mint_dates(date_strs):
+    return parse_dates(date_strs)
 
 
 class Transaction(object):
@@ -77,6 +88,13 @@ class Transaction(object):
     def __init__(self, raw_dict):
         self.__dict__.update(pythonify_mint_dict(raw_dict))
 
+    @classmethod
+    def from_fields(cls, fields):
+        """Creates a transaction from an already pythonified dict."""
+        trans = cls.__new__(cls)
+        trans.__dict__.update(fields)
+        return trans
+
     def split(self, amount, category, desc, note, is_debit=True):
         """Returns a new Transaction split from self."""
         item = deepcopy(self)
@@ -138,7 +156,8 @@ class Transaction(object):
 
     @classmethod
     def parse_from_json(cls, json_dicts):
-        return [cls(raw_dict) for raw_dict in json_dicts]
+        return [cls.from_fields(fields)
+                for fields in pythonify_mint_dicts(list(json_dicts))]
 
     @staticmethod
     def sum_amounts(trans):
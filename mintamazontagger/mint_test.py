@@ -4,7 +4,7 @@ import unittest
 from mintamazontagger import category
 from mintamazontagger import mint
 from mintamazontagger.mint import Transaction
-from mintamazontagger.mockdata import transaction
+from mintamazontagger.mockdata import transaction, transaction_json
 
 
 class HelpMethods(unittest.TestCase):
@@ -73,6 +73,22 @@ class TransactionClass(unittest.TestCase):
         self.assertEqual(trans.amount, -423120000)
         self.assertFalse(trans.is_debit)
 
+    def test_parse_from_json(self):
+        trans = Transaction.parse_from_json([
+            transaction_json(id=1),
+            transaction_json(id=2, amount='$1.50', is_debit=False),
+            transaction_json(id=3, date='3/1/14'),
+        ])
+
+        self.assertEqual([t.id for t in trans], [1, 2, 3])
+        self.assertEqual(
+            [t.amount for t in trans], [11950000, -1500000, 11950000])
+        self.assertEqual(
+            [t.date for t in trans],
+            [date(2014, 2, 28), date(2014, 2, 28), date(2014, 3, 1)])
+        self.assertEqual(trans[0].odate, date(2014, 2, 28))
+        self.assertFalse(trans[0].matched)
+
     def test_split(self):
         trans = transaction()
         strans = trans.split(1234, 'Shopping', 'Some new item', 'Test note')
@@ -1,4 +1,6 @@
 from collections import OrderedDict
+import csv
+import io
 
 from mintamazontagger import amazon
 from mintamazontagger import mint
@@ -20,6 +22,38 @@ def refund(*args, **kwargs):
     return amazon.Refund(refund_dict(*args, **kwargs))
 
 
+def split_shipment(order_id='A'):
+    """Returns (orders, items) of an order shipped in two packages.
+
+    A quantity 3 item ($16.35) and a $1.00 item are shipped as $6.45 and
+    $10.90 (w/o matching tracking), so the quantity 3 item is split up.
+    """
+    orders = [
+        order(order_id=order_id, subtotal='$6.45', tax_charged='$0.00',
+              total_charged='$6.45', tracking='A'),
+        order(order_id=order_id, subtotal='$10.90', tax_charged='$0.00',
+              total_charged='$10.90', tracking='B')]
+    items = [
+        item(order_id=order_id, quantity=3, item_subtotal='$16.35',
+             tracking='C'),
+        item(order_id=order_id, quantity=1, item_subtotal='$1.00',
+             tracking='C')]
+    return orders, items
+
+
+def csv_text(dicts):
+    """Renders report dicts (e.g. from order_dict) as Amazon CSV text."""
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(dicts[0].keys()))
+    writer.writeheader()
+    writer.writerows(dicts)
+    return out.getvalue()
+
+
+def csv_file(dicts):
+    return io.StringIO(csv_text(dicts))
+
+
 def transaction_json(
         amount='$11.95',
         is_debit=True,
@@ -0,0 +1,180 @@
+# Partitions integer values (e.g. item subtotals in cents) into bins that
+# must sum exactly to given targets (e.g. shipment subtotals in cents).
+#
+# Bins are filled one at a time (smallest target first) by a backtracking
+# search, with pruning:
+# - Identical values are interchangeable, so values are handled as a multiset
+#   (distinct value -> count) and each arrangement is explored only once.
+# - A subset-sum reachability bitset (per suffix of distinct values) prunes
+#   any partial fill whose remaining amount can no longer be reached.
+# - Before filling a bin, every remaining target must still be reachable with
+#   the remaining values.
+# - Failed states (bin, remaining counts) are memoized.
+#
+# Negative values or targets (e.g. refund or promotion lines) break the
+# pruning: a partial sum can overshoot and come back. Those multisets are
+# instead searched without pruning (still a multiset, and memoized), trying
+# every split of the remaining counts within max_nodes steps.
+
+from collections import defaultdict
+
+# The search recurses per bin and per distinct value; bail out well before
+# Python's recursion limit.
+MAX_SEARCH_DEPTH = 500
+
+
+class SubsetPartitioner:
+    """Finds an assignment of a multiset of values to bins with exact sums.
+
+    solve_counts() returns, per bin, the count taken of each distinct value,
+    or None if there is no such assignment or the search exceeded max_nodes
+    steps (in which case exhausted is True). nodes counts the steps taken.
+    """
+
+    def __init__(self, targets, max_nodes=None):
+        self.targets = targets
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.exhausted = False
+
+    def solve_counts(self, distinct_values, counts):
+        """Partitions a multiset of values into the bins.
+
+        distinct_values are the distinct values (in decreasing order) and
+        counts their multiplicities (see get_weighted_multiset).
+        """
+        self.distinct_values = distinct_values
+        if not self.targets:
+            return None
+        if (sum([v * c for v, c in zip(distinct_values, counts)]) !=
+                sum(self.targets)):
+            return None
+        if len(distinct_values) + len(self.targets) > MAX_SEARCH_DEPTH:
+            self.exhausted = True
+            return None
+
+        # Small targets have the fewest ways to be filled: do them first.
+        self.bin_order = sorted(
+            range(len(self.targets)), key=lambda b: self.targets[b])
+        self.bin_counts = [None] * len(self.targets)
+        self.failed = set()
+        if (any(v < 0 for v in distinct_values) or
+                any(t < 0 for t in self.targets)):
+            fill = self.fill_unpruned
+        else:
+            fill = self.fill
+        if not fill(0, list(counts)):
+            return None
+        return self.bin_counts
+
+    def fill(self, k, counts):
+        if k == len(self.bin_order):
+            return not any(counts)
+        key = (k, tuple(counts))
+        if key in self.failed:
+            return False
+
+        reach = self.get_reachability(
+            counts, max([self.targets[b] for b in self.bin_order[k:]]))
+        if all((reach[0] >> self.targets[b]) & 1
+               for b in self.bin_order[k:]):
+            b = self.bin_order[k]
+            for take in self.iter_fills(
+                    0, self.targets[b], counts, [0] * len(counts), reach):
+                self.bin_counts[b] = take
+                if self.fill(k + 1, [c - t for c, t in zip(counts, take)]):
+                    return True
+                if self.exhausted:
+                    return False
+        self.failed.add(key)
+        return False
+
+    def fill_unpruned(self, k, counts):
+        """Like fill, for values or targets that may be negative."""
+        b = self.bin_order[k]
+        if k == len(self.bin_order) - 1:
+            # The totals match, so the rest sums to the last target.
+            self.bin_counts[b] = list(counts)
+            return True
+        key = (k, tuple(counts))
+        if key in self.failed:
+            return False
+        for take in self.iter_unpruned_fills(
+                0, self.targets[b], counts, [0] * len(counts)):
+            self.bin_counts[b] = take
+            if self.fill_unpruned(
+                    k + 1, [c - t for c, t in zip(counts, take)]):
+                return True
+            if self.exhausted:
+                return False
+        self.failed.add(key)
+        return False
+
+    def iter_unpruned_fills(self, j, remaining, counts, take):
+        """Yields each way to fill `remaining`, trying every count."""
+        if j == len(counts):
+            if remaining == 0:
+                yield list(take)
+            return
+        value = self.distinct_values[j]
+        for c in range(counts[j], -1, -1):
+            self.nodes += 1
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                self.exhausted = True
+                return
+            take[j] = c
+            yield from self.iter_unpruned_fills(
+                j + 1, remaining - c * value, counts, take)
+            if self.exhausted:
+                return
+        take[j] = 0
+
+    def get_reachability(self, counts, max_target):
+        """Returns per suffix j, a bitset of sums reachable by values[j:]."""
+        limit = (1 << (max_target + 1)) - 1
+        reach = [0] * (len(counts) + 1)
+        reach[-1] = 1
+        for j in range(len(counts) - 1, -1, -1):
+            shifted = reach[j + 1]
+            reachable = shifted
+            for _ in range(counts[j]):
+                shifted = (shifted << self.distinct_values[j]) & limit
+                if not shifted:
+                    break
+                reachable |= shifted
+            reach[j] = reachable
+        return reach
+
+    def iter_fills(self, j, remaining, counts, take, reach):
+        """Yields each way (count per distinct value) to fill `remaining`."""
+        if remaining == 0:
+            yield list(take)
+            return
+        value = self.distinct_values[j]
+        for c in range(min(counts[j], remaining // value), -1, -1):
+            if not (reach[j + 1] >> (remaining - c * value)) & 1:
+                continue
+            self.nodes += 1
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                self.exhausted = True
+                return
+            take[j] = c
+            yield from self.iter_fills(
+                j + 1, remaining - c * value, counts, take, reach)
+            if self.exhausted:
+                return
+        take[j] = 0
+
+
+def get_weighted_multiset(value_counts):
+    """Returns (distinct values in decreasing order, their counts).
+
+    value_counts are (value, count) pairs; values may repeat.
+    """
+    counts_by_value = defaultdict(int)
+    for v, c in value_counts:
+        counts_by_value[v] += c
+    # Zero values fit anywhere; they are assigned to the first bin.
+    distinct_values = sorted(
+        [v for v in counts_by_value if v != 0], reverse=True)
+    return distinct_values, [counts_by_value[v] for v in distinct_values]
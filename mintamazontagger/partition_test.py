@@ -0,0 +1,93 @@
+import unittest
+
+from mintamazontagger import partition
+
+
+def solve(values, targets, max_nodes=None):
+    """Returns (the partitioner, bin sums or None) for a list of values."""
+    partitioner = partition.SubsetPartitioner(targets, max_nodes)
+    distinct_values, counts = partition.get_weighted_multiset(
+        (v, 1) for v in values)
+    bin_counts = partitioner.solve_counts(distinct_values, counts)
+    if bin_counts is None:
+        return partitioner, None
+    return partitioner, [
+        sum([v * c for v, c in zip(distinct_values, counts)])
+        for counts in bin_counts]
+
+
+class PartitionMethods(unittest.TestCase):
+    def test_solve_counts_identical_values(self):
+        targets = [400, 1200, 1400]
+
+        _, sums = solve([200] * 15, targets)
+
+        self.assertEqual(sums, targets)
+
+    def test_solve_counts_mixed_values(self):
+        values = [1099, 250, 3100, 99, 1200, 5001, 250, 1]
+        targets = [3100, 1200 + 1099 + 1, 5001 + 250 + 250 + 99]
+
+        _, sums = solve(values, targets)
+
+        self.assertEqual(sums, targets)
+
+    def test_solve_counts_zero_values(self):
+        # Zero values are left out of the multiset.
+        self.assertEqual(
+            partition.get_weighted_multiset([(0, 2), (500, 1)]),
+            ([500], [1]))
+        self.assertEqual(solve([0, 500, 0], [500])[1], [500])
+
+    def test_solve_counts_impossible(self):
+        self.assertIsNone(solve([300, 300], [500])[1])
+        self.assertIsNone(solve([300, 300], [400, 200])[1])
+        self.assertIsNone(solve([300], [])[1])
+
+    def test_solve_counts_negative_values(self):
+        # A promotion line (negative subtotal) in the second shipment.
+        values = [1000, 500, -200, 300]
+        targets = [500, 1000 - 200 + 300]
+
+        _, sums = solve(values, targets)
+
+        self.assertEqual(sums, targets)
+        self.assertEqual(solve([500, -500], [0, 0])[1], [0, 0])
+        self.assertEqual(solve([-300, -200], [-200, -300])[1], [-200, -300])
+        self.assertIsNone(solve([1000, -200], [300, 500])[1])
+
+    def test_solve_counts_many_shipments(self):
+        # Dozens of items across a dozen shipments.
+        values = [(i % 7 + 1) * 111 for i in range(48)]
+        targets = [sum(values[i::12]) for i in range(12)]
+
+        partitioner, sums = solve(values, targets)
+
+        self.assertEqual(sums, targets)
+        self.assertFalse(partitioner.exhausted)
+
+    def test_solve_counts_max_nodes(self):
+        values = [(i % 7 + 1) * 111 for i in range(48)]
+        targets = [sum(values[i::12]) for i in range(12)]
+
+        partitioner, sums = solve(values, targets, max_nodes=5)
+
+        self.assertIsNone(sums)
+        self.assertTrue(partitioner.exhausted)
+
+    def test_get_weighted_multiset(self):
+        self.assertEqual(
+            partition.get_weighted_multiset(
+                [(300, 12), (0, 2), (700, 5), (300, 1)]),
+            ([700, 300], [5, 13]))
+
+    def test_solve_counts(self):
+        partitioner = partition.SubsetPartitioner([1300, 4400, 1400])
+
+        bin_counts = partitioner.solve_counts([700, 300], [5, 12])
+
+        self.assertEqual(bin_counts, [[1, 2], [2, 10], [2, 0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+"""On-disk cache of parsed Amazon reports.
+
+Parsing multi-year reports dominates start-up time, yet the same report files
+are typically re-read run after run. The parsed records are pickled next to
+a key of the source file's size and modification time; as long as the report
+is unchanged, the records are loaded from the cache instead of re-parsed.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+
+from mintamazontagger.amazon import get_report_path
+from mintamazontagger.atomicfile import open_atomic
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+logger.setLevel(logging.INFO)
+
+# Bump whenever the pickled record format changes (e.g. new FIELDS).
+CACHE_VERSION = 4
+
+REPORT_CACHE_FMT = '{} {}.pickle'
+
+
+def get_cache_key(record_cls, report_path):
+    stat = os.stat(report_path)
+    return (CACHE_VERSION, record_cls.__name__, report_path,
+            stat.st_size, stat.st_mtime_ns)
+
+
+def get_cache_path(record_cls, report_path, cache_base_path):
+    path_digest = hashlib.sha1(report_path.encode('utf-8')).hexdigest()
+    return os.path.join(
+        cache_base_path,
+        REPORT_CACHE_FMT.format(record_cls.__name__, path_digest))
+
+
+def load_cached_report(cache_path, cache_key):
+    """Returns the cached records for cache_key, or None on a cache miss."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as f:
+            key, records = pickle.load(f)
+    # E.g. a truncated file, or one pickled by a different (version of the)
+    # tagger: a missing module (ModuleNotFoundError is an ImportError) or
+    # class, or an unexpected pickled value.
+    except (EOFError, pickle.UnpicklingError, AttributeError, ValueError,
+            ImportError, TypeError):
+        logger.warning('Ignoring unreadable report cache: {}'.format(
+            cache_path))
+        return None
+    return records if key == cache_key else None
+
+
+def dump_cached_report(cache_path, cache_key, records):
+    with open_atomic(cache_path, 'wb') as f:
+        pickle.dump((cache_key, records), f, pickle.HIGHEST_PROTOCOL)
+
+
+def load_from_cache(record_cls, csv_file, cache_base_path):
+    """Returns the cached records for csv_file, or None on a cache miss."""
+    report_path = get_report_path(csv_file)
+    if not cache_base_path or not report_path:
+        return None
+    records = load_cached_report(
+        get_cache_path(record_cls, report_path, cache_base_path),
+        get_cache_key(record_cls, report_path))
+    if records is not None:
+        logger.info('Loaded {} {}s from the report cache'.format(
+            len(records), record_cls.__name__))
+    return records
+
+
+def save_to_cache(record_cls, csv_file, cache_base_path, records):
+    report_path = get_report_path(csv_file)
+    if not cache_base_path or not report_path:
+        return
+    dump_cached_report(
+        get_cache_path(record_cls, report_path, cache_base_path),
+        get_cache_key(record_cls, report_path),
+        records)
+
+
+def parse_from_csv_cached(record_cls, csv_file, cache_base_path,
+                          make_progress=None):
+    """Like record_cls.parse_from_csv, but backed by the report cache.
+
+    Falls back to a plain parse if there is no cache location or csv_file is
+    not a regular file. make_progress, if given, is only called (to create
+    the parse's progress indicator) when the report is actually parsed.
+    """
+    records = load_from_cache(record_cls, csv_file, cache_base_path)
+    if records is None:
+        progress = make_progress() if make_progress else None
+        records = record_cls.parse_from_csv(csv_file, progress)
+        save_to_cache(record_cls, csv_file, cache_base_path, records)
+    return records
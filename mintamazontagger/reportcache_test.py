@@ -0,0 +1,98 @@
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from mintamazontagger import reportcache
+from mintamazontagger.amazon import Order
+from mintamazontagger.mockdata import csv_file, csv_text, order_dict
+
+
+class ReportCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+        self.report_path = os.path.join(self.tmp_dir, 'Orders.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_report(self, dicts):
+        with open(self.report_path, 'w', encoding='utf-8') as f:
+            f.write(csv_text(dicts))
+
+    def parse(self):
+        with open(self.report_path, encoding='utf-8') as f:
+            return reportcache.parse_from_csv_cached(
+                Order, f, self.cache_dir)
+
+    def test_parse_from_csv_cached(self):
+        self.write_report([order_dict(order_id='1')])
+
+        orders = self.parse()
+        self.assertEqual([o.order_id for o in orders], ['1'])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        cached_orders = self.parse()
+        self.assertEqual([o.order_id for o in cached_orders], ['1'])
+        self.assertEqual(cached_orders[0].total_charged, 11950000)
+        self.assertEqual(
+            cached_orders[0].raw_dict(), orders[0].raw_dict())
+
+    def test_parse_from_csv_cached_report_changed(self):
+        self.write_report([order_dict(order_id='1')])
+        self.parse()
+
+        self.write_report(
+            [order_dict(order_id='1'), order_dict(order_id='22')])
+        orders = self.parse()
+
+        self.assertEqual([o.order_id for o in orders], ['1', '22'])
+
+    def test_parse_from_csv_cached_progress_only_when_parsing(self):
+        self.write_report([order_dict(order_id='1')])
+        made = []
+
+        def make_progress():
+            made.append(True)
+            return None
+
+        with open(self.report_path, encoding='utf-8') as f:
+            reportcache.parse_from_csv_cached(
+                Order, f, self.cache_dir, make_progress)
+        with open(self.report_path, encoding='utf-8') as f:
+            reportcache.parse_from_csv_cached(
+                Order, f, self.cache_dir, make_progress)
+
+        self.assertEqual(made, [True])
+
+    def test_parse_from_csv_cached_unreadable_cache(self):
+        self.write_report([order_dict(order_id='1')])
+        self.parse()
+        cache_path = os.path.join(
+            self.cache_dir, os.listdir(self.cache_dir)[0])
+
+        for cached in (
+                # A class from a module that no longer exists.
+                b'cno_such_tagger_module\nOrder\n.',
+                # Not a (key, records) pair.
+                pickle.dumps(5),
+                b'\x80'):
+            with open(cache_path, 'wb') as f:
+                f.write(cached)
+
+            orders = self.parse()
+
+            self.assertEqual([o.order_id for o in orders], ['1'])
+
+    def test_parse_from_csv_cached_not_a_file(self):
+        orders = reportcache.parse_from_csv_cached(
+            Order, csv_file([order_dict()]), self.cache_dir)
+
+        self.assertEqual(len(orders), 1)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+
+if __name__ == '__main__':
+    unittest.main()
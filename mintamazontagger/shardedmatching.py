@@ -0,0 +1,196 @@
+"""Matching of transactions to orders and refunds over a process pool.
+
+Orders are only ever charged (positive amounts) and refunds credited
+(negative amounts), so debits and credits are matched independently: orders
+and refunds are matched concurrently rather than one after the other.
+
+The first pass (one order per transaction, see matching.match_singles) only
+has transactions compete with others of the same amount, or within the
+amount tolerance. It is further sharded by amount: a shard is a run of
+amounts (in cents) with no gap larger than the tolerance. The passes that
+combine orders (of any amounts) run over all that the first pass left, one
+shard per sign.
+
+Workers are only sent the amounts, dates and order ids involved, and return
+(transaction index, order indexes) pairs that are then matched here. The
+result is the same as matching.match_transactions on all transactions with
+orders, then on those left with refunds (except for transactions within the
+amount tolerance of $0, which are only matched to orders unless negative).
+"""
+
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+
+from mintamazontagger import matching
+from mintamazontagger.matchtrace import MatchTrace
+
+# Shards sent to a worker at once (most shards are a single amount).
+MATCH_SHARD_CHUNK_SIZE = 64
+
+
+class ShardTransaction:
+    """The parts of a Mint transaction that matching needs."""
+
+    __slots__ = ('idx', 'amount', 'odate', 'orders')
+
+    def __init__(self, idx, amount, odate):
+        self.idx = idx
+        self.amount = amount
+        self.odate = odate
+        self.orders = []
+
+    def match(self, orders):
+        self.orders = orders
+
+
+class ShardOrder:
+    """The parts of an Order (or Refund) that matching needs."""
+
+    __slots__ = ('idx', 'order_id', 'amount', 'date', 'matched')
+
+    def __init__(self, idx, order_id, amount, date):
+        self.idx = idx
+        self.order_id = order_id
+        self.amount = amount
+        self.date = date
+        self.matched = False
+
+    def transact_date(self):
+        return self.date
+
+    def transact_amount(self):
+        return self.amount
+
+    def match(self, trans):
+        self.matched = True
+
+
+def get_trans_rows(trans):
+    return [(idx, t.amount, t.odate) for idx, t in enumerate(trans)]
+
+
+def get_order_rows(orders):
+    return [(idx, o.order_id, o.transact_amount(), o.transact_date())
+            for idx, o in enumerate(orders)]
+
+
+def get_amount_shards(trans_rows, order_rows, tolerance_cents=0):
+    """Splits rows into shards of amounts that cannot match across.
+
+    Yields (trans rows, order rows) pairs, each in their original order.
+    Shards without either transactions or orders are skipped.
+    """
+    rows_by_bucket = defaultdict(lambda: ([], []))
+    for row in trans_rows:
+        rows_by_bucket[matching.get_amount_bucket(row[1])][0].append(row)
+    for row in order_rows:
+        rows_by_bucket[matching.get_amount_bucket(row[2])][1].append(row)
+
+    shard = ([], [])
+    last_bucket = None
+    for bucket in sorted(rows_by_bucket):
+        if (last_bucket is not None and
+                bucket - last_bucket > tolerance_cents):
+            if shard[0] and shard[1]:
+                yield sorted(shard[0]), sorted(shard[1])
+            shard = ([], [])
+        shard[0].extend(rows_by_bucket[bucket][0])
+        shard[1].extend(rows_by_bucket[bucket][1])
+        last_bucket = bucket
+    if shard[0] and shard[1]:
+        yield sorted(shard[0]), sorted(shard[1])
+
+
+def get_shard_matches(trans):
+    """Returns the (transaction index, order indexes) of matched trans."""
+    return [(t.idx, [o.idx for o in t.orders]) for t in trans if t.orders]
+
+
+def match_singles_shard(trans_rows, order_rows, max_days_after_shipping,
+                        strategy, tolerance_cents, trace=False):
+    """Returns the shard's matches, and its MatchTrace if trace is True."""
+    trans = [ShardTransaction(*row) for row in trans_rows]
+    orders = [ShardOrder(*row) for row in order_rows]
+    shard_trace = MatchTrace() if trace else None
+    matching.match_singles(
+        trans, orders, max_days_after_shipping, strategy=strategy,
+        tolerance_cents=tolerance_cents, trace=shard_trace)
+    return get_shard_matches(trans), shard_trace
+
+
+def match_combinations_shard(trans_rows, order_rows, max_days_after_shipping,
+                             strategy, cross_order_budget, tolerance_cents,
+                             trace=False):
+    """Returns the shard's matches, and its MatchTrace if trace is True."""
+    trans = [ShardTransaction(*row) for row in trans_rows]
+    orders = [ShardOrder(*row) for row in order_rows]
+    shard_trace = MatchTrace() if trace else None
+    matching.match_combinations(
+        trans, orders, max_days_after_shipping, strategy=strategy,
+        cross_order_budget=cross_order_budget,
+        tolerance_cents=tolerance_cents, trace=shard_trace)
+    return get_shard_matches(trans), shard_trace
+
+
+def apply_shard_matches(trans, orders, shard_result, progress=None,
+                        trace=None):
+    shard_matches, shard_trace = shard_result
+    for t_idx, order_idxs in shard_matches:
+        matching.match(
+            trans[t_idx], [orders[idx] for idx in order_idxs], progress)
+    if trace is not None:
+        trace.merge(shard_trace, trans)
+
+
+def match_orders_and_refunds(trans, orders, refunds, max_days_after_shipping,
+                             progress=None, strategy=matching.OPTIMAL,
+                             cross_order_budget=None,
+                             amount_tolerance_cents=0, max_workers=None,
+                             trace=None):
+    """Matches debits to orders and credits to refunds, concurrently.
+
+    Takes the same options as matching.match_transactions. Uses a pool of
+    max_workers worker processes (None for one per CPU).
+    """
+    sides = [
+        ([t for t in trans if t.amount >= 0], orders),
+        ([t for t in trans if t.amount < 0], refunds),
+    ]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        # First pass, by amount.
+        shards = [
+            (side, shard_trans_rows, shard_order_rows)
+            for side, (side_trans, side_orders) in enumerate(sides)
+            for shard_trans_rows, shard_order_rows in get_amount_shards(
+                get_trans_rows(side_trans), get_order_rows(side_orders),
+                amount_tolerance_cents)]
+        for (side, _, _), shard_result in zip(shards, executor.map(
+                match_singles_shard,
+                [trans_rows for _, trans_rows, _ in shards],
+                [order_rows for _, _, order_rows in shards],
+                itertools.repeat(max_days_after_shipping),
+                itertools.repeat(strategy),
+                itertools.repeat(amount_tolerance_cents),
+                itertools.repeat(trace is not None),
+                chunksize=MATCH_SHARD_CHUNK_SIZE)):
+            apply_shard_matches(*sides[side], shard_result, progress, trace)
+
+        # Second (and third) pass, by sign. Combinations need 2+ orders.
+        sides = [
+            ([t for t in side_trans if not t.orders],
+             [o for o in side_orders if not o.matched])
+            for side_trans, side_orders in sides]
+        sides = [(side_trans, side_orders)
+                 for side_trans, side_orders in sides
+                 if side_trans and len(side_orders) > 1]
+        futures = [
+            executor.submit(
+                match_combinations_shard,
+                get_trans_rows(side_trans), get_order_rows(side_orders),
+                max_days_after_shipping, strategy, cross_order_budget,
+                amount_tolerance_cents, trace is not None)
+            for side_trans, side_orders in sides]
+        for (side_trans, side_orders), future in zip(sides, futures):
+            apply_shard_matches(
+                side_trans, side_orders, future.result(), progress, trace)
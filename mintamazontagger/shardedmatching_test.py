@@ -0,0 +1,53 @@
+import unittest
+
+from mintamazontagger import shardedmatching
+from mintamazontagger.mockdata import order, refund, transaction
+
+
+class ShardedMatchingMethods(unittest.TestCase):
+    def test_get_amount_shards(self):
+        trans_rows = [(0, 10000, None), (1, 20000, None), (2, 50000, None)]
+        order_rows = [(0, '1', 20000, None), (1, '2', 10000, None),
+                      (2, '3', 30000, None)]
+
+        self.assertEqual(
+            list(shardedmatching.get_amount_shards(trans_rows, order_rows)),
+            [([(0, 10000, None)], [(1, '2', 10000, None)]),
+             ([(1, 20000, None)], [(0, '1', 20000, None)])])
+
+    def test_get_amount_shards_within_tolerance(self):
+        trans_rows = [(0, 10000, None), (1, 30000, None)]
+        order_rows = [(0, '1', 20000, None), (1, '2', 40000, None)]
+
+        self.assertEqual(
+            list(shardedmatching.get_amount_shards(
+                trans_rows, order_rows, tolerance_cents=1)),
+            [(trans_rows, order_rows)])
+
+    def test_match_orders_and_refunds(self):
+        o1 = order(order_id='1', shipment_date='02/26/14')
+        o2 = order(order_id='2', shipment_date='02/20/14')
+        o3a = order(order_id='3', subtotal='$5.45', tax_charged='$0.55',
+                    total_charged='$6.00', tracking='A')
+        o3b = order(order_id='3', subtotal='$5.45', tax_charged='$0.50',
+                    total_charged='$5.95', tracking='B')
+        r = refund()
+        t1 = transaction(amount='$11.95', date='2/20/14', id=1)
+        t2 = transaction(amount='$11.95', date='2/27/14', id=2)
+        t3 = transaction(amount='$11.95', date='3/1/14', id=3)
+        t4 = transaction(amount='$11.95', is_debit=False, date='3/16/14',
+                         id=4)
+
+        shardedmatching.match_orders_and_refunds(
+            [t1, t2, t3, t4], [o1, o2, o3a, o3b], [r], 3, max_workers=2)
+
+        self.assertEqual(t1.orders, [o2])
+        self.assertEqual(t2.orders, [o1])
+        self.assertEqual(t3.orders, [o3a, o3b])
+        self.assertEqual(t4.orders, [r])
+        self.assertEqual(o1.trans_id, 2)
+        self.assertEqual(r.trans_id, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,6 @@
 # https://www.amazon.com/gp/b2b/reports
 
 from collections import defaultdict, Counter
-import itertools
 import logging
 
 from progress.bar import IncrementalBar
@@ -17,7 +16,10 @@ import readchar
 
 from mintamazontagger import amazon
 from mintamazontagger import category
+from mintamazontagger import matching
+from mintamazontagger import mergejoin
 from mintamazontagger import mint
+from mintamazontagger import shardedmatching
 from mintamazontagger.currency import micro_usd_nearly_equal
 from mintamazontagger import arg_utils
 
@@ -80,26 +82,87 @@ def get_mint_updates(
         orders, items, refunds,
         trans,
         stats,
-        mint_category_name_to_id=category.DEFAULT_MINT_CATEGORIES_TO_IDS):
+        mint_category_name_to_id=category.DEFAULT_MINT_CATEGORIES_TO_IDS,
+        assignment_cache=None,
+        ledger=None,
+        match_trace=None):
+    """Returns (updates, unmatched orders & refunds).
+
+    Associates items with orders (see associate_items), then matches them
+    (see get_mint_updates_for_orders).
+    """
+    orders, _ = associate_items(orders, items, stats, assignment_cache)
+    return get_mint_updates_for_orders(
+        orders, refunds, trans, stats, mint_category_name_to_id, ledger,
+        match_trace)
+
+
+def associate_items(orders, items, stats, assignment_cache=None):
+    """Associates items with orders; returns (orders, gave up order ids).
+
+    The order ids are those for which item association gave up (see
+    --item_association_budget); their count is also kept in stats. With
+    --streaming_association, orders and items can be any iterables (e.g.
+    Order.iter_from_csv) and the orders returned are new records, in a list:
+    memory is bounded while associating, not for the orders returned.
+    assignment_cache (an assignmentcache.AssignmentCache) memoizes item
+    association across runs.
+    """
+    if args.streaming_association:
+        # Orders and items are sorted by order id (spilling to disk) and
+        # merge-joined, one order id at a time. The orders returned are the
+        # ones read back. Only the sort and the join run in bounded memory:
+        # matching needs every order, so all of them (and their associated
+        # items) are kept. Items dropped by iter_associable_items or not
+        # associated with any order are never kept.
+        associated_orders = []
+        gave_up = []
+        for oid, oid_orders, oid_gave_up in mergejoin.iter_associated_orders(
+                orders, amazon.iter_associable_items(items),
+                budget=args.item_association_budget,
+                assignment_cache=assignment_cache):
+            associated_orders.extend(oid_orders)
+            if oid_gave_up:
+                gave_up.append(oid)
+        orders = associated_orders
+    else:
+        # Filter the items in a single pass, grouping the ones that can be
+        # associated by order id. Items with non-1 quantities are split
+        # across orders (packages) during association.
+        items_by_oid = amazon.group_by_order_id(
+            amazon.iter_associable_items(items))
+
+        itemProgress = IncrementalBar(
+            'Matching Amazon Items with Orders',
+            max=sum([amazon.Item.sum_quantities(oid_items)
+                     for oid_items in items_by_oid.values()]))
+        gave_up = amazon.associate_items_with_orders_by_oid(
+            orders, items_by_oid, itemProgress, args.item_association_budget,
+            args.association_workers or None, assignment_cache)
+        itemProgress.finish()
+    stats['association_gave_up'] = len(gave_up)
+    return orders, gave_up
+
+
+def get_mint_updates_for_orders(
+        orders, refunds,
+        trans,
+        stats,
+        mint_category_name_to_id=category.DEFAULT_MINT_CATEGORIES_TO_IDS,
+        ledger=None,
+        match_trace=None):
+    """Returns (updates, unmatched orders & refunds).
+
+    Items must already be associated with orders (see associate_items).
+    Transactions, orders and refunds in ledger (a ledger.MatchLedger) were
+    tagged by previous runs and are skipped; matched transactions that turn
+    out to be tagged already are added to it. If a matchtrace.MatchTrace is
+    given as match_trace, matching is traced in it.
+    """
     mint_historic_category_renames = get_mint_category_history_for_items(trans)
 
-    # Remove items from canceled orders.
-    items = [i for i in items if not i.is_cancelled()]
-    # Remove items that haven't shipped yet (also aren't charged).
-    items = [i for i in items if i.order_status == 'Shipped']
-    # Remove items with zero quantity (it happens!)
-    items = [i for i in items if i.quantity > 0]
-    # Make more Items such that every item is quantity 1. This is critical
-    # prior to associate_items_with_orders such that items with non-1
-    # quantities split into different packages can be associated with the
-    # appropriate order.
-    items = [si for i in items for si in i.split_by_quantity()]
-
-    itemProgress = IncrementalBar(
-        'Matching Amazon Items with Orders',
-        max=len(items))
-    amazon.associate_items_with_orders(orders, items, itemProgress)
-    itemProgress.finish()
+    if ledger is not None:
+        ledger.index_records(orders + refunds)
 
     # Only match orders that have items.
     orders = [o for o in orders if o.items]
@@ -130,28 +193,51 @@ def get_mint_updates(
             args.mint_input_categories_filter.lower().split(','))
         trans = [t for t in trans if t.category.lower() in cat_whitelist]
 
-    # Match orders.
-    orderMatchProgress = IncrementalBar(
-        'Matching Amazon Orders w/ Mint Trans',
-        max=len(orders))
-    match_transactions(trans, orders, orderMatchProgress)
-    orderMatchProgress.finish()
-
-    unmatched_trans = [t for t in trans if not t.orders]
-
-    # Match refunds.
-    refundMatchProgress = IncrementalBar(
-        'Matching Amazon Refunds w/ Mint Trans',
-        max=len(refunds))
-    match_transactions(unmatched_trans, refunds, refundMatchProgress)
-    refundMatchProgress.finish()
+    if ledger is not None:
+        # Skip what previous runs have already matched and tagged.
+        num_trans = len(trans)
+        trans = [t for t in trans if not ledger.has_transaction(t)]
+        stats['ledgered'] = num_trans - len(trans)
+        orders = [o for o in orders if not ledger.has_record(o)]
+        refunds = [r for r in refunds if not ledger.has_record(r)]
+
+    if args.match_workers != 1:
+        # Match orders and refunds concurrently.
+        matchProgress = IncrementalBar(
+            'Matching Amazon Orders & Refunds w/ Mint Trans',
+            max=len(orders) + len(refunds))
+        shardedmatching.match_orders_and_refunds(
+            trans, orders, refunds, args.max_days_after_shipping,
+            matchProgress, args.match_strategy,
+            args.cross_order_match_budget if args.match_across_orders
+            else None,
+            args.match_amount_tolerance_cents, args.match_workers or None,
+            match_trace)
+        matchProgress.finish()
+    else:
+        # Match orders.
+        orderMatchProgress = IncrementalBar(
+            'Matching Amazon Orders w/ Mint Trans',
+            max=len(orders))
+        match_transactions(trans, orders, orderMatchProgress, match_trace)
+        orderMatchProgress.finish()
+
+        unmatched_trans = [t for t in trans if not t.orders]
+
+        # Match refunds.
+        refundMatchProgress = IncrementalBar(
+            'Matching Amazon Refunds w/ Mint Trans',
+            max=len(refunds))
+        match_transactions(
+            unmatched_trans, refunds, refundMatchProgress, match_trace)
+        refundMatchProgress.finish()
 
     unmatched_orders = [o for o in orders if not o.matched]
     unmatched_trans = [t for t in trans if not t.orders]
     unmatched_refunds = [r for r in refunds if not r.matched]
 
     num_gift_card = len([o for o in unmatched_orders
-                         if 'Gift Certificate' in o.payment_instrument_type])
+                         if o.is_paid_by_gift_card()])
     num_unshipped = len([o for o in unmatched_orders if not o.shipment_date])
 
     matched_orders = [o for o in orders if o.matched]
@@ -179,6 +265,9 @@ def get_mint_updates(
             order = amazon.Order.merge(t.orders)
             merged_orders.extend(orders)
 
+            if order.attribute_charge_diff_to_adjustment(t.amount):
+                stats['amount_adjustment'] += 1
+
             prefix = '{}: '.format(order.website)
             if args.description_prefix_override:
                 prefix = args.description_prefix_override
@@ -204,6 +293,9 @@ def get_mint_updates(
         else:
             refunds = amazon.Refund.merge(t.orders)
             merged_refunds.extend(refunds)
+
+            if amazon.Refund.attribute_refund_diff_to_tax(refunds, t.amount):
+                stats['amount_adjustment'] += 1
             prefix = '{} refund: '.format(refunds[0].website)
 
             if args.description_return_prefix_override:
@@ -240,6 +332,8 @@ def get_mint_updates(
         if mint.Transaction.old_and_new_are_identical(
                 t, new_transactions, ignore_category=args.no_tag_categories):
             stats['already_up_to_date'] += 1
+            if ledger is not None:
+                ledger.add(t)
             continue
 
         valid_prefixes = (
@@ -262,6 +356,8 @@ def get_mint_updates(
                 stats['retag'] += 1
             elif not args.retag_changed:
                 stats['no_retag'] += 1
+                if ledger is not None:
+                    ledger.add(t)
                 continue
             else:
                 stats['retag'] += 1
@@ -275,69 +371,14 @@ def get_mint_updates(
     return updates, unmatched_orders + unmatched_refunds
 
 
-def mark_best_as_matched(t, list_of_orders_or_refunds, progress=None):
-    if not list_of_orders_or_refunds:
-        return
-
-    # Only consider it a match if the posted date (transaction date) is
-    # within `max_days_after_shipping` days of the ship date of the order.
-    closest_match = None
-    closest_match_num_days = 365  # Large number
-    max_days_after_shipping = args.max_days_after_shipping
-
-    for orders in list_of_orders_or_refunds:
-        an_order = next((o for o in orders if o.transact_date()), None)
-        if not an_order:
-            continue
-        num_days = (t.odate - an_order.transact_date()).days
-        # TODO: consider orders even if it has a matched_transaction if this
-        # transaction is closer.
-        already_matched = any([o.matched for o in orders])
-        if (abs(num_days) < max_days_after_shipping + 1 and
-                abs(num_days) < closest_match_num_days and
-                not already_matched):
-            closest_match = orders
-            closest_match_num_days = abs(num_days)
-
-    if closest_match:
-        for o in closest_match:
-            o.match(t)
-        t.match(closest_match)
-        if progress:
-            progress.next(len(closest_match))
-
-
-def match_transactions(unmatched_trans, unmatched_orders, progress=None):
+def match_transactions(unmatched_trans, unmatched_orders, progress=None,
+                       trace=None):
     # Also works with Refund objects.
-    # First pass: Match up transactions that exactly equal an order's charged
-    # amount.
-    amount_to_orders = defaultdict(list)
-
-    for o in unmatched_orders:
-        amount_to_orders[o.transact_amount()].append([o])
-
-    for t in unmatched_trans:
-        mark_best_as_matched(t, amount_to_orders[t.amount], progress)
-
-    unmatched_orders = [o for o in unmatched_orders if not o.matched]
-    unmatched_trans = [t for t in unmatched_trans if not t.orders]
-
-    # Second pass: Match up transactions to a combination of orders (sometimes
-    # they are charged together).
-    oid_to_orders = defaultdict(list)
-    for o in unmatched_orders:
-        oid_to_orders[o.order_id].append(o)
-    amount_to_orders = defaultdict(list)
-    for orders_same_id in oid_to_orders.values():
-        combos = []
-        for r in range(2, len(orders_same_id) + 1):
-            combos.extend(itertools.combinations(orders_same_id, r))
-        for c in combos:
-            orders_total = sum([o.transact_amount() for o in c])
-            amount_to_orders[orders_total].append(c)
-
-    for t in unmatched_trans:
-        mark_best_as_matched(t, amount_to_orders[t.amount], progress)
+    matching.match_transactions(
+        unmatched_trans, unmatched_orders, args.max_days_after_shipping,
+        progress, args.match_strategy,
+        args.cross_order_match_budget if args.match_across_orders else None,
+        args.match_amount_tolerance_cents, trace)
 
 
 def print_dry_run(orig_trans_to_tagged, ignore_category=False):
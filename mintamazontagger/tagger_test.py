@@ -1,13 +1,16 @@
+import argparse
 from collections import Counter
+import random
 import unittest
+from unittest import mock
 
-from mintamazontagger import tagger
+from mintamazontagger import arg_utils
+from mintamazontagger.ledger import MatchLedger
 from mintamazontagger.mockdata import item, order, refund, transaction
 
-
-class Args:
-    def __init__(self, **kwds):
-        self.__dict__.update(kwds)
+# The tagger parses the command line when imported.
+with mock.patch('sys.argv', ['tagger_test']):
+    from mintamazontagger import tagger
 
 
 def get_args(
@@ -22,26 +25,103 @@ def get_args(
         prompt_retag=False,
         num_updates=0,
         retag_changed=False,
-        do_not_predict_categories=True):
-    return Args(
-        description_prefix_override=description_prefix_override,
-        description_return_prefix_override=description_return_prefix_override,
-        amazon_domains=amazon_domains,
-        mint_input_merchant_filter=mint_input_merchant_filter,
-        mint_input_categories_filter=mint_input_categories_filter,
-        verbose_itemize=verbose_itemize,
-        no_itemize=no_itemize,
-        no_tag_categories=no_tag_categories,
-        prompt_retag=prompt_retag,
-        num_updates=num_updates,
-        retag_changed=retag_changed,
-        do_not_predict_categories=do_not_predict_categories,
-    )
+        do_not_predict_categories=True,
+        match_amount_tolerance_cents=0,
+        match_workers=1,
+        item_association_budget=1000000,
+        streaming_association=False):
+    # Any other args are left at their defaults.
+    parser = argparse.ArgumentParser()
+    arg_utils.define_args(parser)
+    args = parser.parse_args([])
+    args.description_prefix_override = description_prefix_override
+    args.description_return_prefix_override = (
+        description_return_prefix_override)
+    args.amazon_domains = amazon_domains
+    args.mint_input_merchant_filter = mint_input_merchant_filter
+    args.mint_input_categories_filter = mint_input_categories_filter
+    args.verbose_itemize = verbose_itemize
+    args.no_itemize = no_itemize
+    args.no_tag_categories = no_tag_categories
+    args.prompt_retag = prompt_retag
+    args.num_updates = num_updates
+    args.retag_changed = retag_changed
+    args.do_not_predict_categories = do_not_predict_categories
+    args.match_amount_tolerance_cents = match_amount_tolerance_cents
+    args.match_workers = match_workers
+    args.item_association_budget = item_association_budget
+    args.streaming_association = streaming_association
+    return args
+
+
+def get_mint_updates(orders, items, refunds, trans, args, stats, **kwargs):
+    tagger.args = args
+    return tagger.get_mint_updates(
+        orders, items, refunds, trans, stats, **kwargs)
+
+
+def get_random_history(seed):
+    """Returns orders, items, refunds & transactions of few amounts & dates."""
+    rand = random.Random(seed)
+    orders, items, refunds, trans = [], [], [], []
+    for n in range(12):
+        oid = str(n)
+        amount = '${}.00'.format(rand.choice([5, 7, 12]))
+        ship_date = '02/{}/14'.format(rand.randint(10, 14))
+        orders.append(order(
+            order_id=oid, subtotal=amount, tax_charged='$0.00',
+            tax_before_promotions='$0.00', total_charged=amount,
+            shipment_date=ship_date, tracking=oid))
+        items.append(item(
+            order_id=oid, title='Item {}'.format(n), item_subtotal=amount,
+            item_subtotal_tax='$0.00', item_total=amount,
+            purchase_price_per_unit=amount, quantity=1,
+            shipment_date=ship_date, tracking=oid))
+        trans.append(transaction(
+            id=n, amount=amount,
+            date='2/{}/14'.format(rand.randint(10, 17))))
+    for n in range(4):
+        amount = '${}.00'.format(rand.choice([3, 4]))
+        refund_date = '3/{}/14'.format(rand.randint(10, 12))
+        refunds.append(refund(
+            order_id=str(n), title='Item {}'.format(n), quantity=1,
+            refund_amount=amount, refund_tax_amount='$0.00',
+            refund_date=refund_date))
+        trans.append(transaction(
+            id=100 + n, amount=amount, is_debit=False, date=refund_date))
+    return orders, items, refunds, trans
 
 
 class Tagger(unittest.TestCase):
+    def test_associate_items_gave_up(self):
+        for streaming_association in (False, True):
+            # The same item shipped in several packages needs a search.
+            items = [
+                item(order_id='A', item_subtotal='$2.00', quantity=1,
+                     tracking='A')
+                for i in range(15)
+            ] + [item(order_id='B')]
+            orders = [
+                order(order_id='A', subtotal='$4.00', tracking='B'),
+                order(order_id='A', subtotal='$12.00', tracking='C'),
+                order(order_id='A', subtotal='$14.00', tracking='D'),
+                order(order_id='B'),
+            ]
+            tagger.args = get_args(
+                item_association_budget=2,
+                streaming_association=streaming_association)
+
+            stats = Counter()
+            orders, gave_up = tagger.associate_items(orders, items, stats)
+
+            self.assertEqual(gave_up, ['A'])
+            self.assertEqual(stats['association_gave_up'], 1)
+            self.assertEqual(
+                [(o.order_id, len(o.items)) for o in orders],
+                [('A', 0), ('A', 0), ('A', 0), ('B', 1)])
+
     def test_get_mint_updates_empty_input(self):
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [], [], [],
             [],
             get_args(), Counter())
@@ -53,7 +133,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction()
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(), stats)
@@ -79,7 +159,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(amount='$11.95', is_debit=False, date='3/12/14')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [], [], [r1],
             [t1],
             get_args(), stats)
@@ -105,7 +185,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(amount='$11.95', is_debit=False, date='3/12/14')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [], [], [r1],
             [t1],
             get_args(), stats)
@@ -113,16 +193,76 @@ class Tagger(unittest.TestCase):
         self.assertEqual(len(updates), 0)
         self.assertEqual(stats['new_tag'], 0)
 
+    def test_get_mint_updates_amount_tolerance(self):
+        i1 = item()
+        o1 = order()
+        t1 = transaction(amount='$11.96')
+
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [o1], [i1], [],
+            [t1],
+            get_args(match_amount_tolerance_cents=1), stats)
+
+        self.assertEqual(len(updates), 1)
+        orig_t, new_trans = updates[0]
+        self.assertTrue(orig_t is t1)
+        self.assertEqual(len(new_trans), 2)
+        self.assertEqual(
+            new_trans[0].merchant,
+            'Amazon.com: Charge adjustment (rounding, etc)')
+        self.assertEqual(new_trans[0].amount, 10000)
+        self.assertEqual(new_trans[1].merchant, 'Amazon.com: 2x Duracell AAs')
+        self.assertEqual(new_trans[1].amount, 11950000)
+        self.assertEqual(stats['amount_adjustment'], 1)
+
+    def test_get_mint_updates_amount_tolerance_refund(self):
+        r1 = refund(
+            title='Cool item',
+            refund_amount='$10.95',
+            refund_tax_amount='$1.00',
+            refund_date='3/12/14')
+        t1 = transaction(amount='$11.94', is_debit=False, date='3/12/14')
+
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [], [], [r1],
+            [t1],
+            get_args(match_amount_tolerance_cents=1), stats)
+
+        self.assertEqual(len(updates), 1)
+        orig_t, new_trans = updates[0]
+        self.assertEqual(len(new_trans), 1)
+        self.assertEqual(new_trans[0].merchant, 'Amazon.com: 2x Cool item')
+        self.assertEqual(new_trans[0].amount, -11940000)
+        self.assertEqual(r1.refund_tax_amount, 990000)
+        self.assertEqual(stats['amount_adjustment'], 1)
+
+    def test_get_mint_updates_amount_tolerance_exceeded(self):
+        i1 = item()
+        o1 = order()
+        t1 = transaction(amount='$11.97')
+
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [o1], [i1], [],
+            [t1],
+            get_args(match_amount_tolerance_cents=1), stats)
+
+        self.assertEqual(len(updates), 0)
+
     def test_get_mint_updates_skip_already_tagged(self):
         i1 = item()
         o1 = order()
         t1 = transaction(merchant='SomeRandoCustomPrefix: already tagged')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
-            get_args(description_prefix_override='SomeRandoCustomPrefix: '),
+            get_args(
+                description_prefix_override='SomeRandoCustomPrefix: ',
+                mint_input_merchant_filter='amazon,somerandocustomprefix'),
             stats)
 
         self.assertEqual(len(updates), 0)
@@ -134,7 +274,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(merchant='Amazon.com: already tagged')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(retag_changed=True), stats)
@@ -148,7 +288,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(merchant='Amazon.co.uk: already tagged')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(), stats)
@@ -164,7 +304,7 @@ class Tagger(unittest.TestCase):
             note=o1.get_note() + '\nItem(s):\n - 2x Duracell AAs')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(retag_changed=True), stats)
@@ -180,7 +320,7 @@ class Tagger(unittest.TestCase):
             note=o1.get_note() + '\nItem(s):\n - 2x Duracell AAs')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(no_tag_categories=True), stats)
@@ -188,13 +328,97 @@ class Tagger(unittest.TestCase):
         self.assertEqual(len(updates), 0)
         self.assertEqual(stats['already_up_to_date'], 1)
 
+    def test_get_mint_updates_ledger_skips_tagged(self):
+        match_ledger = MatchLedger()
+        updates, _ = get_mint_updates(
+            [order()], [item()], [],
+            [transaction()],
+            get_args(), Counter(), ledger=match_ledger)
+        self.assertEqual(len(updates), 1)
+        match_ledger.add_updates(updates)
+
+        # A rerun skips the tagged transaction and order...
+        stats = Counter()
+        updates, unmatched = get_mint_updates(
+            [order()], [item()], [],
+            [transaction()],
+            get_args(), stats, ledger=match_ledger)
+
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(unmatched, [])
+        self.assertEqual(stats['ledgered'], 1)
+
+        # ... so the order is not matched to another transaction.
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [order()], [item()], [],
+            [transaction(id=2)],
+            get_args(), stats, ledger=match_ledger)
+
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(stats['trans_unmatch'], 1)
+
+    def test_get_mint_updates_ledger_all_tagged_no_trans(self):
+        # With everything tagged already, no Mint transactions are fetched.
+        match_ledger = MatchLedger()
+        updates, _ = get_mint_updates(
+            [order()], [item()], [],
+            [transaction()],
+            get_args(), Counter(), ledger=match_ledger)
+        match_ledger.add_updates(updates)
+
+        stats = Counter()
+        updates, unmatched = get_mint_updates(
+            [order()], [item()], [], [],
+            get_args(), stats, ledger=match_ledger)
+
+        self.assertEqual(updates, [])
+        self.assertEqual(unmatched, [])
+        self.assertEqual(stats['trans'], 0)
+
+    def test_get_mint_updates_ledger_adds_up_to_date(self):
+        i1 = item()
+        o1 = order()
+        t1 = transaction(
+            merchant='Amazon.com: 2x Duracell AAs',
+            note=o1.get_note() + '\nItem(s):\n - 2x Duracell AAs')
+        match_ledger = MatchLedger()
+
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [o1], [i1], [],
+            [t1],
+            get_args(no_tag_categories=True), stats, ledger=match_ledger)
+
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(stats['already_up_to_date'], 1)
+        self.assertTrue(match_ledger.has_transaction(t1))
+        self.assertTrue(match_ledger.has_record(order()))
+
+    def test_get_mint_updates_ledger_adds_no_retag(self):
+        i1 = item()
+        o1 = order()
+        t1 = transaction(merchant='Amazon.co.uk: already tagged')
+        match_ledger = MatchLedger()
+
+        stats = Counter()
+        updates, _ = get_mint_updates(
+            [o1], [i1], [],
+            [t1],
+            get_args(), stats, ledger=match_ledger)
+
+        self.assertEqual(len(updates), 0)
+        self.assertEqual(stats['no_retag'], 1)
+        self.assertTrue(match_ledger.has_transaction(t1))
+        self.assertTrue(match_ledger.has_record(order()))
+
     def test_get_mint_updates_verbose_itemize_arg(self):
         i1 = item()
         o1 = order(shipping_charge='$3.99', total_promotions='$3.99')
         t1 = transaction()
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(verbose_itemize=True), stats)
@@ -222,7 +446,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(amount='$15.94')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1], [],
             [t1],
             get_args(no_itemize=True), stats)
@@ -255,7 +479,7 @@ class Tagger(unittest.TestCase):
         t1 = transaction(amount='$17.00')
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1], [i1, i2], [],
             [t1],
             get_args(no_itemize=True), stats)
@@ -269,6 +493,21 @@ class Tagger(unittest.TestCase):
         self.assertEqual(new_trans[0].category, 'Shopping')
         self.assertEqual(new_trans[0].amount, 17000000)
 
+    def test_get_mint_updates_match_workers(self):
+        def get_results(seed, match_workers):
+            updates, unmatched = get_mint_updates(
+                *get_random_history(seed),
+                get_args(match_workers=match_workers), Counter())
+            return (
+                [(t.id, [(nt.merchant, nt.amount) for nt in new_trans])
+                 for t, new_trans in updates],
+                sorted((r.order_id, r.is_debit) for r in unmatched))
+
+        for seed in range(3):
+            serial = get_results(seed, 1)
+            self.assertTrue(serial[0])
+            self.assertEqual(get_results(seed, 2), serial)
+
     def test_get_mint_updates_multi_orders_trans_same_date_and_amount(self):
         i1 = item(order_id='A')
         o1 = order(order_id='A')
@@ -278,14 +517,14 @@ class Tagger(unittest.TestCase):
         t2 = transaction()
 
         stats = Counter()
-        updates, _ = tagger.get_mint_updates(
+        updates, _ = get_mint_updates(
             [o1, o2], [i1, i2], [],
             [t1, t2],
             get_args(), stats)
 
         self.assertEqual(len(updates), 2)
 
-        updates2, _ = tagger.get_mint_updates(
+        updates2, _ = get_mint_updates(
             [o1, o2], [i1, i2], [],
             [t1, t2],
             get_args(num_updates=1), stats)